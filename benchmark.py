@@ -0,0 +1,403 @@
+"""
+Benchmark fuera de línea de Chokolo Bot.
+
+Genera catálogos sintéticos (de 1k a 500k productos repartidos en varios
+grupos), ejecuta los handlers con Update/Context falsos y un bot que no se
+conecta a Telegram, y reporta latencias (p50/p90/p99), throughput y memoria
+pico por operación en JSON.
+
+Uso:
+    python benchmark.py --tamanos 1000,10000,100000 --salida resultados.json
+    python benchmark.py --base resultados.json --tolerancia 0.25
+
+Con --base compara contra un resultado anterior y termina con código 1 si
+alguna operación empeoró más que la tolerancia.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+# =============================================
+# CONFIGURACIÓN DEL ENTORNO
+# =============================================
+# chokolo_bot lee el token y la carpeta de datos al importarse: se apuntan a
+# un directorio temporal para no tocar la base de datos real.
+DIRECTORIO_TEMPORAL = tempfile.mkdtemp(prefix="chokolo_bench_")
+os.environ['HOME'] = DIRECTORIO_TEMPORAL
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+
+MARCAS = [
+    "Nike Air Force", "Jordan", "New Balance", "Adidas Samba", "Yeezy Boost",
+    "Puma Suede", "Asics Gel", "Converse Chuck", "Vans Old Skool", "Reebok Club"
+]
+VARIANTES = ["Retro", "Low", "High", "OG", "SE", "Premium", "Triple White", "Panda"]
+TALLAS = [f"{t / 2:.1f}" for t in range(14, 27)]   # 7.0 ... 13.0
+
+OPERACIONES = ['cargar_db', 'price', 'size', 'buscar_producto',
+               'registrar_producto', 'eliminar_producto', 'guardar_db']
+METRICAS_COMPARADAS = ('p50_ms', 'p99_ms')
+# Diferencias absolutas por debajo de esto son ruido, no regresiones
+MINIMO_ABSOLUTO = {'p50_ms': 0.5, 'p99_ms': 0.5, 'memoria_pico_kb': 64}
+
+# =============================================
+# TELEGRAM FALSO
+# =============================================
+class BotFalso:
+    """Responde al instante a lo que usan los handlers (sin red)"""
+
+    def __init__(self, admins=(1,)):
+        self.admins = [SimpleNamespace(user=SimpleNamespace(id=a)) for a in admins]
+        self.llamadas = 0
+
+    async def _responder(self, **kwargs):
+        self.llamadas += 1
+        return SimpleNamespace(message_id=self.llamadas)
+
+    send_message = send_photo = _responder
+
+    async def send_media_group(self, **kwargs):
+        self.llamadas += 1
+        return [SimpleNamespace(message_id=self.llamadas) for _ in kwargs['media']]
+
+    async def get_chat_administrators(self, chat_id):
+        return self.admins
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(download_as_bytearray=lambda: self._descargar(file_id))
+
+    async def _descargar(self, file_id):
+        """Miniatura distinta por file_id (ruido determinista de 90x90 en PNG)"""
+        from PIL import Image
+        imagen = Image.frombytes('L', (90, 90), random.Random(file_id).randbytes(90 * 90))
+        salida = io.BytesIO()
+        imagen.save(salida, 'PNG')
+        return bytearray(salida.getvalue())
+
+def crear_update(bot, chat_id, user_id=1, caption=None, foto=None):
+    bot.llamadas += 1
+    mensaje = SimpleNamespace(
+        message_id=bot.llamadas,
+        caption=caption,
+        photo=[SimpleNamespace(file_id=foto)] if foto else [],
+        media_group_id=None,
+        reply_to_message=None,
+        reply_text=bot._responder
+    )
+    return SimpleNamespace(
+        message=mensaje,
+        effective_message=mensaje,
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=user_id, first_name="Bench"),
+        get_bot=lambda: bot
+    )
+
+def crear_contexto(bot, args=None):
+    return SimpleNamespace(bot=bot, args=args or [])
+
+# =============================================
+# CATÁLOGOS SINTÉTICOS
+# =============================================
+def generar_productos(total, grupos, azar):
+    """{producto_id: producto} con `total` tallas repartidas en `grupos` chats"""
+    productos = {}
+    i = 0
+    while len(productos) < total:
+        modelo = f"{azar.choice(MARCAS)} {i} {azar.choice(VARIANTES)}"
+        chat_id = grupos[i % len(grupos)]
+        precio = f"${azar.randint(60, 400)}"
+        for talla in sorted(azar.sample(TALLAS, azar.randint(1, 6)), key=float):
+            productos[f"{modelo.lower()}_{talla}"] = {
+                'modelo': modelo,
+                'talla': talla,
+                'precio': precio,
+                'foto': f"AgACAgEAAxkBAAI{i:08d}",
+                'chat_id': chat_id,
+                'msg_id': i,
+                'user_id': 1
+            }
+            if len(productos) == total:
+                break
+        i += 1
+    return productos
+
+def preparar_datos(cb, productos):
+    """Escribe el catálogo sintético donde cargar_db() lo busca"""
+    for ruta in (cb.DB_FILE, cb.DB_BIN_FILE, cb.JOURNAL_FILE, cb.JOURNAL_FILE + ".old",
+                 cb.SQLITE_FILE, cb.SQLITE_FILE + "-wal", cb.SQLITE_FILE + "-shm"):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+    instantanea = cb.CatalogoProductos.desde_instantanea(productos).instantanea()
+    with open(cb.DB_FILE, 'w', encoding='utf-8') as f:
+        json.dump(instantanea, f, ensure_ascii=False, separators=(',', ':'))
+
+def instalar_catalogo(cb, catalogo):
+    """Reemplaza el catálogo global del bot con sus observadores y cachés"""
+    cb.catalogo = catalogo
+    cb.respaldos = cb.SistemaRespaldos(cb.BACKUP_DIR)
+    cb.cache_respuestas = cb.CacheRespuestas()
+    cb.indice_fotos = cb.IndiceFotos()
+    cb.api_catalogo = cb.ApiCatalogo()
+    catalogo.suscribir(cb.respaldos.anotar)
+    catalogo.suscribir(cb.cache_respuestas.anotar)
+    catalogo.suscribir(cb.indice_fotos.anotar)
+    catalogo.suscribir(cb.api_catalogo.anotar)
+    cb.indice_fotos.construir()   # Como al arrancar el bot (fuera de lo medido)
+
+# =============================================
+# MEDICIÓN
+# =============================================
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    k = (len(ordenados) - 1) * p / 100
+    inferior = int(k)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (k - inferior)
+
+def resumir(latencias, memoria_pico):
+    ordenados = sorted(latencias)
+    total = sum(ordenados)
+    return {
+        'n': len(ordenados),
+        'media_ms': round(statistics.fmean(ordenados) * 1000, 4),
+        'p50_ms': round(percentil(ordenados, 50) * 1000, 4),
+        'p90_ms': round(percentil(ordenados, 90) * 1000, 4),
+        'p99_ms': round(percentil(ordenados, 99) * 1000, 4),
+        'max_ms': round(ordenados[-1] * 1000, 4),
+        'ops_por_segundo': round(len(ordenados) / total, 2) if total else None,
+        'memoria_pico_kb': round(memoria_pico / 1024, 1)
+    }
+
+async def medir(operacion, repeticiones, muestras_memoria, despues=None):
+    """Ejecuta operacion(i) (sync o async) y mide latencia y memoria pico.
+
+    La memoria se mide en una pasada aparte con tracemalloc (que es lento)
+    para no contaminar las latencias.
+    """
+    async def ejecutar(i):
+        resultado = operacion(i)
+        if asyncio.iscoroutine(resultado):
+            await resultado
+        if despues is not None:
+            await despues()
+
+    latencias = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        await ejecutar(i)
+        latencias.append(time.perf_counter() - inicio)
+
+    memoria_pico = 0
+    tracemalloc.start()
+    try:
+        for i in range(repeticiones, repeticiones + muestras_memoria):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            await ejecutar(i)
+            memoria_pico = max(memoria_pico, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return resumir(latencias, memoria_pico)
+
+# =============================================
+# ESCENARIOS
+# =============================================
+async def medir_tamano(cb, total, grupos, repeticiones, muestras_memoria, azar):
+    productos = generar_productos(total, grupos, azar)
+    preparar_datos(cb, productos)
+    bot = BotFalso()
+    resultados = {}
+
+    async def vaciar_cola():
+        await cb.cola_salida.vaciar(timeout=30)
+
+    # Carga desde disco (se usa el último catálogo cargado)
+    cargados = []
+    def cargar(_):
+        cargados.append(cb.cargar_db())
+    resultados['cargar_db'] = await medir(cargar, max(3, repeticiones // 20), 1)
+    instalar_catalogo(cb, cargados[-1])
+    cb.cache_admins = cb.CacheAdministradores()
+
+    existentes = list(productos.values())
+    azar.shuffle(existentes)
+
+    # Lecturas: /price y /size (cada grupo frío una vez, luego desde caché)
+    for comando, handler in (('price', cb.price), ('size', cb.size)):
+        resultados[comando] = await medir(
+            lambda i, handler=handler: handler(crear_update(bot, grupos[i % len(grupos)]), crear_contexto(bot)),
+            repeticiones, muestras_memoria, vaciar_cola
+        )
+
+    # /buscar con marca + número de un modelo existente
+    def buscar(i):
+        producto = existentes[i % len(existentes)]
+        palabras = producto['modelo'].split()
+        return cb.buscar_producto(
+            crear_update(bot, producto['chat_id']),
+            crear_contexto(bot, palabras[:2] + [palabras[-2]])
+        )
+    resultados['buscar_producto'] = await medir(buscar, repeticiones, muestras_memoria, vaciar_cola)
+
+    # Registro de un modelo nuevo por foto (la escritura a disco queda programada, sin fsync)
+    def registrar(i):
+        tallas = ' / '.join(sorted(azar.sample(TALLAS, 3), key=float))
+        caption = f"Bench Nuevo {total}-{i}\nTalla {tallas} - ${azar.randint(60, 400)}"
+        return cb.registrar_producto(
+            crear_update(bot, grupos[i % len(grupos)], caption=caption, foto=f"bench_{i}"),
+            crear_contexto(bot)
+        )
+    resultados['registrar_producto'] = await medir(registrar, repeticiones, muestras_memoria, vaciar_cola)
+
+    # /eliminar de productos existentes (sin repetir)
+    def eliminar(i):
+        producto = existentes[i % len(existentes)]
+        return cb.eliminar_producto(
+            crear_update(bot, producto['chat_id']),
+            crear_contexto(bot, producto['modelo'].split() + [producto['talla']])
+        )
+    resultados['eliminar_producto'] = await medir(eliminar, repeticiones, muestras_memoria, vaciar_cola)
+
+    # guardar_db tras 10 cambios pendientes
+    def guardar(i):
+        for j in range(10):
+            producto = dict(existentes[(i * 10 + j) % len(existentes)], precio=f"${i}")
+            cb.catalogo.registrar(f"{producto['modelo'].lower()}_{producto['talla']}", producto)
+        cb.guardar_db(forzar=True)
+    resultados['guardar_db'] = await medir(guardar, repeticiones, muestras_memoria)
+
+    await cb.persistencia.flush(forzar=True)
+    cb.catalogo.cerrar()
+    return resultados
+
+async def ejecutar(cb, tamanos, num_grupos, repeticiones, muestras_memoria, semilla):
+    grupos = [-1009000000000 - i for i in range(num_grupos)]
+    cb.GRUPOS_AUTORIZADOS[:] = grupos
+    # Sin límites de envío: se mide el bot, no los tiempos de espera de Telegram
+    cb.TASA_GLOBAL = cb.TASA_POR_CHAT = cb.RAFAGA_POR_CHAT = 1e9
+    cb.cola_salida = cb.ColaSalida()
+
+    resultados = {}
+    for total in tamanos:
+        print(f"▶️ {total} productos en {num_grupos} grupos...", file=sys.stderr)
+        resultados[str(total)] = await medir_tamano(
+            cb, total, grupos, repeticiones, muestras_memoria, random.Random(semilla + total)
+        )
+        imprimir_tabla(total, resultados[str(total)])
+    return resultados
+
+# =============================================
+# REPORTES Y COMPARACIÓN
+# =============================================
+def imprimir_tabla(total, resultados):
+    print(f"\n📊 {total} productos", file=sys.stderr)
+    print(f"{'operación':<20}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'mem KB':>10}", file=sys.stderr)
+    for operacion in OPERACIONES:
+        r = resultados[operacion]
+        print(
+            f"{operacion:<20}{r['p50_ms']:>10.3f}{r['p90_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+            f"{r['ops_por_segundo'] or 0:>12.1f}{r['memoria_pico_kb']:>10.1f}",
+            file=sys.stderr
+        )
+
+def comparar(actual, base, tolerancia):
+    """Lista de regresiones: métricas que crecieron más que la tolerancia"""
+    regresiones = []
+    for total, operaciones in actual['resultados'].items():
+        for operacion, metricas in operaciones.items():
+            anterior = base.get('resultados', {}).get(total, {}).get(operacion)
+            if anterior is None:
+                continue
+            for metrica in METRICAS_COMPARADAS + ('memoria_pico_kb',):
+                antes, ahora = anterior.get(metrica), metricas.get(metrica)
+                if not (antes and ahora) or ahora - antes < MINIMO_ABSOLUTO[metrica]:
+                    continue
+                if ahora > antes * (1 + tolerancia):
+                    regresiones.append({
+                        'tamano': int(total),
+                        'operacion': operacion,
+                        'metrica': metrica,
+                        'base': antes,
+                        'actual': ahora,
+                        'cambio': round(ahora / antes - 1, 3)
+                    })
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fuera de línea de Chokolo Bot")
+    parser.add_argument('--tamanos', default="1000,10000,100000",
+                        help="Cantidades de productos separadas por coma (ej: 1000,10000,500000)")
+    parser.add_argument('--grupos', type=int, default=20, help="Cantidad de grupos (chat_id) sintéticos")
+    parser.add_argument('--repeticiones', type=int, default=200, help="Ejecuciones por operación")
+    parser.add_argument('--muestras-memoria', type=int, default=5,
+                        help="Ejecuciones extra bajo tracemalloc para la memoria pico")
+    parser.add_argument('--almacen', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--semilla', type=int, default=1234)
+    parser.add_argument('--salida', help="Archivo JSON de resultados (por defecto a stdout)")
+    parser.add_argument('--base', help="Resultado anterior contra el cual comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help="Aumento relativo permitido antes de marcar regresión (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    os.environ['ALMACEN_DB'] = args.almacen
+    import chokolo_bot as cb
+    logging.getLogger().setLevel(logging.WARNING)
+
+    tamanos = [int(t) for t in args.tamanos.split(',')]
+    resultados = asyncio.run(ejecutar(
+        cb, tamanos, args.grupos, args.repeticiones, args.muestras_memoria, args.semilla
+    ))
+    cb.persistencia._executor.shutdown(wait=True)
+
+    salida = {
+        'meta': {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'almacen': args.almacen,
+            'grupos': args.grupos,
+            'repeticiones': args.repeticiones,
+            'semilla': args.semilla
+        },
+        'resultados': resultados
+    }
+
+    codigo = 0
+    if args.base:
+        with open(args.base, 'r', encoding='utf-8') as f:
+            regresiones = comparar(salida, json.load(f), args.tolerancia)
+        salida['regresiones'] = regresiones
+        for r in regresiones:
+            print(
+                f"❌ Regresión {r['operacion']} ({r['tamano']}): {r['metrica']} "
+                f"{r['base']} -> {r['actual']} (+{r['cambio']:.0%})",
+                file=sys.stderr
+            )
+        if regresiones:
+            codigo = 1
+        else:
+            print("✅ Sin regresiones respecto a la base", file=sys.stderr)
+
+    texto = json.dumps(salida, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+    sys.exit(codigo)
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,174 @@
+import time
+INICIO_ARRANQUE = time.perf_counter()  # Para reportar el tiempo de arranque en los logs
+
 import logging
 import re
 import json
 import os
 import shutil
-from datetime import datetime
-from telegram import Update
+import tempfile
+import sys
+import bisect
+from array import array
+import functools
+import unicodedata
+import threading
+import marshal
+import multiprocessing
+import signal
+import contextlib
+import sqlite3
+import gzip
+import base64
+import binascii
+import io
+import hashlib
+import math
+import argparse
+import hmac
+import secrets
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from telegram import (
+    Update,
+    ChatMember,
+    InputMediaPhoto,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup
+)
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
+    BaseUpdateProcessor,
     ContextTypes,
     MessageHandler,
     CommandHandler,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    JobQueue,
+    TypeHandler,
     filters
 )
-from dotenv import load_dotenv
-from flask import Flask, request, jsonify  # Nuevas importaciones
 
 # =============================================
 # CONFIGURACIÓN DE FLASK
 # =============================================
-flask_app = Flask(__name__)  # Cambiado de 'app' a 'flask_app'
+# Flask se importa recién al crear la app (en el hilo del servidor o al
+# levantar el webhook): no retrasa la carga del catálogo ni el arranque del bot.
+flask_app = None
+
+# En modo webhook: (Application de Telegram, event loop en el que corre)
+receptor_webhook = None
+
+def crear_flask_app():
+    """Crea (una sola vez) la app de Flask con sus rutas"""
+    global flask_app
+    if flask_app is not None:
+        return flask_app
+    from flask import Flask, Response, request, jsonify
+
+    flask_app = Flask(__name__)  # Cambiado de 'app' a 'flask_app'
+
+    @flask_app.route('/')
+    def home():
+        return jsonify({"status": "ok", "message": "Coes Sneakers Bot is running"})
+
+    @flask_app.route('/webhook', methods=['POST'])
+    def webhook():
+        """Valida el secret token y entrega el update a la cola de la Application"""
+        if receptor_webhook is None:
+            return jsonify({"status": "error", "message": "Webhook deshabilitado (modo polling)"}), 503
+
+        secreto = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(secreto, WEBHOOK_SECRET):
+            return jsonify({"status": "error", "message": "Token secreto inválido"}), 403
+
+        datos = request.get_json(silent=True)
+        if not isinstance(datos, dict):
+            return jsonify({"status": "error", "message": "Update inválido"}), 400
+
+        app, loop = receptor_webhook
+        update = Update.de_json(datos, app.bot)
+        # La vista corre en un hilo del servidor: la cola se alimenta desde el loop del bot
+        loop.call_soon_threadsafe(app.update_queue.put_nowait, update)
+        return jsonify({"status": "ok"})
+
+    @flask_app.route('/metrics')
+    def metrics():
+        """Métricas del bot en formato de texto de Prometheus"""
+        return Response(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def error_api(ruta, estado, mensaje):
+        metricas.incrementar('chokolo_api_respuestas_total', ruta=ruta, codigo=str(estado))
+        return jsonify({"status": "error", "message": mensaje}), estado
+
+    def responder_api(ruta, instantanea, clave, generar):
+        """Respuesta guardada en la instantánea: 304 si el cliente ya la tiene, gzip si lo acepta"""
+        cuerpo, etag, comprimido = instantanea.respuesta(clave, generar)
+        usar_gzip = comprimido is not None and request.accept_encodings['gzip'] > 0
+        if usar_gzip:
+            etag += '-gz'  # ETag fuerte: distinto por codificación
+        if request.if_none_match.contains(etag):
+            respuesta = Response(status=304)
+        else:
+            respuesta = Response(comprimido if usar_gzip else cuerpo, content_type='application/json; charset=utf-8')
+            if usar_gzip:
+                respuesta.headers['Content-Encoding'] = 'gzip'
+        respuesta.set_etag(etag)
+        respuesta.headers['Cache-Control'] = 'no-cache'  # Siempre revalidar (barato con 304)
+        respuesta.headers['Vary'] = 'Accept-Encoding'
+        metricas.incrementar('chokolo_api_respuestas_total', ruta=ruta, codigo=str(respuesta.status_code))
+        return respuesta
+
+    def limite_api():
+        limite = request.args.get('limit', API_LIMITE_PAGINA, type=int)
+        return max(1, min(limite, API_LIMITE_MAXIMO))
+
+    @flask_app.route('/catalog/<int(signed=True):chat_id>')
+    def catalogo_grupo(chat_id):
+        """Modelos del grupo por páginas (?limit=, ?cursor= de la respuesta anterior)"""
+        if chat_id not in GRUPOS_AUTORIZADOS:
+            return error_api('grupo', 404, "Grupo no encontrado")
+        cursor = request.args.get('cursor')
+        try:
+            desde = decodificar_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return error_api('grupo', 400, str(e))
+        limite = limite_api()
+        instantanea = api_catalogo.instantanea(chat_id)
+        return responder_api(
+            'grupo', instantanea, ('pagina', desde, limite), lambda: instantanea.pagina(desde, limite)
+        )
 
-@flask_app.route('/')
-def home():
-    return jsonify({"status": "ok", "message": "Coes Sneakers Bot is running"})
+    @flask_app.route('/catalog/search')
+    def catalogo_busqueda():
+        """Búsqueda con el mismo texto y filtros que /buscar (?chat_id=, ?q=, ?limit=, ?cursor=)"""
+        chat_id = request.args.get('chat_id', type=int)
+        consulta = request.args.get('q', '').strip()
+        if chat_id not in GRUPOS_AUTORIZADOS:
+            return error_api('busqueda', 404, "Grupo no encontrado")
+        if not consulta:
+            return error_api('busqueda', 400, "Falta el parámetro q")
+        cursor = request.args.get('cursor')
+        try:
+            desde = int(decodificar_cursor(cursor)) if cursor else 0
+        except ValueError as e:
+            return error_api('busqueda', 400, str(e))
+        limite = limite_api()
+        instantanea = api_catalogo.instantanea(chat_id)
+        return responder_api(
+            'busqueda', instantanea, ('busqueda', consulta.lower(), desde, limite),
+            lambda: instantanea.buscar(consulta.lower(), desde, limite)
+        )
 
-@flask_app.route('/webhook', methods=['POST'])
-def webhook():
-    return jsonify({"status": "ok"})
+    return flask_app
 
 def run_flask():
     port = int(os.environ.get('PORT', 5000))
-    flask_app.run(host='0.0.0.0', port=port)
+    crear_flask_app().run(host='0.0.0.0', port=port)
 
 # =============================================
 # CONFIGURACIÓN BÁSICA DEL BOT
@@ -42,11 +180,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno desde .env
-load_dotenv()
+# Cargar variables de entorno desde .env (dotenv solo se importa si hay uno;
+# en Render las variables vienen del entorno)
+def buscar_archivo_env():
+    """Como find_dotenv(): .env en la carpeta del script o en alguna superior"""
+    carpeta = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        if os.path.isfile(os.path.join(carpeta, '.env')):
+            return os.path.join(carpeta, '.env')
+        superior = os.path.dirname(carpeta)
+        if superior == carpeta:
+            return None
+        carpeta = superior
+
+if buscar_archivo_env():
+    from dotenv import load_dotenv
+    load_dotenv(buscar_archivo_env())
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 SITIO_WEB = "https://coesneakers.com/"
 
+# Modo webhook: URL pública del servicio (en Render, RENDER_EXTERNAL_URL).
+# Sin URL el bot usa long polling como siempre.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# URL de la Bot API (se puede apuntar a un servidor falso para pruebas locales)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL', TELEGRAM_API_URL.rsplit('/bot', 1)[0] + '/file/bot')
+
+# Procesos worker: con WORKERS > 1 un proceso recibe los updates y los reparte
+# por chat_id entre N workers que comparten el catálogo en SQLite.
+WORKERS = int(os.getenv('WORKERS', '1'))
+
 # Configuración robusta de rutas (evita OneDrive)
 BASE_DIR = os.path.expanduser("~")  # Carpeta de usuario
 DATA_DIR = os.path.join(BASE_DIR, "coes_bot_data")  # Nueva ubicación
@@ -75,53 +240,1862 @@ if not TOKEN:
 logger.info(f"Directorio de datos: {DATA_DIR}")
 logger.info(f"Archivo de base de datos: {DB_FILE}")
 
+# =============================================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# =============================================
+# Expuestas en GET /metrics. Se escriben desde el loop del bot y desde el
+# hilo de persistencia, y se leen desde el hilo de Flask: todo pasa por un lock.
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escapar_etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas_texto(etiquetas):
+    """(('chat_id', 1), ('le', 0.5)) -> '{chat_id="1",le="0.5"}'"""
+    if not etiquetas:
+        return ""
+    return "{" + ','.join(f'{clave}="{_escapar_etiqueta(valor)}"' for clave, valor in etiquetas) + "}"
+
+class Metricas:
+    """Registro mínimo de contadores e histogramas + valores calculados al exportar.
+
+    Con WORKERS > 1 cada worker manda periódicamente su instantanea() al
+    front, que la guarda con recibir() y la suma a sus propios valores en
+    exportar(): /metrics muestra el total de todos los procesos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tipos = {}          # nombre -> (tipo, ayuda)
+        self._valores = {}        # nombre -> {etiquetas: valor}
+        self._histogramas = {}    # nombre -> {etiquetas: [conteos por bucket, suma, total]}
+        self._buckets = {}        # nombre -> límites del histograma
+        self._funciones = {}      # nombre -> función que retorna {etiquetas: valor}
+        self._por_proceso = set()  # Calculadas que se suman entre procesos
+        self._otros = {}          # origen (worker) -> última instantánea recibida
+
+    def contador(self, nombre, ayuda):
+        self._tipos[nombre] = ('counter', ayuda)
+        self._valores[nombre] = {}
+
+    def histograma(self, nombre, ayuda, buckets=BUCKETS_LATENCIA):
+        self._tipos[nombre] = ('histogram', ayuda)
+        self._histogramas[nombre] = {}
+        self._buckets[nombre] = buckets
+
+    def calculada(self, nombre, tipo, ayuda, funcion, por_proceso=True):
+        """Valor leído al exportar: funcion() -> {(('etiqueta', valor), ...): número}.
+
+        por_proceso=False para valores que cualquier proceso calcula igual
+        (p. ej. desde la base compartida): no se suman los de los workers.
+        """
+        self._tipos[nombre] = (tipo, ayuda)
+        self._funciones[nombre] = funcion
+        if por_proceso:
+            self._por_proceso.add(nombre)
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            serie = self._valores[nombre]
+            serie[clave] = serie.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        buckets = self._buckets[nombre]
+        with self._lock:
+            serie = self._histogramas[nombre].get(clave)
+            if serie is None:
+                serie = self._histogramas[nombre][clave] = [[0] * len(buckets), 0.0, 0]
+            indice = bisect.bisect_left(buckets, valor)
+            if indice < len(buckets):
+                serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _calcular(self, nombre):
+        try:
+            return dict(self._funciones[nombre]())
+        except Exception as e:
+            logger.error(f"Error calculando métrica {nombre}: {e}")
+            return None
+
+    def instantanea(self):
+        """Valores propios, para mandarlos a otro proceso (de un worker al front)"""
+        with self._lock:
+            valores = {nombre: dict(serie) for nombre, serie in self._valores.items()}
+            histogramas = {
+                nombre: {e: [list(c), s, t] for e, (c, s, t) in series.items()}
+                for nombre, series in self._histogramas.items()
+            }
+        calculadas = {nombre: self._calcular(nombre) or {} for nombre in self._por_proceso}
+        return {'valores': valores, 'histogramas': histogramas, 'calculadas': calculadas}
+
+    def recibir(self, origen, instantanea):
+        """Guarda la última instantánea de otro proceso (reemplaza la anterior)"""
+        with self._lock:
+            self._otros[origen] = instantanea
+
+    def exportar(self):
+        """Texto en el formato de exposición de Prometheus (versión 0.0.4)"""
+        with self._lock:
+            otros = list(self._otros.values())
+        lineas = []
+        for nombre, (tipo, ayuda) in self._tipos.items():
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            if nombre in self._funciones:
+                valores = self._calcular(nombre)
+                if valores is None:
+                    continue
+                for otro in otros:
+                    for etiquetas, valor in otro['calculadas'].get(nombre, {}).items():
+                        valores[etiquetas] = valores.get(etiquetas, 0) + valor
+                for etiquetas, valor in valores.items():
+                    lineas.append(f"{nombre}{_etiquetas_texto(etiquetas)} {valor}")
+            elif tipo == 'histogram':
+                buckets = self._buckets[nombre]
+                with self._lock:
+                    series = {e: [list(c), s, t] for e, (c, s, t) in self._histogramas[nombre].items()}
+                for otro in otros:
+                    for etiquetas, (conteos, suma, total) in otro['histogramas'].get(nombre, {}).items():
+                        serie = series.setdefault(etiquetas, [[0] * len(buckets), 0.0, 0])
+                        serie[0] = [a + b for a, b in zip(serie[0], conteos)]
+                        serie[1] += suma
+                        serie[2] += total
+                for etiquetas, (conteos, suma, total) in series.items():
+                    acumulado = 0
+                    for limite, conteo in zip(buckets, conteos):
+                        acumulado += conteo
+                        lineas.append(f"{nombre}_bucket{_etiquetas_texto(etiquetas + (('le', limite),))} {acumulado}")
+                    lineas.append(f"{nombre}_bucket{_etiquetas_texto(etiquetas + (('le', '+Inf'),))} {total}")
+                    lineas.append(f"{nombre}_sum{_etiquetas_texto(etiquetas)} {suma}")
+                    lineas.append(f"{nombre}_count{_etiquetas_texto(etiquetas)} {total}")
+            else:
+                with self._lock:
+                    series = dict(self._valores[nombre])
+                for otro in otros:
+                    for etiquetas, valor in otro['valores'].get(nombre, {}).items():
+                        series[etiquetas] = series.get(etiquetas, 0) + valor
+                for etiquetas, valor in series.items():
+                    lineas.append(f"{nombre}{_etiquetas_texto(etiquetas)} {valor}")
+        return "\n".join(lineas) + "\n"
+
+metricas = Metricas()
+metricas.contador('chokolo_updates_total', "Updates recibidos de Telegram, por tipo")
+metricas.contador('chokolo_handler_llamadas_total', "Ejecuciones de cada handler")
+metricas.contador('chokolo_handler_errores_total', "Excepciones no controladas por handler")
+metricas.histograma('chokolo_handler_duracion_segundos', "Latencia de cada handler")
+metricas.contador('chokolo_telegram_llamadas_total', "Llamadas a la Bot API por método y código HTTP")
+metricas.histograma('chokolo_telegram_duracion_segundos', "Latencia de las llamadas a la Bot API")
+metricas.histograma('chokolo_persistencia_duracion_segundos', "Duración de guardar_db y hacer_backup")
+metricas.contador('chokolo_persistencia_bytes_total', "Bytes escritos a disco por destino")
+metricas.contador('chokolo_api_respuestas_total', "Respuestas de la API de catálogo por ruta y código HTTP")
+metricas.contador('chokolo_productos_eliminados_total', "Tallas eliminadas en lote por motivo (vencimiento, limpiar)")
+
+def medir_duracion(metrica, **etiquetas):
+    """Decorador: observa en `metrica` la duración de la función (sync o async)"""
+    def decorador(funcion):
+        if asyncio.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return await funcion(*args, **kwargs)
+                finally:
+                    metricas.observar(metrica, time.perf_counter() - inicio, **etiquetas)
+        else:
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return funcion(*args, **kwargs)
+                finally:
+                    metricas.observar(metrica, time.perf_counter() - inicio, **etiquetas)
+        return envoltura
+    return decorador
+
+def instrumentar_handler(handler):
+    """Decorador de handlers: cuenta llamadas y errores y mide la latencia"""
+    @functools.wraps(handler)
+    async def envoltura(update, context):
+        inicio = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            metricas.incrementar('chokolo_handler_errores_total', handler=handler.__name__)
+            raise
+        finally:
+            metricas.incrementar('chokolo_handler_llamadas_total', handler=handler.__name__)
+            metricas.observar('chokolo_handler_duracion_segundos', time.perf_counter() - inicio, handler=handler.__name__)
+    return envoltura
+
+async def contar_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler del grupo -1: cuenta todos los updates antes de despacharlos"""
+    tipo = next((campo for campo in TIPOS_UPDATE if getattr(update, campo, None) is not None), 'otro')
+    metricas.incrementar('chokolo_updates_total', tipo=tipo)
+
+TIPOS_UPDATE = ('message', 'edited_message', 'callback_query', 'chat_member', 'my_chat_member')
+
+class RequestMedido(HTTPXRequest):
+    """HTTPXRequest que registra método, código y latencia de cada llamada a la Bot API"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        # Las descargas terminan en el nombre del archivo: una etiqueta fija
+        # evita crear series nuevas por cada foto descargada
+        metodo = 'descarga' if url.startswith(TELEGRAM_FILE_URL) else url.rsplit('/', 1)[-1]
+        inicio = time.perf_counter()
+        codigo = 'error'
+        try:
+            codigo, cuerpo = await super().do_request(url, method, request_data, *args, **kwargs)
+            return codigo, cuerpo
+        finally:
+            metricas.incrementar('chokolo_telegram_llamadas_total', metodo=metodo, codigo=codigo)
+            metricas.observar('chokolo_telegram_duracion_segundos', time.perf_counter() - inicio, metodo=metodo)
+
 # =============================================
 # SISTEMA DE PERSISTENCIA JSON MEJORADO
 # =============================================
+# Cada cambio se agrega como una línea al diario (costo constante); una
+# compactación en segundo plano lo vuelca periódicamente sobre DB_FILE.
+JOURNAL_FILE = os.path.join(DATA_DIR, "productos_db.journal")
+FSYNC_LOTE = 32                 # fsync cada N registros pendientes...
+FSYNC_INTERVALO = 1.0           # ...o cada N segundos, lo que ocurra primero
+COMPACTAR_CADA = 5000           # Registros en el diario antes de compactar
+# Copia binaria (marshal) de la instantánea para arrancar rápido; si no
+# corresponde a productos_db.json (o no se puede leer) se usa el JSON.
+SNAPSHOT_BINARIO = os.getenv('SNAPSHOT_BINARIO', '1') != '0'
+DB_BIN_FILE = os.path.join(DATA_DIR, "productos_db.bin")
+VERSION_BINARIO = 5             # Formato de las tuplas (2: hash perceptual, 3: precios numéricos, 4: fecha,
+                                # 5: claves por grupo y modelo)
+
+class DiarioPersistencia:
+    """Diario de solo-agregado (put/del) sobre una instantánea JSON"""
+
+    def __init__(self, ruta_snapshot, ruta_diario, ruta_binario=None):
+        self.ruta_snapshot = ruta_snapshot
+        self.ruta_diario = ruta_diario
+        self.ruta_rotado = ruta_diario + ".old"
+        self.ruta_binario = ruta_binario
+        self.sello_cargado = None     # (tamaño, mtime) del JSON leído en cargar()
+        self._lock = threading.Lock()
+        self._lock_binario = threading.Lock()
+        self._archivo = None
+        self._pendientes = 0          # Registros escritos sin fsync
+        self._ultimo_fsync = time.monotonic()
+        self._registros = 0           # Registros en el diario actual
+        self._compactando = None      # Hilo de compactación en curso
+        self._hilo_binario = None     # Hilo que genera la copia binaria al arrancar
+
+    def cargar(self):
+        """(instantanea, registros): la instantánea tal cual y los registros de
+        diario rotado (si una compactación quedó a medias) + diario actual"""
+        instantanea = {}
+        if os.path.exists(self.ruta_snapshot):
+            self.sello_cargado = self._sello()
+            instantanea = self._cargar_binario()
+            if instantanea is None:
+                with open(self.ruta_snapshot, 'r', encoding='utf-8') as f:
+                    instantanea = json.load(f)
+        registros = []
+        for ruta in (self.ruta_rotado, self.ruta_diario):
+            registros.extend(self._leer(ruta))
+        return instantanea, registros
+
+    def _leer(self, ruta):
+        if not os.path.exists(ruta):
+            return []
+        registros = []
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for numero, linea in enumerate(f, 1):
+                try:
+                    registros.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    # Normalmente la última línea cortada por un apagado brusco
+                    logger.warning(f"Diario {ruta}: línea {numero} ilegible, se ignora")
+        if ruta == self.ruta_diario:
+            self._registros += len(registros)
+        return registros
+
+    def _sello(self):
+        estado = os.stat(self.ruta_snapshot)
+        return [estado.st_size, estado.st_mtime_ns]
+
+    def _cargar_binario(self):
+        """Instantánea desde la copia binaria, o None si falta o no coincide con el JSON"""
+        if self.ruta_binario is None or not os.path.exists(self.ruta_binario):
+            return None
+        try:
+            with open(self.ruta_binario, 'rb') as f:
+                datos = marshal.loads(f.read())  # loads(bytes) es mucho más rápido que load(archivo)
+            if datos.get('binario') != VERSION_BINARIO or datos.get('sello') != self.sello_cargado:
+                logger.info("Instantánea binaria desactualizada, se usa el JSON")
+                return None
+            return datos
+        except (OSError, ValueError, EOFError, TypeError, AttributeError) as e:
+            logger.warning(f"Instantánea binaria ilegible ({e}), se usa el JSON")
+            return None
+
+    def escribir_binario(self, instantanea, sello):
+        """Copia binaria de una instantánea compacta: tallas como bytes de array('d')"""
+        if self.ruta_binario is None or instantanea.get('version') != VERSION_INSTANTANEA or instantanea.get('binario'):
+            return
+        ahora = int(time.time())   # Modelos guardados antes de tener fecha
+        try:
+            modelos = {
+                clave: (
+                    datos['modelo'], datos['foto'], datos['chat_id'], datos['msg_id'], datos['user_id'],
+                    array('d', datos['tallas']).tobytes(),
+                    datos.get('precios') or [datos['precio']] * len(datos['tallas']),
+                    datos.get('phash'),
+                    array('d', ModeloProducto.valores_dict(datos)).tobytes(),
+                    datos.get('actualizado') or ahora
+                )
+                for clave, datos in instantanea['modelos'].items()
+            }
+            with self._lock_binario:
+                # Temporal único: otro proceso (o instancia) puede estar escribiendo la suya
+                descriptor, temp_file = tempfile.mkstemp(
+                    dir=os.path.dirname(self.ruta_binario),
+                    prefix=os.path.basename(self.ruta_binario) + ".", suffix=".tmp"
+                )
+                try:
+                    with os.fdopen(descriptor, 'wb') as f:
+                        marshal.dump({
+                            'version': VERSION_INSTANTANEA, 'binario': VERSION_BINARIO, 'sello': sello,
+                            'modelos': modelos
+                        }, f)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(temp_file, self.ruta_binario)
+                finally:
+                    if os.path.exists(temp_file):
+                        os.remove(temp_file)
+        except Exception as e:
+            logger.error(f"Error escribiendo instantánea binaria: {e}")
+
+    def escribir_binario_en_segundo_plano(self, instantanea, sello):
+        """escribir_binario() en un hilo daemon (no retrasa el arranque); cerrar() lo espera"""
+        self._hilo_binario = threading.Thread(
+            target=self.escribir_binario, args=(instantanea, sello), daemon=True
+        )
+        self._hilo_binario.start()
+
+    def compactacion_interrumpida(self):
+        return os.path.exists(self.ruta_rotado)
+
+    def anotar(self, op, producto_id, producto=None):
+        """Agrega un cambio al diario (se suscribe al catálogo)"""
+        registro = {'op': op, 'id': producto_id}
+        if op == 'put':
+            registro['p'] = producto
+        linea = json.dumps(registro, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self._archivo is None:
+                self._archivo = self._abrir()
+            self._archivo.write(linea)
+            self._pendientes += 1
+            metricas.incrementar('chokolo_persistencia_bytes_total', len(linea.encode('utf-8')), destino='diario')
+            self._registros += 1
+
+    def _abrir(self):
+        archivo = open(self.ruta_diario, 'a+', encoding='utf-8')
+        if archivo.tell() > 0:
+            # Si quedó una línea cortada, empezar en una línea nueva
+            archivo.seek(archivo.tell() - 1)
+            if archivo.read(1) != "\n":
+                archivo.write("\n")
+        return archivo
+
+    def sincronizar(self, forzar=False):
+        """Vacía el búfer y hace fsync agrupado según FSYNC_LOTE/FSYNC_INTERVALO"""
+        with self._lock:
+            if self._archivo is None or not self._pendientes:
+                return
+            self._archivo.flush()
+            vencido = time.monotonic() - self._ultimo_fsync >= FSYNC_INTERVALO
+            if forzar or vencido or self._pendientes >= FSYNC_LOTE:
+                os.fsync(self._archivo.fileno())
+                self._pendientes = 0
+                self._ultimo_fsync = time.monotonic()
+
+    def requiere_compactacion(self):
+        return self._registros >= COMPACTAR_CADA and not self.compactando()
+
+    def compactando(self):
+        return self._compactando is not None and self._compactando.is_alive()
+
+    def compactar(self, catalogo, en_segundo_plano=True):
+        """Rota el diario y escribe la instantánea a partir de una copia"""
+        if self.compactando():
+            return
+        if self.compactacion_interrumpida():
+            # Rotar ahora pisaría registros aún no volcados: se termina la anterior
+            self._escribir_snapshot(catalogo.instantanea())
+        with self._lock:
+            if self._archivo is not None:
+                self._archivo.flush()
+                os.fsync(self._archivo.fileno())
+                self._archivo.close()
+                self._archivo = None
+            self._pendientes = 0
+            if os.path.exists(self.ruta_diario):
+                os.replace(self.ruta_diario, self.ruta_rotado)
+            self._registros = 0
+            generar = catalogo.copiar_instantanea()
+        if en_segundo_plano:
+            self._compactando = threading.Thread(
+                target=lambda: self._escribir_snapshot(generar()), daemon=True
+            )
+            self._compactando.start()
+        else:
+            self._escribir_snapshot(generar())
+
+    def _escribir_snapshot(self, instantanea):
+        try:
+            temp_file = self.ruta_snapshot + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(instantanea, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            # Reemplazo atómico: el diario rotado solo se borra con la instantánea a salvo
+            metricas.incrementar('chokolo_persistencia_bytes_total', os.path.getsize(temp_file), destino='instantanea')
+            os.replace(temp_file, self.ruta_snapshot)
+            self.escribir_binario(instantanea, self._sello())
+            if os.path.exists(self.ruta_rotado):
+                os.remove(self.ruta_rotado)
+            logger.info(f"Compactación completada: {len(instantanea.get('modelos', instantanea))} modelos")
+        except Exception as e:
+            logger.error(f"Error compactando DB: {e}")
+
+    def cerrar(self, catalogo=None):
+        """fsync final; si se pasa el catálogo, compacta antes de salir"""
+        self.sincronizar(forzar=True)
+        if self._compactando is not None:
+            self._compactando.join()
+        if self._hilo_binario is not None:
+            self._hilo_binario.join()
+        if catalogo is not None and self._registros:
+            self.compactar(catalogo, en_segundo_plano=False)
+
+# Almacenamiento del catálogo: "json" (memoria + diario) o "sqlite"
+ALMACEN_DB = os.getenv('ALMACEN_DB', 'json').strip().lower()
+SQLITE_FILE = os.path.join(DATA_DIR, "productos_db.sqlite3")
+
 def cargar_db():
-    """Carga la base de datos con manejo robusto de errores"""
+    """Crea el catálogo sobre el almacenamiento configurado en ALMACEN_DB"""
+    if ALMACEN_DB == 'sqlite':
+        try:
+            catalogo_sqlite = CatalogoSQLite(SQLITE_FILE)
+            if not len(catalogo_sqlite) and (os.path.exists(DB_FILE) or os.path.exists(JOURNAL_FILE)):
+                origen = CatalogoProductos.desde_instantanea(*DiarioPersistencia(DB_FILE, JOURNAL_FILE).cargar())
+                catalogo_sqlite.importar(origen.exportar())
+                logger.info(f"Catálogo JSON migrado a SQLite: {len(catalogo_sqlite)} productos")
+            return catalogo_sqlite
+        except Exception as e:
+            logger.error(f"Error abriendo SQLite, se usa JSON: {e}")
+
+    diario = DiarioPersistencia(DB_FILE, JOURNAL_FILE, DB_BIN_FILE if SNAPSHOT_BINARIO else None)
+    inicio = time.perf_counter()
     try:
-        if os.path.exists(DB_FILE):
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        instantanea, registros = diario.cargar()
+        catalogo_json = CatalogoProductos.desde_instantanea(instantanea, registros, diario)
     except Exception as e:
         logger.error(f"Error cargando DB: {e}")
-        return {}
-
-def guardar_db():
-    """Guarda la base de datos con verificación de permisos"""
+        return CatalogoProductos(diario=diario)
+    logger.info(
+        f"Catálogo cargado en {(time.perf_counter() - inicio) * 1000:.0f} ms "
+        f"(instantánea {'binaria' if instantanea.get('binario') else 'JSON'}, {len(registros)} registros de diario)"
+    )
+
+    if instantanea and instantanea.get('version') not in (2, VERSION_INSTANTANEA):
+        # Migración del formato original (un dict por talla) al compacto
+        shutil.copyfile(DB_FILE, DB_FILE + ".v1")
+        diario.compactar(catalogo_json, en_segundo_plano=False)
+        logger.info(f"productos_db.json migrado al formato compacto (copia en {DB_FILE}.v1)")
+    elif instantanea.get('version') == 2:
+        # Compacta de un registro por modelo: se reescribe con un registro por grupo y modelo
+        diario.compactar(catalogo_json, en_segundo_plano=False)
+        logger.info("productos_db.json reescrito con registros por grupo")
+    elif diario.compactacion_interrumpida():
+        diario.compactar(catalogo_json, en_segundo_plano=False)
+    elif instantanea and diario.ruta_binario and not instantanea.get('binario'):
+        # Primer arranque con esta versión (o binario viejo): se genera para el próximo
+        diario.escribir_binario_en_segundo_plano(instantanea, diario.sello_cargado)
+    return catalogo_json
+
+@medir_duracion('chokolo_persistencia_duracion_segundos', operacion='guardar_db')
+def guardar_db(forzar=False):
+    """Confirma en disco los cambios pendientes del catálogo"""
     try:
-        temp_file = DB_FILE + ".tmp"
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            json.dump(productos_db, f, ensure_ascii=False, indent=2)
-        
-        # Reemplazo atómico para evitar corrupción
-        if os.path.exists(DB_FILE):
-            os.remove(DB_FILE)
-        os.rename(temp_file, DB_FILE)
-        
+        catalogo.confirmar(forzar)
     except Exception as e:
         logger.error(f"Error guardando DB: {e}")
 
-def hacer_backup():
-    """Crea backups con verificación de archivos"""
+# =============================================
+# SISTEMA DE RESPALDOS (COMPLETOS + INCREMENTALES)
+# =============================================
+# Respaldos completos comprimidos cada RESPALDO_INTERVALO_COMPLETO y, entre
+# ellos, deltas con los cambios acumulados cada RESPALDO_INTERVALO_DELTA.
+RESPALDO_INTERVALO_DELTA = 5 * 60
+RESPALDO_INTERVALO_COMPLETO = 6 * 3600
+RETENCION_HORARIA = 24          # Último completo de cada hora (horas)
+RETENCION_DIARIA = 7            # Último completo de cada día (días)
+RETENCION_SEMANAL = 4           # Último completo de cada semana (semanas)
+RETENCION_DELTAS_DIAS = 7       # Más atrás, la restauración es al completo más cercano
+FORMATO_FECHA_RESPALDO = "%Y%m%d_%H%M%S_%f"
+PATRON_RESPALDO = re.compile(
+    r'^(?:(?P<tipo>completo|delta)_(?P<fecha>\d{8}_\d{6}_\d{6})(?:_(?P<hash>[0-9a-f]+))?\.json(?:l)?\.gz'
+    r'|backup_(?P<legado>\d{8}_\d{6})\.json)$'
+)
+
+class SistemaRespaldos:
+    """Respaldos completos + deltas deduplicados, con retención y restauración"""
+
+    def __init__(self, directorio, completos=True):
+        self.directorio = directorio
+        self.completos = completos  # False: solo deltas (workers que no son el 0)
+        self._lock = threading.Lock()
+        self._pendientes = {}   # producto_id -> producto (None = eliminado)
+        self._ultimo_delta = time.time()
+        completos = [r for r in self.listar() if r[1] == 'completo']
+        self._ultimo_completo = completos[-1][0].timestamp() if completos else 0
+        self._hash_completo = completos[-1][3] if completos else None
+
+    def anotar(self, op, producto_id, producto=None):
+        """Acumula cambios desde el último delta (se suscribe al catálogo)"""
+        with self._lock:
+            self._pendientes[producto_id] = producto if op == 'put' else None
+
+    def listar(self):
+        """[(fecha, tipo, ruta, hash)] de todos los respaldos, del más viejo al más nuevo"""
+        respaldos = []
+        for nombre in os.listdir(self.directorio):
+            match = PATRON_RESPALDO.match(nombre)
+            if not match:
+                continue
+            if match['legado']:
+                fecha, tipo = datetime.strptime(match['legado'], "%Y%m%d_%H%M%S"), 'completo'
+            else:
+                fecha, tipo = datetime.strptime(match['fecha'], FORMATO_FECHA_RESPALDO), match['tipo']
+            respaldos.append((fecha, tipo, os.path.join(self.directorio, nombre), match['hash']))
+        respaldos.sort()
+        return respaldos
+
+    def respaldar(self, catalogo, forzar=False):
+        """Escribe el delta y/o el completo que estén vencidos"""
+        ahora = time.time()
+        if forzar or ahora - self._ultimo_delta >= RESPALDO_INTERVALO_DELTA:
+            self._escribir_delta()
+        if self.completos and ahora - self._ultimo_completo >= RESPALDO_INTERVALO_COMPLETO:
+            # El delta va primero: así el completo contiene todo lo anterior a él
+            self._escribir_delta()
+            self._escribir_completo(catalogo)
+            self.podar()
+
+    def _escribir(self, nombre, datos):
+        ruta = os.path.join(self.directorio, nombre)
+        with gzip.open(ruta + ".tmp", 'wb') as f:
+            f.write(datos)
+        metricas.incrementar('chokolo_persistencia_bytes_total', os.path.getsize(ruta + ".tmp"), destino='respaldo')
+        os.replace(ruta + ".tmp", ruta)
+        return len(datos)
+
+    def _escribir_delta(self):
+        with self._lock:
+            cambios, self._pendientes = self._pendientes, {}
+            self._ultimo_delta = time.time()
+        if not cambios:
+            return
+        lineas = ''.join(
+            json.dumps({'id': producto_id, 'p': producto}, ensure_ascii=False, separators=(',', ':')) + "\n"
+            for producto_id, producto in cambios.items()
+        )
+        fecha = datetime.now().strftime(FORMATO_FECHA_RESPALDO)
+        self._escribir(f"delta_{fecha}.jsonl.gz", lineas.encode('utf-8'))
+
+    def _escribir_completo(self, catalogo):
+        self._ultimo_completo = time.time()
+        datos = json.dumps(
+            catalogo.instantanea(), ensure_ascii=False, sort_keys=True, separators=(',', ':')
+        ).encode('utf-8')
+        huella = hashlib.sha256(datos).hexdigest()[:16]
+        if huella == self._hash_completo:
+            return  # Sin cambios desde el último completo: los deltas bastan
+        self._hash_completo = huella
+        fecha = datetime.now().strftime(FORMATO_FECHA_RESPALDO)
+        tamano = self._escribir(f"completo_{fecha}_{huella}.json.gz", datos)
+        logger.info(f"Respaldo completo: {tamano} bytes sin comprimir")
+
+    def podar(self):
+        """Retención horaria/diaria/semanal para completos; deltas por antigüedad"""
+        ahora = datetime.now()
+        respaldos = self.listar()
+        completos = [r for r in respaldos if r[1] == 'completo']
+        conservar = {completos[-1][2]} if completos else set()
+        vistos = set()
+        for fecha, _, ruta, _ in reversed(completos):
+            edad = ahora - fecha
+            if edad < timedelta(hours=RETENCION_HORARIA):
+                cubeta = ('h', fecha.strftime("%Y%m%d%H"))
+            elif edad < timedelta(days=RETENCION_DIARIA):
+                cubeta = ('d', fecha.strftime("%Y%m%d"))
+            elif edad < timedelta(weeks=RETENCION_SEMANAL):
+                cubeta = ('s', fecha.strftime("%G%V"))
+            else:
+                continue
+            if cubeta not in vistos:
+                vistos.add(cubeta)
+                conservar.add(ruta)
+
+        limite_deltas = ahora - timedelta(days=RETENCION_DELTAS_DIAS)
+        for fecha, tipo, ruta, _ in respaldos:
+            viejo = tipo == 'delta' and fecha < limite_deltas
+            if viejo or (tipo == 'completo' and ruta not in conservar):
+                try:
+                    os.remove(ruta)
+                except OSError as e:
+                    logger.error(f"Error podando respaldo {ruta}: {e}")
+
+    def restaurar(self, momento):
+        """Reconstruye {producto_id: producto} tal como estaba en `momento`"""
+        respaldos = [r for r in self.listar() if r[0] <= momento]
+        base = [r for r in respaldos if r[1] == 'completo']
+        if not base:
+            raise ValueError(f"No hay respaldos completos anteriores a {momento}")
+        fecha_base, _, ruta_base, _ = base[-1]
+        productos = self._leer_completo(ruta_base)
+        for fecha, tipo, ruta, _ in respaldos:
+            if tipo != 'delta' or fecha <= fecha_base:
+                continue
+            with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+                for linea in f:
+                    cambio = json.loads(linea)
+                    if cambio['p'] is None:
+                        productos.pop(cambio['id'], None)
+                    else:
+                        productos[cambio['id']] = cambio['p']
+        return productos
+
+    def _leer_completo(self, ruta):
+        if ruta.endswith('.gz'):
+            with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+                return expandir_instantanea(json.load(f))
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return expandir_instantanea(json.load(f))
+
+respaldos = SistemaRespaldos(BACKUP_DIR)
+
+@medir_duracion('chokolo_persistencia_duracion_segundos', operacion='hacer_backup')
+def hacer_backup(forzar=False):
+    """Escribe los respaldos vencidos (delta y/o completo)"""
     try:
-        if os.path.exists(DB_FILE):
-            fecha = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = os.path.join(BACKUP_DIR, f"backup_{fecha}.json")
-            
-            # Método más seguro para copiar
-            with open(DB_FILE, 'r', encoding='utf-8') as orig, \
-                 open(backup_file, 'w', encoding='utf-8') as backup:
-                backup.write(orig.read())
-                
+        respaldos.respaldar(catalogo, forzar)
     except Exception as e:
         logger.error(f"Error en backup: {e}")
 
+def restaurar_db(momento):
+    """Reemplaza el catálogo por su estado en `momento` ('AAAA-MM-DD HH:MM')"""
+    fecha = datetime.fromisoformat(momento)
+    productos = respaldos.restaurar(fecha)
+    # Respaldo del estado actual por si la restauración no era la esperada
+    respaldos._escribir_delta()
+    respaldos._escribir_completo(catalogo)
+
+    for producto_id in list(catalogo.exportar()):
+        if producto_id not in productos:
+            catalogo.eliminar(producto_id)
+    for producto_id, producto in productos.items():
+        if catalogo.get(producto_id) != producto:
+            catalogo.registrar(producto_id, producto)
+    hacer_backup(forzar=True)
+    catalogo.cerrar()
+    logger.info(f"Catálogo restaurado a {fecha}: {len(productos)} productos")
+
+# =============================================
+# PERSISTENCIA DIFERIDA (FUERA DEL EVENT LOOP)
+# =============================================
+PERSISTENCIA_DEBOUNCE = 0.5     # Segundos para agrupar una ráfaga de cambios
+
+class PersistenciaDiferida:
+    """Write-behind: guardar_db() + hacer_backup() en un hilo aparte.
+
+    Los handlers llaman a programar() y responden de inmediato; todos los
+    cambios de la ventana de PERSISTENCIA_DEBOUNCE se escriben en una sola
+    pasada. Quien necesite durabilidad puede hacer `await flush()`.
+    """
+
+    def __init__(self, debounce=PERSISTENCIA_DEBOUNCE):
+        self.debounce = debounce
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistencia")
+        self._temporizador = None
+
+    def programar(self):
+        """Agenda una escritura (si no hay una ya agendada) tras el debounce"""
+        if self._temporizador is None:
+            loop = asyncio.get_running_loop()
+            self._temporizador = loop.call_later(self.debounce, self._disparar)
+
+    def _disparar(self):
+        self._temporizador = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self, forzar=False):
+        """Escribe ya todo lo pendiente; con forzar=True hace fsync"""
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._escribir, forzar)
+
+    def _escribir(self, forzar=False):
+        guardar_db(forzar)
+        hacer_backup()
+
+    def cerrar(self):
+        """Espera las escrituras en curso y deja todo en disco (al apagar)"""
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        self._executor.shutdown(wait=True)
+        guardar_db(forzar=True)
+        hacer_backup(forzar=True)
+        catalogo.cerrar()
+
+persistencia = PersistenciaDiferida()
+
+# =============================================
+# MOTOR DE BÚSQUEDA (TOKENS + TRIGRAMAS)
+# =============================================
+LIMITE_RESULTADOS_BUSQUEDA = 10
+RESULTADOS_POR_PAGINA = 10      # Máximo de fotos por álbum de Telegram
+SIMILITUD_MINIMA_TOKEN = 0.45   # Coeficiente Dice mínimo entre trigramas
+RELEVANCIA_MINIMA = 0.5         # Promedio mínimo por palabra buscada
+
+@functools.lru_cache(maxsize=4096)
+def normalizar_texto(texto):
+    """Minúsculas, sin acentos ni signos: 'Jórdan 4 "Retro"' -> ('jordan', '4', 'retro')"""
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return tuple(re.findall(r'[a-z0-9]+(?:\.[0-9]+)?', texto))
+
+@functools.lru_cache(maxsize=8192)
+def trigramas(token):
+    """Trigramas con relleno para que tokens cortos ('4', 'ow') también indexen"""
+    relleno = f"${token}$"
+    return frozenset(relleno[i:i + 3] for i in range(len(relleno) - 2))
+
+def puntuar(palabras, tokens):
+    """Relevancia de la consulta normalizada contra los tokens de un modelo"""
+    puntaje = sum(
+        max((similitud_token(p, t) for t in tokens), default=0.0) for p in palabras
+    ) / len(palabras)
+    if puntaje < RELEVANCIA_MINIMA:
+        return 0.0
+    if ' '.join(palabras) in ' '.join(tokens):
+        puntaje += 0.5  # Bonificación por frase exacta
+    return puntaje
+
+def similitud_token(consulta, token):
+    """Relevancia de una palabra buscada contra una palabra del modelo (0 a 1)"""
+    if consulta == token:
+        return 1.0
+    if token.startswith(consulta):
+        return 0.9
+    if consulta in token:
+        return 0.8
+    a, b = trigramas(consulta), trigramas(token)
+    dice = 2 * len(a & b) / (len(a) + len(b))
+    return dice if dice >= SIMILITUD_MINIMA_TOKEN else 0.0
+
+class MotorBusqueda:
+    """Índice invertido por grupo: trigrama -> productos.
+
+    Se actualiza de forma incremental con cada registro o eliminación y
+    tolera errores de tipeo ("jordn"), acentos y orden de las palabras.
+    """
+
+    def __init__(self):
+        self._trigramas = {}   # chat_id -> {trigrama: {producto_id}}
+        self._tokens = {}      # producto_id -> (chat_id, tokens del modelo)
+
+    def agregar(self, producto_id, chat_id, modelo):
+        self.quitar(producto_id)
+        tokens = normalizar_texto(modelo)
+        self._tokens[producto_id] = (chat_id, tokens)
+        indice = self._trigramas.setdefault(chat_id, {})
+        for token in set(tokens):
+            for tri in trigramas(token):
+                indice.setdefault(tri, set()).add(producto_id)
+
+    def quitar(self, producto_id):
+        entrada = self._tokens.pop(producto_id, None)
+        if entrada is None:
+            return
+        chat_id, tokens = entrada
+        indice = self._trigramas.get(chat_id, {})
+        for token in set(tokens):
+            for tri in trigramas(token):
+                ids = indice.get(tri)
+                if ids is not None:
+                    ids.discard(producto_id)
+                    if not ids:
+                        del indice[tri]
+        if not indice:
+            self._trigramas.pop(chat_id, None)
+
+    def buscar(self, chat_id, consulta, limite=LIMITE_RESULTADOS_BUSQUEDA):
+        """Retorna [(producto_id, relevancia)] ordenado de mayor a menor relevancia"""
+        palabras = normalizar_texto(consulta)
+        indice = self._trigramas.get(chat_id)
+        if not palabras or not indice:
+            return []
+
+        candidatos = set()
+        for palabra in set(palabras):
+            for tri in trigramas(palabra):
+                candidatos.update(indice.get(tri, ()))
+
+        resultados = []
+        for producto_id in candidatos:
+            puntaje = puntuar(palabras, self._tokens[producto_id][1])
+            if puntaje:
+                resultados.append((producto_id, puntaje))
+
+        resultados.sort(key=lambda r: (-r[1], r[0]))
+        return resultados[:limite] if limite else resultados
+
+# Filtros numéricos de /buscar y /price: "talla 10.5", "talla 9-11", "<100",
+# ">=80", "80-120" (precio) y "barato"/"caro" (orden por precio)
+PATRON_FILTRO_TALLA = re.compile(r'\btallas?\s*(\d+(?:\.\d+)?)(?:\s*-\s*(\d+(?:\.\d+)?))?', re.IGNORECASE)
+PATRON_FILTRO_COMPARACION = re.compile(r'([<>]=?)\s*\$?\s*(\d+(?:\.\d+)?)')
+PATRON_FILTRO_RANGO = re.compile(r'(?<![\w.])\$?(\d+(?:\.\d+)?)\s*-\s*\$?(\d+(?:\.\d+)?)(?![\w.])')
+PATRON_FILTRO_ORDEN = re.compile(r'\b(barato|baratos|caro|caros)\b', re.IGNORECASE)
+
+def interpretar_filtros(consulta):
+    """Separa los filtros numéricos del texto de una consulta.
+
+    Retorna (texto, filtros) con filtros = {'talla': (min, max) o None,
+    'precio': (min, max) o None, 'orden': 'asc'/'desc'/None, 'piezas': [...]}.
+    Los rangos son inclusivos ('<100' -> (-inf, 99.99...)); 'piezas' es el
+    filtro en texto canónico para reconstruirlo (botón "Siguiente").
+    """
+    filtros = {'talla': None, 'precio': None, 'orden': None, 'piezas': []}
+
+    def talla(m):
+        minimo = float(m.group(1))
+        maximo = float(m.group(2)) if m.group(2) else minimo
+        filtros['talla'] = (minimo, maximo)
+        filtros['piezas'].append(f"talla {m.group(1)}" + (f"-{m.group(2)}" if m.group(2) else ""))
+        return ' '
+
+    def comparacion(m):
+        operador, valor = m.group(1), float(m.group(2))
+        minimo, maximo = filtros['precio'] or (-math.inf, math.inf)
+        if operador[0] == '<':
+            maximo = valor if operador == '<=' else math.nextafter(valor, -math.inf)
+        else:
+            minimo = valor if operador == '>=' else math.nextafter(valor, math.inf)
+        filtros['precio'] = (minimo, maximo)
+        filtros['piezas'].append(f"{operador}{m.group(2)}")
+        return ' '
+
+    def rango(m):
+        filtros['precio'] = (float(m.group(1)), float(m.group(2)))
+        filtros['piezas'].append(f"{m.group(1)}-{m.group(2)}")
+        return ' '
+
+    def orden(m):
+        filtros['orden'] = 'asc' if m.group(1).lower().startswith('barato') else 'desc'
+        filtros['piezas'].append(m.group(1).lower())
+        return ' '
+
+    texto = PATRON_FILTRO_TALLA.sub(talla, consulta)
+    texto = PATRON_FILTRO_COMPARACION.sub(comparacion, texto)
+    texto = PATRON_FILTRO_RANGO.sub(rango, texto)
+    texto = PATRON_FILTRO_ORDEN.sub(orden, texto)
+    return ' '.join(texto.split()), filtros
+
+def hay_filtros(filtros):
+    return bool(filtros['piezas'])
+
+def cumple_filtros(producto, filtros):
+    """Para resultados de una búsqueda por texto (ya son pocos)"""
+    talla, precio = numeros_producto(producto)
+    if filtros['talla'] is not None:
+        if not filtros['talla'][0] <= talla <= filtros['talla'][1]:
+            return False
+    if filtros['precio'] is not None:
+        if precio is None or not filtros['precio'][0] <= precio <= filtros['precio'][1]:
+            return False
+    return True
+
+def ordenar_por_precio(productos, orden):
+    """Orden estable por precio numérico ('asc'/'desc'); los precios sin número van al final"""
+    if orden is None:
+        return productos
+    precios = [(numeros_producto(p)[1], p) for p in productos]
+    conocidos = [(precio, p) for precio, p in precios if precio is not None]
+    conocidos.sort(key=lambda e: e[0], reverse=orden == 'desc')
+    return [p for _, p in conocidos] + [p for precio, p in precios if precio is None]
+
+# =============================================
+# CATÁLOGO COMPACTO CON ÍNDICES POR GRUPO
+# =============================================
+def formatear_talla(valor):
+    """10 -> '10.0', 10.5 -> '10.5' (mismo formato que el registro original)"""
+    valor = float(valor)
+    return f"{valor:.1f}" if valor.is_integer() else str(valor)
+
+@functools.lru_cache(maxsize=4096)   # Los mismos precios se repiten en miles de tallas
+def valor_precio(precio):
+    """'$95' -> 95.0, '1,200 USD' -> 1200.0; NaN si el texto no tiene número"""
+    coincidencia = re.search(r'\d+(?:,\d{3})*(?:\.\d+)?', precio)
+    return float(coincidencia.group().replace(',', '')) if coincidencia else math.nan
+
+def numero_o_none(valor):
+    """NaN -> None (JSON no tiene NaN)"""
+    return None if math.isnan(valor) else valor
+
+def con_fecha(producto, ahora=None):
+    """El producto con 'actualizado' (epoch en segundos); se agrega al registrarlo si no lo trae.
+
+    Así la fecha viaja en el diario y en los respaldos, y reconstruir el
+    catálogo no "rejuvenece" las publicaciones.
+    """
+    if 'actualizado' in producto:
+        return producto
+    return {**producto, 'actualizado': int(time.time() if ahora is None else ahora)}
+
+def numeros_producto(producto):
+    """(talla, precio) numéricos de un producto por talla (precio None si no tiene número).
+
+    Un producto anotado antes de existir talla_num/precio_num se interpreta al vuelo.
+    """
+    talla = producto.get('talla_num')
+    if talla is None:
+        talla = float(producto['talla'])
+    if 'precio_num' in producto:
+        return talla, producto['precio_num']
+    return talla, numero_o_none(valor_precio(producto['precio']))
+
+class ModeloProducto:
+    """Un modelo publicado: campos comunes una sola vez + tallas en arreglo.
+
+    Reemplaza a un dict por talla con modelo/foto/chat_id/... repetidos. Se
+    trata como inmutable (cada cambio crea un registro nuevo), así una
+    compactación puede copiar el diccionario de modelos sin bloquear.
+    """
+
+    __slots__ = ('modelo', 'foto', 'chat_id', 'msg_id', 'user_id', 'tallas', 'precios', 'valores', 'phash',
+                 'actualizado')
+
+    def __init__(self, modelo, foto, chat_id, msg_id, user_id, tallas=(), precios=(), phash=None,
+                 valores=None, actualizado=None):
+        self.modelo = sys.intern(modelo)
+        self.foto = foto
+        self.chat_id = chat_id
+        self.msg_id = msg_id
+        self.user_id = user_id
+        self.tallas = array('d', tallas)                  # Ordenadas de menor a mayor
+        self.precios = [sys.intern(p) for p in precios]   # Paralelo a tallas
+        # Precio numérico (NaN si no se pudo interpretar), paralelo a precios
+        self.valores = array('d', map(valor_precio, self.precios) if valores is None else valores)
+        self.phash = phash                                # Hash perceptual de la foto (hex) o None
+        # Última publicación del modelo (epoch en segundos); sin fecha guardada cuenta desde ahora
+        self.actualizado = int(time.time()) if actualizado is None else actualizado
+
+    def __len__(self):
+        return len(self.tallas)
+
+    def indice(self, talla):
+        """Posición de la talla ('10.5', 10.5) o None"""
+        try:
+            valor = float(talla)
+        except ValueError:
+            return None
+        i = bisect.bisect_left(self.tallas, valor)
+        return i if i < len(self.tallas) and self.tallas[i] == valor else None
+
+    def con_talla(self, producto):
+        """Copia con la talla agregada o actualizada; los campos comunes pasan a ser los del producto"""
+        tallas, precios, valores = list(self.tallas), list(self.precios), list(self.valores)
+        talla, precio = numeros_producto(producto)
+        precio = math.nan if precio is None else precio
+        i = bisect.bisect_left(tallas, talla)
+        if i < len(tallas) and tallas[i] == talla:
+            precios[i] = producto['precio']
+            valores[i] = precio
+        else:
+            tallas.insert(i, talla)
+            precios.insert(i, producto['precio'])
+            valores.insert(i, precio)
+        return ModeloProducto(
+            producto['modelo'], producto['foto'], producto['chat_id'],
+            producto['msg_id'], producto['user_id'], tallas, precios, producto.get('phash'), valores,
+            producto.get('actualizado')
+        )
+
+    def sin_talla(self, i):
+        """Copia sin la talla en la posición i (None si no queda ninguna)"""
+        if len(self.tallas) == 1:
+            return None
+        tallas, precios, valores = list(self.tallas), list(self.precios), list(self.valores)
+        del tallas[i], precios[i], valores[i]
+        return ModeloProducto(
+            self.modelo, self.foto, self.chat_id, self.msg_id, self.user_id,
+            tallas, precios, self.phash, valores, self.actualizado
+        )
+
+    def producto(self, i):
+        """Vista compatible con el formato original (un dict por talla)"""
+        producto = {
+            'modelo': self.modelo,
+            'talla': formatear_talla(self.tallas[i]),
+            'precio': self.precios[i],
+            'talla_num': self.tallas[i],
+            'precio_num': numero_o_none(self.valores[i]),
+            'foto': self.foto,
+            'chat_id': self.chat_id,
+            'msg_id': self.msg_id,
+            'user_id': self.user_id,
+            'actualizado': self.actualizado
+        }
+        if self.phash is not None:
+            producto['phash'] = self.phash
+        return producto
+
+    def productos(self):
+        return [self.producto(i) for i in range(len(self.tallas))]
+
+    def a_dict(self):
+        datos = {
+            'modelo': self.modelo,
+            'foto': self.foto,
+            'chat_id': self.chat_id,
+            'msg_id': self.msg_id,
+            'user_id': self.user_id,
+            'tallas': list(self.tallas),
+            'actualizado': self.actualizado
+        }
+        # Lo normal es un precio para todas las tallas: se guarda una sola vez
+        if len(set(self.precios)) == 1:
+            datos['precio'] = self.precios[0]
+            datos['valor'] = numero_o_none(self.valores[0])
+        else:
+            datos['precios'] = self.precios
+            datos['valores'] = [numero_o_none(v) for v in self.valores]
+        if self.phash is not None:
+            datos['phash'] = self.phash
+        return datos
+
+    @staticmethod
+    def valores_dict(datos):
+        """Precios numéricos de un registro compacto (se interpretan si es de antes de guardarlos)"""
+        if 'valores' in datos:
+            valores = datos['valores']
+        elif 'valor' in datos:
+            valores = [datos['valor']] * len(datos['tallas'])
+        else:
+            return [valor_precio(p) for p in datos.get('precios') or [datos['precio']] * len(datos['tallas'])]
+        return [math.nan if v is None else v for v in valores]
+
+    @classmethod
+    def desde_dict(cls, datos):
+        precios = datos.get('precios') or [datos['precio']] * len(datos['tallas'])
+        return cls(
+            datos['modelo'], datos['foto'], datos['chat_id'], datos['msg_id'], datos['user_id'],
+            datos['tallas'], precios, datos.get('phash'), cls.valores_dict(datos), datos.get('actualizado')
+        )
+
+    @classmethod
+    def desde_tupla(cls, tupla):
+        """Registro desde la instantánea binaria (sin volver a convertir tallas ni precios)"""
+        registro = cls.__new__(cls)
+        (registro.modelo, registro.foto, registro.chat_id, registro.msg_id,
+         registro.user_id, tallas, registro.precios, registro.phash, valores, registro.actualizado) = tupla
+        registro.tallas = array('d')
+        registro.tallas.frombytes(tallas)
+        registro.valores = array('d')
+        registro.valores.frombytes(valores)
+        return registro
+
+# Instantánea compacta: 2 = un registro por modelo, 3 = uno por grupo y modelo
+VERSION_INSTANTANEA = 3
+
+def clave_registro(chat_id, prefijo):
+    """Clave de un registro compacto: "chat_id:modelo" (el mismo modelo en dos grupos son dos registros)"""
+    return f"{chat_id}:{prefijo}"
+
+def prefijo_clave(clave):
+    """"-100123:jordan 4" -> "jordan 4" (el producto_id de cada talla es "jordan 4_10.0")"""
+    return clave.partition(':')[2]
+
+def claves_instantanea(datos):
+    """{clave: registro} de una instantánea compacta (las de versión 2 no llevan el grupo en la clave)"""
+    if datos.get('version') == 2:
+        return {clave_registro(registro['chat_id'], clave): registro for clave, registro in datos['modelos'].items()}
+    return datos['modelos']
+
+def expandir_instantanea(datos):
+    """{producto_id: producto} a partir de una instantánea compacta u original"""
+    if datos.get('version') not in (2, VERSION_INSTANTANEA):
+        return datos
+    return {
+        f"{prefijo_clave(clave)}_{producto['talla']}": producto
+        for clave, registro in claves_instantanea(datos).items()
+        for producto in ModeloProducto.desde_dict(registro).productos()
+    }
+
+class IndiceOrdenado:
+    """Valores numéricos de un grupo en un array('d') ordenado.
+
+    bisect ubica un rango en O(log n) sin interpretar ningún producto. Cada
+    valor guarda (clave del modelo, talla) en arreglos paralelos en lugar de
+    un producto_id, para no crear un string por entrada.
+    """
+
+    __slots__ = ('valores', 'claves', 'tallas')
+
+    def __init__(self, entradas=()):
+        """entradas = [(valor, clave, talla)] en cualquier orden (se ordenan una sola vez)"""
+        entradas = sorted(entradas, key=lambda e: e[0])
+        self.valores = array('d', (e[0] for e in entradas))
+        self.claves = [e[1] for e in entradas]
+        self.tallas = array('d', (e[2] for e in entradas))
+
+    def __len__(self):
+        return len(self.valores)
+
+    def agregar(self, valor, clave, talla):
+        i = bisect.bisect_right(self.valores, valor)
+        self.valores.insert(i, valor)
+        self.claves.insert(i, clave)
+        self.tallas.insert(i, talla)
+
+    def quitar(self, valor, clave, talla):
+        inicio = bisect.bisect_left(self.valores, valor)
+        for i in range(inicio, bisect.bisect_right(self.valores, valor, inicio)):
+            if self.tallas[i] == talla and self.claves[i] == clave:
+                del self.valores[i], self.claves[i], self.tallas[i]
+                return
+
+    def rango(self, minimo=-math.inf, maximo=math.inf):
+        """[(clave, talla)] con minimo <= valor <= maximo, de menor a mayor valor"""
+        inicio = bisect.bisect_left(self.valores, minimo)
+        fin = bisect.bisect_right(self.valores, maximo, inicio)
+        return list(zip(self.claves[inicio:fin], self.tallas[inicio:fin]))
+
+def entradas_numericas(clave, registro):
+    """([(precio, clave, talla)], [(talla, clave, talla)]) de un modelo; sin los precios NaN"""
+    por_precio = [
+        (valor, clave, talla) for valor, talla in zip(registro.valores, registro.tallas)
+        if not math.isnan(valor)
+    ]
+    return por_precio, [(talla, clave, talla) for talla in registro.tallas]
+
+# Desde cuántas eliminaciones de un lote conviene descartar los índices
+# derivados (búsqueda, rangos) y reconstruirlos en una pasada al consultarlos
+LOTE_REINDEXAR = 256
+
+class CatalogoProductos:
+    """Catálogo en memoria: un ModeloProducto por grupo y modelo, indexado por grupo.
+
+    Los comandos por grupo (/price, /size, /buscar) consultan el índice
+    chat_id -> modelos en vez de recorrer toda la base de datos. Hacia afuera
+    se conserva la interfaz por talla (producto_id = "modelo_talla"), así
+    /eliminar y los observadores funcionan igual que antes.
+    """
+
+    def __init__(self, modelos=None, diario=None):
+        self.modelos = {}     # "chat_id:modelo en minúsculas" -> ModeloProducto
+        self._chats_modelo = {}  # modelo en minúsculas -> {chat_id: None} (grupos que lo publicaron)
+        self.diario = diario
+        self._busqueda = None  # MotorBusqueda, se construye en la primera búsqueda
+        self._numericos = None  # chat_id -> (IndiceOrdenado de precios, de tallas), en el primer filtro
+        self._por_chat = {}   # chat_id -> {clave: None} (en orden de registro)
+        self._conteo_chat = {}  # chat_id -> cantidad de tallas
+        self._total = 0       # Cantidad de tallas (productos) registradas
+        self._observadores = []
+        # Los handlers modifican el catálogo desde el loop; guardar_db(),
+        # hacer_backup() y /metrics lo leen desde otros hilos
+        self._lock = threading.RLock()
+        if modelos:
+            self._cargar(modelos)
+        if diario is not None:
+            self.suscribir(diario.anotar)
+
+    @classmethod
+    def desde_instantanea(cls, instantanea, registros=(), diario=None):
+        """Instantánea compacta (versión 2) u original (un dict por talla) + diario"""
+        if instantanea.get('binario'):
+            catalogo = cls({
+                clave: ModeloProducto.desde_tupla(tupla)
+                for clave, tupla in instantanea['modelos'].items()
+            })
+        elif instantanea.get('version') in (2, VERSION_INSTANTANEA):
+            catalogo = cls({
+                clave: ModeloProducto.desde_dict(datos)
+                for clave, datos in claves_instantanea(instantanea).items()
+            })
+        else:
+            catalogo = cls()
+            for producto_id, producto in instantanea.items():
+                catalogo._aplicar('put', producto_id, producto)
+        for registro in registros:
+            catalogo._aplicar(registro['op'], registro['id'], registro.get('p'))
+        if diario is not None:
+            catalogo.diario = diario
+            catalogo.suscribir(diario.anotar)
+        return catalogo
+
+    def __len__(self):
+        return self._total
+
+    @property
+    def busqueda(self):
+        """Índice de trigramas; construirlo al cargar retrasaría el arranque"""
+        if self._busqueda is None:
+            inicio = time.perf_counter()
+            busqueda = MotorBusqueda()
+            for clave, registro in self.modelos.items():
+                busqueda.agregar(clave, registro.chat_id, registro.modelo)
+            self._busqueda = busqueda
+            logger.info(
+                f"Índice de búsqueda construido en {(time.perf_counter() - inicio) * 1000:.0f} ms "
+                f"({len(self.modelos)} modelos)"
+            )
+        return self._busqueda
+
+    @property
+    def numericos(self):
+        """Índices ordenados de precio y talla por grupo (para /buscar y /price con filtros)"""
+        if self._numericos is None:
+            entradas = {}
+            for clave, registro in self.modelos.items():
+                por_precio, por_talla = entradas.setdefault(registro.chat_id, ([], []))
+                precios, tallas = entradas_numericas(clave, registro)
+                por_precio.extend(precios)
+                por_talla.extend(tallas)
+            self._numericos = {
+                chat_id: (IndiceOrdenado(por_precio), IndiceOrdenado(por_talla))
+                for chat_id, (por_precio, por_talla) in entradas.items()
+            }
+        return self._numericos
+
+    def _indexar_numericos(self, clave, registro, quitar=False):
+        indices = self._numericos.get(registro.chat_id)
+        if indices is None:
+            indices = self._numericos[registro.chat_id] = (IndiceOrdenado(), IndiceOrdenado())
+        for indice, entradas in zip(indices, entradas_numericas(clave, registro)):
+            for entrada in entradas:
+                (indice.quitar if quitar else indice.agregar)(*entrada)
+
+    def __contains__(self, producto_id):
+        return self.get(producto_id) is not None
+
+    def _ubicar(self, producto_id):
+        """(clave, registro, posición) del grupo que tiene esa talla, o (None, None, None).
+
+        El producto_id ("modelo_talla") es único en todo el catálogo, como en
+        el formato original: a lo sumo un grupo tiene cada talla de un modelo.
+        """
+        prefijo, _, talla = producto_id.rpartition('_')
+        for chat_id in self._chats_modelo.get(prefijo, ()):
+            clave = clave_registro(chat_id, prefijo)
+            registro = self.modelos[clave]
+            i = registro.indice(talla)
+            if i is not None:
+                return clave, registro, i
+        return None, None, None
+
+    def get(self, producto_id, default=None):
+        _, registro, i = self._ubicar(producto_id)
+        return registro.producto(i) if registro is not None else default
+
+    def suscribir(self, observador):
+        """Registra observador(op, producto_id, producto) para cada cambio"""
+        self._observadores.append(observador)
+
+    def exportar(self):
+        """Copia {producto_id: producto} de todo el catálogo (formato original)"""
+        with self._lock:
+            modelos = dict(self.modelos)
+        return {
+            f"{prefijo_clave(clave)}_{producto['talla']}": producto
+            for clave, registro in modelos.items()
+            for producto in registro.productos()
+        }
+
+    def copiar_instantanea(self):
+        """Copia barata del estado; retorna una función que arma el JSON compacto.
+
+        Los registros son inmutables, así que basta copiar el diccionario y
+        la serialización puede hacerse después en otro hilo.
+        """
+        with self._lock:
+            copia = dict(self.modelos)
+        return lambda: {
+            'version': VERSION_INSTANTANEA,
+            'modelos': {clave: registro.a_dict() for clave, registro in copia.items()}
+        }
+
+    def instantanea(self):
+        return self.copiar_instantanea()()
+
+    def confirmar(self, forzar=False):
+        """Hace durables los cambios anotados (fsync agrupado + compactación)"""
+        if self.diario is None:
+            return
+        self.diario.sincronizar(forzar)
+        if self.diario.requiere_compactacion():
+            self.diario.compactar(self)
+
+    def cerrar(self):
+        if self.diario is not None:
+            self.diario.cerrar(self)
+
+    def _notificar(self, op, producto_id, producto=None):
+        for observador in self._observadores:
+            observador(op, producto_id, producto)
+
+    def _cargar(self, modelos):
+        """Carga inicial en bloque: solo los índices por grupo (la búsqueda es perezosa)"""
+        self.modelos = dict(modelos)
+        por_chat, conteo = self._por_chat, self._conteo_chat
+        for clave, registro in self.modelos.items():
+            tallas = len(registro.tallas)
+            self._total += tallas
+            conteo[registro.chat_id] = conteo.get(registro.chat_id, 0) + tallas
+            por_chat.setdefault(registro.chat_id, {})[clave] = None
+            self._chats_modelo.setdefault(prefijo_clave(clave), {})[registro.chat_id] = None
+
+    def _poner(self, clave, registro):
+        """Reemplaza (o borra, con None) el registro de un grupo y modelo y sus índices"""
+        anterior = self.modelos.get(clave)
+        if self._numericos is not None:
+            if anterior is not None:
+                self._indexar_numericos(clave, anterior, quitar=True)
+            if registro is not None:
+                self._indexar_numericos(clave, registro)
+        if anterior is not None:
+            self._total -= len(anterior)
+            self._conteo_chat[anterior.chat_id] -= len(anterior)
+            if not self._conteo_chat[anterior.chat_id]:
+                del self._conteo_chat[anterior.chat_id]
+
+        if registro is None:
+            if anterior is None:
+                return
+            del self.modelos[clave]
+            grupo = self._por_chat[anterior.chat_id]
+            del grupo[clave]
+            if not grupo:
+                del self._por_chat[anterior.chat_id]
+            prefijo = prefijo_clave(clave)
+            chats = self._chats_modelo[prefijo]
+            del chats[anterior.chat_id]
+            if not chats:
+                del self._chats_modelo[prefijo]
+            if self._busqueda is not None:
+                self._busqueda.quitar(clave)
+            return
+
+        self.modelos[clave] = registro
+        self._total += len(registro)
+        self._conteo_chat[registro.chat_id] = self._conteo_chat.get(registro.chat_id, 0) + len(registro)
+        self._por_chat.setdefault(registro.chat_id, {})[clave] = None
+        self._chats_modelo.setdefault(prefijo_clave(clave), {})[registro.chat_id] = None
+        if self._busqueda is not None and (anterior is None or anterior.modelo != registro.modelo):
+            self._busqueda.agregar(clave, registro.chat_id, registro.modelo)
+
+    def _aplicar(self, op, producto_id, producto=None):
+        """Aplica un cambio por talla; retorna el producto que sale de su grupo.
+
+        En 'del' es el eliminado; en 'put', el de otro grupo que tenía la misma
+        talla (el id es único y la nueva publicación lo reemplaza), o None.
+        """
+        ubicada, registro, i = self._ubicar(producto_id)
+        if op == 'put':
+            clave = clave_registro(producto['chat_id'], producto_id.rpartition('_')[0])
+            movido = None
+            if ubicada is not None and ubicada != clave:
+                movido = registro.producto(i)
+                self._poner(ubicada, registro.sin_talla(i))
+            anterior = self.modelos.get(clave)
+            if anterior is None:
+                anterior = ModeloProducto(
+                    producto['modelo'], producto['foto'], producto['chat_id'],
+                    producto['msg_id'], producto['user_id']
+                )
+            self._poner(clave, anterior.con_talla(producto))
+            return movido
+
+        if ubicada is None:
+            return None
+        eliminado = registro.producto(i)
+        self._poner(ubicada, registro.sin_talla(i))
+        return eliminado
+
+    # Los cambios se aplican bajo self._lock y se notifican fuera de él: el
+    # diario toma su propio lock y compactar() toma ambos en el orden inverso.
+    # Una talla que pasa a otro grupo se notifica como 'del' (grupo anterior) + 'put'.
+    def registrar(self, producto_id, producto):
+        """Agrega o reemplaza la talla de un modelo manteniendo los índices al día"""
+        producto = con_fecha(producto)
+        with self._lock:
+            movido = self._aplicar('put', producto_id, producto)
+        if movido is not None:
+            self._notificar('del', producto_id, movido)
+        self._notificar('put', producto_id, producto)
+
+    def registrar_lote(self, productos):
+        """Registra [(producto_id, producto)] de una vez (un álbum o caption múltiple)"""
+        ahora = time.time()
+        productos = [(producto_id, con_fecha(producto, ahora)) for producto_id, producto in productos]
+        with self._lock:
+            movidos = [self._aplicar('put', producto_id, producto) for producto_id, producto in productos]
+        for (producto_id, producto), movido in zip(productos, movidos):
+            if movido is not None:
+                self._notificar('del', producto_id, movido)
+            self._notificar('put', producto_id, producto)
+
+    def eliminar(self, producto_id, chat_id=None):
+        """Elimina una talla y la retorna (None si no existía o, con chat_id, si es de otro grupo)"""
+        with self._lock:
+            _, registro, _ = self._ubicar(producto_id)
+            if registro is None or (chat_id is not None and registro.chat_id != chat_id):
+                return None
+            producto = self._aplicar('del', producto_id)
+        if producto is not None:
+            self._notificar('del', producto_id, producto)
+        return producto
+
+    def eliminar_lote(self, producto_ids):
+        """Elimina varias tallas bajo un solo lock; retorna [(producto_id, producto)] eliminados.
+
+        Con LOTE_REINDEXAR o más, el índice de búsqueda y los de rangos se
+        descartan y se vuelven a armar (una sola vez) en la próxima consulta,
+        en lugar de quitar cada entrada de arreglos ordenados.
+        """
+        eliminados = []
+        with self._lock:
+            if len(producto_ids) >= LOTE_REINDEXAR:
+                self._busqueda = None
+                self._numericos = None
+            for producto_id in producto_ids:
+                producto = self._aplicar('del', producto_id)
+                if producto is not None:
+                    eliminados.append((producto_id, producto))
+        for producto_id, producto in eliminados:
+            self._notificar('del', producto_id, producto)
+        return eliminados
+
+    def vencidos(self, chat_id, antes_de, limite=None):
+        """producto_ids del grupo publicados antes de `antes_de` (epoch), del más viejo al más nuevo"""
+        with self._lock:
+            viejos = sorted(
+                (self.modelos[clave].actualizado, clave)
+                for clave in self._por_chat.get(chat_id, {})
+                if self.modelos[clave].actualizado < antes_de
+            )
+            ids = [
+                f"{prefijo_clave(clave)}_{formatear_talla(talla)}"
+                for _, clave in viejos
+                for talla in self.modelos[clave].tallas
+            ]
+        return ids[:limite] if limite else ids
+
+    def con_prefijo(self, chat_id, prefijo):
+        """[(producto_id, producto)] del grupo cuyo modelo empieza con el prefijo (sin distinguir mayúsculas)"""
+        prefijo = prefijo.lower()
+        with self._lock:
+            return [
+                (f"{prefijo_clave(clave)}_{producto['talla']}", producto)
+                for clave in self._por_chat.get(chat_id, {})
+                if prefijo_clave(clave).startswith(prefijo)
+                for producto in self.modelos[clave].productos()
+            ]
+
+    def conteo_por_chat(self):
+        """{chat_id: cantidad de tallas} (para /metrics)"""
+        with self._lock:
+            return dict(self._conteo_chat)
+
+    def productos_chat(self, chat_id):
+        """Productos (uno por talla) de un grupo, en orden de registro"""
+        with self._lock:  # También se lee desde los hilos de la API HTTP
+            return [
+                producto
+                for clave in self._por_chat.get(chat_id, {})
+                for producto in self.modelos[clave].productos()
+            ]
+
+    def version_datos(self):
+        """Solo este proceso modifica el catálogo en memoria (los cambios se ven por observadores)"""
+        return 0
+
+    def tallas_modelo(self, modelo, chat_id):
+        """Tallas registradas para un modelo en un grupo (sin distinguir mayúsculas)"""
+        registro = self.modelos.get(clave_registro(chat_id, modelo.lower()))
+        return [formatear_talla(t) for t in registro.tallas] if registro is not None else []
+
+    def buscar(self, chat_id, consulta, limite=LIMITE_RESULTADOS_BUSQUEDA):
+        """Productos del grupo cuyos modelos coinciden con la consulta, por relevancia"""
+        return [
+            producto
+            for clave, _ in self.busqueda.buscar(chat_id, consulta, limite)
+            for producto in self.modelos[clave].productos()
+        ]
+
+    def filtrar(self, chat_id, talla=None, precio=None, orden=None):
+        """Productos del grupo con talla y/o precio en rango ((min, max) inclusivos).
+
+        Se recorre solo el rango del índice ordenado más selectivo (talla si
+        se pidió, si no precio); con orden 'asc'/'desc' se ordena por precio.
+        Sin rango de precio, los productos sin precio numérico van al final.
+        """
+        with self._lock:
+            indices = self.numericos.get(chat_id)
+            if indices is None:
+                return []
+            por_precio, por_talla = indices
+            if talla is not None:
+                entradas = por_talla.rango(*talla)
+            else:
+                entradas = por_precio.rango(*(precio or (-math.inf, math.inf)))
+            productos = []
+            for clave, valor_talla in entradas:
+                registro = self.modelos[clave]
+                i = bisect.bisect_left(registro.tallas, valor_talla)
+                if talla is not None and precio is not None and not (
+                    precio[0] <= registro.valores[i] <= precio[1]
+                ):
+                    continue
+                productos.append(registro.producto(i))
+            if talla is None and precio is None:
+                # El índice de precios no tiene los NaN: los productos sin precio van al final
+                for clave, valor_talla in por_talla.rango():
+                    registro = self.modelos[clave]
+                    i = bisect.bisect_left(registro.tallas, valor_talla)
+                    if math.isnan(registro.valores[i]):
+                        productos.append(registro.producto(i))
+        if talla is not None or orden == 'desc':
+            return ordenar_por_precio(productos, orden)
+        return productos
+
+
+# =============================================
+# ALMACENAMIENTO SQLITE (OPCIONAL)
+# =============================================
+class CatalogoSQLite:
+    """Catálogo sobre SQLite (WAL) con la misma interfaz que CatalogoProductos.
+
+    Las consultas por grupo, modelo y talla usan índices de la base de datos
+    en lugar de mantener todo el catálogo en memoria. /buscar usa FTS5 con
+    tokenizador de trigramas cuando está disponible.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.RLock()
+        self._observadores = []
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS productos (
+                id TEXT NOT NULL UNIQUE,
+                chat_id INTEGER NOT NULL,
+                modelo_norm TEXT NOT NULL,
+                talla TEXT NOT NULL,
+                datos TEXT NOT NULL,
+                talla_num REAL,
+                precio_num REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_productos_chat ON productos(chat_id);
+            CREATE INDEX IF NOT EXISTS idx_productos_modelo ON productos(modelo_norm, talla);
+            CREATE INDEX IF NOT EXISTS idx_productos_talla ON productos(chat_id, talla);
+        """)
+        self._migrar_numericos()
+        self._migrar_fechas()
+        self.fts = self._crear_fts()
+        self._conexion.commit()
+
+    def _migrar_numericos(self):
+        """Agrega talla_num/precio_num (e índices) a una base creada antes de tenerlos"""
+        columnas = {fila[1] for fila in self._conexion.execute("PRAGMA table_info(productos)")}
+        if 'precio_num' not in columnas:
+            self._conexion.execute("ALTER TABLE productos ADD COLUMN talla_num REAL")
+            self._conexion.execute("ALTER TABLE productos ADD COLUMN precio_num REAL")
+            filas = self._conexion.execute("SELECT rowid, datos FROM productos").fetchall()
+            for rowid, datos in filas:
+                producto = json.loads(datos)
+                producto['talla_num'], producto['precio_num'] = numeros_producto(producto)
+                self._conexion.execute(
+                    "UPDATE productos SET talla_num = ?, precio_num = ?, datos = ? WHERE rowid = ?",
+                    (producto['talla_num'], producto['precio_num'],
+                     json.dumps(producto, ensure_ascii=False), rowid)
+                )
+            logger.info(f"SQLite: talla y precio numéricos agregados a {len(filas)} productos")
+        self._conexion.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_productos_precio ON productos(chat_id, precio_num);
+            CREATE INDEX IF NOT EXISTS idx_productos_talla_num ON productos(chat_id, talla_num);
+        """)
+
+    def _migrar_fechas(self):
+        """Agrega la columna actualizado (e índice); los productos previos cuentan desde ahora"""
+        columnas = {fila[1] for fila in self._conexion.execute("PRAGMA table_info(productos)")}
+        if 'actualizado' not in columnas:
+            self._conexion.execute("ALTER TABLE productos ADD COLUMN actualizado INTEGER")
+            ahora = int(time.time())
+            filas = self._conexion.execute("SELECT rowid, datos FROM productos").fetchall()
+            for rowid, datos in filas:
+                self._conexion.execute(
+                    "UPDATE productos SET actualizado = ?, datos = ? WHERE rowid = ?",
+                    (ahora, json.dumps({**json.loads(datos), 'actualizado': ahora}, ensure_ascii=False), rowid)
+                )
+            logger.info(f"SQLite: fecha de publicación agregada a {len(filas)} productos")
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS idx_productos_actualizado ON productos(chat_id, actualizado)"
+        )
+
+    def _crear_fts(self):
+        try:
+            self._conexion.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+                    modelo_norm, content='productos', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+                    INSERT INTO productos_fts(rowid, modelo_norm) VALUES (new.rowid, new.modelo_norm);
+                END;
+                CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+                    INSERT INTO productos_fts(productos_fts, rowid, modelo_norm)
+                    VALUES ('delete', old.rowid, old.modelo_norm);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite sin FTS5, /buscar usará el índice por grupo: {e}")
+            return False
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._conexion.execute(sql, parametros).fetchall()
+
+    def __len__(self):
+        return self._consultar("SELECT COUNT(*) FROM productos")[0][0]
+
+    def __contains__(self, producto_id):
+        return bool(self._consultar("SELECT 1 FROM productos WHERE id = ?", (producto_id,)))
+
+    def get(self, producto_id, default=None):
+        fila = self._consultar("SELECT datos FROM productos WHERE id = ?", (producto_id,))
+        return json.loads(fila[0][0]) if fila else default
+
+    def suscribir(self, observador):
+        """Registra observador(op, producto_id, producto) para cada cambio"""
+        self._observadores.append(observador)
+
+    def _notificar(self, op, producto_id, producto=None):
+        for observador in self._observadores:
+            observador(op, producto_id, producto)
+
+    def _insertar(self, producto_id, producto):
+        """Inserta o reemplaza; retorna el producto de otro grupo que tenía el mismo id (o None)"""
+        fila = self._conexion.execute(
+            "SELECT chat_id, datos FROM productos WHERE id = ?", (producto_id,)
+        ).fetchone()
+        movido = json.loads(fila[1]) if fila and fila[0] != producto['chat_id'] else None
+        # DELETE + INSERT (no REPLACE) para que los triggers de FTS se disparen
+        self._conexion.execute("DELETE FROM productos WHERE id = ?", (producto_id,))
+        talla, precio = numeros_producto(producto)
+        producto = con_fecha(producto)
+        self._conexion.execute(
+            "INSERT INTO productos (id, chat_id, modelo_norm, talla, datos, talla_num, precio_num, actualizado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (producto_id, producto['chat_id'], ' '.join(normalizar_texto(producto['modelo'])),
+             producto['talla'], json.dumps({**producto, 'talla_num': talla, 'precio_num': precio},
+                                           ensure_ascii=False), talla, precio, producto['actualizado'])
+        )
+        return movido
+
+    # Cada escritura se confirma al instante: una transacción abierta hasta
+    # confirmar() bloquearía a los demás workers (busy timeout) mientras tanto.
+    def registrar(self, producto_id, producto):
+        """Agrega o reemplaza un producto en su propia transacción"""
+        producto = con_fecha(producto)
+        with self._lock:
+            movido = self._insertar(producto_id, producto)
+            self._conexion.commit()
+        if movido is not None:
+            self._notificar('del', producto_id, movido)
+        self._notificar('put', producto_id, producto)
+
+    def registrar_lote(self, productos):
+        """Registra [(producto_id, producto)] en una sola transacción"""
+        ahora = time.time()
+        productos = [(producto_id, con_fecha(producto, ahora)) for producto_id, producto in productos]
+        with self._lock:
+            movidos = [self._insertar(producto_id, producto) for producto_id, producto in productos]
+            self._conexion.commit()
+        for (producto_id, producto), movido in zip(productos, movidos):
+            if movido is not None:
+                self._notificar('del', producto_id, movido)
+            self._notificar('put', producto_id, producto)
+
+    def eliminar(self, producto_id, chat_id=None):
+        """Elimina un producto y lo retorna (None si no existía o, con chat_id, si es de otro grupo)"""
+        with self._lock:
+            producto = self.get(producto_id)
+            if producto is None or (chat_id is not None and producto['chat_id'] != chat_id):
+                return None
+            self._conexion.execute("DELETE FROM productos WHERE id = ?", (producto_id,))
+            self._conexion.commit()
+        self._notificar('del', producto_id, producto)
+        return producto
+
+    def eliminar_lote(self, producto_ids):
+        """Elimina varias tallas en una sola transacción; retorna [(producto_id, producto)] eliminados"""
+        eliminados = []
+        with self._lock:
+            for inicio in range(0, len(producto_ids), 500):  # Límite de parámetros de SQLite
+                parte = list(producto_ids[inicio:inicio + 500])
+                marcas = ', '.join('?' * len(parte))
+                filas = self._conexion.execute(
+                    f"SELECT id, datos FROM productos WHERE id IN ({marcas})", parte
+                ).fetchall()
+                self._conexion.execute(f"DELETE FROM productos WHERE id IN ({marcas})", parte)
+                eliminados.extend((producto_id, json.loads(datos)) for producto_id, datos in filas)
+            self._conexion.commit()
+        for producto_id, producto in eliminados:
+            self._notificar('del', producto_id, producto)
+        return eliminados
+
+    def vencidos(self, chat_id, antes_de, limite=None):
+        """producto_ids del grupo publicados antes de `antes_de` (índice chat_id + actualizado)"""
+        filas = self._consultar(
+            "SELECT id FROM productos WHERE chat_id = ? AND actualizado < ? ORDER BY actualizado LIMIT ?",
+            (chat_id, antes_de, limite or -1)
+        )
+        return [producto_id for (producto_id,) in filas]
+
+    def con_prefijo(self, chat_id, prefijo):
+        """[(producto_id, producto)] del grupo cuyo modelo empieza con el prefijo (el id es "modelo_talla")"""
+        prefijo = prefijo.lower()
+        filas = self._consultar(
+            "SELECT id, datos FROM productos WHERE chat_id = ? AND substr(id, 1, ?) = ? ORDER BY rowid",
+            (chat_id, len(prefijo), prefijo)
+        )
+        return [(producto_id, json.loads(datos)) for producto_id, datos in filas]
+
+    def importar(self, productos):
+        """Carga masiva (migración desde productos_db.json)"""
+        with self._lock:
+            for producto_id, producto in productos.items():
+                self._insertar(producto_id, producto)
+            self._conexion.commit()
+
+    def exportar(self):
+        return {
+            producto_id: json.loads(datos)
+            for producto_id, datos in self._consultar("SELECT id, datos FROM productos ORDER BY rowid")
+        }
+
+    def instantanea(self):
+        return self.exportar()
+
+    def conteo_por_chat(self):
+        return dict(self._consultar("SELECT chat_id, COUNT(*) FROM productos GROUP BY chat_id"))
+
+    def version_datos(self):
+        """Cambia cuando otra conexión (otro worker) confirma cambios en la base"""
+        return self._consultar("PRAGMA data_version")[0][0]
+
+    def productos_chat(self, chat_id):
+        """Productos de un grupo, en orden de registro (índice por chat_id)"""
+        filas = self._consultar(
+            "SELECT datos FROM productos WHERE chat_id = ? ORDER BY rowid", (chat_id,)
+        )
+        return [json.loads(datos) for (datos,) in filas]
+
+    def tallas_modelo(self, modelo, chat_id):
+        filas = self._consultar(
+            "SELECT talla FROM productos WHERE chat_id = ? AND modelo_norm = ? ORDER BY rowid",
+            (chat_id, ' '.join(normalizar_texto(modelo)))
+        )
+        return [talla for (talla,) in filas]
+
+    def buscar(self, chat_id, consulta, limite=LIMITE_RESULTADOS_BUSQUEDA):
+        """Productos del grupo que coinciden con la consulta, por relevancia"""
+        palabras = normalizar_texto(consulta)
+        if not palabras:
+            return []
+
+        # FTS5 (trigramas) solo acepta términos de 3+ caracteres
+        if self.fts and all(len(p) >= 3 for p in palabras):
+            expresion = ' AND '.join(f'"{p}"' for p in palabras)
+            filas = self._consultar(
+                "SELECT p.datos FROM productos_fts f JOIN productos p ON p.rowid = f.rowid "
+                "WHERE productos_fts MATCH ? AND p.chat_id = ? ORDER BY f.rank LIMIT ?",
+                (expresion, chat_id, limite or -1)
+            )
+            if filas:
+                return [json.loads(datos) for (datos,) in filas]
+
+        # Sin coincidencia exacta: relevancia difusa sobre los modelos del grupo
+        filas = self._consultar(
+            "SELECT modelo_norm, datos FROM productos WHERE chat_id = ? ORDER BY rowid", (chat_id,)
+        )
+        puntajes = {}
+        resultados = []
+        for modelo_norm, datos in filas:
+            if modelo_norm not in puntajes:
+                puntajes[modelo_norm] = puntuar(palabras, tuple(modelo_norm.split()))
+            if puntajes[modelo_norm]:
+                resultados.append((puntajes[modelo_norm], json.loads(datos)))
+        resultados.sort(key=lambda r: -r[0])
+        resultados = [producto for _, producto in resultados]
+        return resultados[:limite] if limite else resultados
+
+    def filtrar(self, chat_id, talla=None, precio=None, orden=None):
+        """Productos del grupo con talla y/o precio en rango (índices por chat_id + columna)"""
+        condiciones, parametros = ["chat_id = ?"], [chat_id]
+        if talla is not None:
+            condiciones.append("talla_num BETWEEN ? AND ?")
+            parametros.extend(talla)
+        if precio is not None:
+            condiciones.append("precio_num BETWEEN ? AND ?")
+            parametros.extend(precio)
+        orden_sql = {
+            'asc': "precio_num IS NULL, precio_num", 'desc': "precio_num IS NULL, precio_num DESC"
+        }.get(orden, "rowid")
+        filas = self._consultar(
+            f"SELECT datos FROM productos WHERE {' AND '.join(condiciones)} ORDER BY {orden_sql}",
+            parametros
+        )
+        return [json.loads(datos) for (datos,) in filas]
+
+    def confirmar(self, forzar=False):
+        """COMMIT de una transacción pendiente (las escrituras ya confirman solas)"""
+        with self._lock:
+            self._conexion.commit()
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.commit()
+            self._conexion.close()
+
+
 # Cargar la base de datos al iniciar
-productos_db = cargar_db()
-logger.info(f"Base de datos cargada. Productos registrados: {len(productos_db)}")
+catalogo = cargar_db()
+catalogo.suscribir(respaldos.anotar)
+metricas.calculada(
+    'chokolo_catalogo_productos', 'gauge', "Productos (tallas) registrados por grupo",
+    lambda: {(('chat_id', chat_id),): total for chat_id, total in catalogo.conteo_por_chat().items()},
+    por_proceso=False   # Con workers el catálogo es la base SQLite compartida: lo cuenta el front
+)
+logger.info(f"Base de datos cargada. Productos registrados: {len(catalogo)}")
 
 # Patrón más flexible para productos
 PATRON_PRODUCTO = re.compile(
@@ -133,6 +2107,240 @@ PATRON_PRODUCTO = re.compile(
     re.IGNORECASE | re.MULTILINE
 )
 
+def interpretar_publicacion(texto):
+    """Todos los bloques modelo/tallas/precio de un caption, en una sola pasada.
+
+    Retorna (bloques, tallas_invalidas) con bloques = [(modelo, tallas, precio)]
+    y las tallas ya normalizadas ('11' -> '11.0').
+    """
+    bloques, tallas_invalidas = [], []
+    for match in PATRON_PRODUCTO.finditer(texto):
+        datos = match.groupdict()
+        modelo = datos['modelo'].strip()
+        precio = re.sub(r'(USD|\$|\s)', '', datos['precio']).strip()  # Normaliza a "65"
+        tallas = []
+        for talla in re.split(r'\s*(?:,|y|\/)\s*', datos['tallas']):
+            talla = talla.strip()
+            try:
+                tallas.append(formatear_talla(talla))
+            except ValueError:
+                tallas_invalidas.append(talla)
+        if tallas:
+            bloques.append((modelo, tallas, precio))
+    return bloques, tallas_invalidas
+
+# =============================================
+# CACHÉ DE ADMINISTRADORES POR GRUPO
+# =============================================
+TTL_ADMINISTRADORES = 300       # Segundos antes de volver a consultar a Telegram
+ESTADOS_ADMIN = {ChatMember.ADMINISTRATOR, ChatMember.OWNER}
+
+class CacheAdministradores:
+    """Conjunto de IDs de administradores por grupo, con TTL.
+
+    Evita una llamada a get_chat_administrators por cada foto o comando;
+    se invalida cuando un ChatMemberUpdated promueve o degrada a alguien.
+    """
+
+    def __init__(self, ttl=TTL_ADMINISTRADORES):
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._admins = {}      # chat_id -> (expira, frozenset de user_id)
+        self._en_curso = {}    # chat_id -> tarea de consulta (una por grupo)
+
+    async def es_admin(self, bot, chat_id, user_id):
+        entrada = self._admins.get(chat_id)
+        if entrada is not None and entrada[0] > time.monotonic():
+            self.aciertos += 1
+            return user_id in entrada[1]
+
+        self.fallos += 1
+        tarea = self._en_curso.get(chat_id)
+        if tarea is None:
+            # Varias fotos simultáneas comparten una sola consulta a la API
+            tarea = asyncio.ensure_future(self._consultar(bot, chat_id))
+            self._en_curso[chat_id] = tarea
+        return user_id in await tarea
+
+    async def _consultar(self, bot, chat_id):
+        try:
+            admins = await bot.get_chat_administrators(chat_id)
+            ids = frozenset(admin.user.id for admin in admins)
+            self._admins[chat_id] = (time.monotonic() + self.ttl, ids)
+            return ids
+        finally:
+            self._en_curso.pop(chat_id, None)
+
+    def invalidar(self, chat_id):
+        self._admins.pop(chat_id, None)
+
+    def estadisticas(self):
+        return {'aciertos': self.aciertos, 'fallos': self.fallos, 'grupos': len(self._admins)}
+
+cache_admins = CacheAdministradores()
+
+# =============================================
+# COLA DE SALIDA CON LÍMITES DE ENVÍO
+# =============================================
+# Límites de Telegram: ~30 mensajes/s en total y ~20 mensajes/min por grupo
+TASA_GLOBAL = 25                # Mensajes por segundo (todos los chats)
+TASA_POR_CHAT = 20 / 60         # Mensajes por segundo en un mismo grupo
+RAFAGA_POR_CHAT = 5             # Mensajes seguidos permitidos antes de espaciar
+REINTENTOS_ENVIO = 3
+VENTANA_BIENVENIDA = 5          # Segundos para juntar a quienes entran a la vez
+
+class CuboTokens:
+    """Token bucket: `tasa` tokens por segundo hasta un máximo de `capacidad`"""
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.actualizado = time.monotonic()
+
+    def _espera(self):
+        """Consume un token si hay; si no, retorna los segundos que faltan"""
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.tasa
+
+    async def adquirir(self):
+        while (espera := self._espera()) > 0:
+            await asyncio.sleep(espera)
+
+class ColaSalida:
+    """Planificador central de envíos a Telegram.
+
+    Una cola FIFO por chat (el orden dentro de un grupo se respeta) con su
+    propio token bucket, más un bucket global. Los 429 se reintentan tras
+    el retry_after que indica Telegram.
+    """
+
+    def __init__(self, tasa_global=None):
+        tasa_global = tasa_global or TASA_GLOBAL
+        self._global = CuboTokens(tasa_global, tasa_global)
+        self._cubos = {}          # chat_id -> CuboTokens
+        self._colas = {}          # chat_id -> deque[(funcion, kwargs, futuro)]
+        self._trabajadores = {}   # chat_id -> tarea que vacía su cola
+        self.enviados = 0
+        self.limitados = 0        # Respuestas 429 recibidas
+        self.errores = 0
+
+    def enviar(self, chat_id, funcion, /, **kwargs):
+        """Encola funcion(**kwargs); retorna un futuro con el resultado (opcional esperarlo)"""
+        futuro = asyncio.get_running_loop().create_future()
+        # Si nadie espera el futuro, que un error no termine en "exception never retrieved"
+        futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._colas.setdefault(chat_id, deque()).append((funcion, kwargs, futuro))
+        if chat_id not in self._trabajadores:
+            self._trabajadores[chat_id] = asyncio.ensure_future(self._trabajar(chat_id))
+        return futuro
+
+    def pendientes(self):
+        return sum(len(cola) for cola in list(self._colas.values()))
+
+    async def vaciar(self, timeout=10):
+        """Espera a que se envíe lo encolado (al apagar el bot)"""
+        if self._trabajadores:
+            await asyncio.wait(list(self._trabajadores.values()), timeout=timeout)
+
+    async def _trabajar(self, chat_id):
+        cola = self._colas[chat_id]
+        cubo = self._cubos.setdefault(chat_id, CuboTokens(TASA_POR_CHAT, RAFAGA_POR_CHAT))
+        try:
+            while cola:
+                funcion, kwargs, futuro = cola[0]
+                await cubo.adquirir()
+                await self._global.adquirir()
+                try:
+                    futuro.set_result(await self._llamar(funcion, kwargs))
+                    self.enviados += 1
+                except Exception as e:
+                    self.errores += 1
+                    logger.error(f"Error enviando a {chat_id}: {e}")
+                    futuro.set_exception(e)
+                cola.popleft()
+        finally:
+            del self._trabajadores[chat_id]
+            if not cola:
+                del self._colas[chat_id]
+
+    async def _llamar(self, funcion, kwargs):
+        for intento in range(REINTENTOS_ENVIO + 1):
+            try:
+                return await funcion(**kwargs)
+            except RetryAfter as e:
+                self.limitados += 1
+                if intento == REINTENTOS_ENVIO:
+                    raise
+                await asyncio.sleep(segundos(e.retry_after))
+            except BadRequest:
+                raise  # No tiene sentido reintentar un mensaje inválido
+            except (TimedOut, NetworkError):
+                if intento == REINTENTOS_ENVIO:
+                    raise
+                await asyncio.sleep(2 ** intento)
+
+def segundos(valor):
+    """retry_after puede llegar como número o como timedelta"""
+    return valor.total_seconds() if isinstance(valor, timedelta) else float(valor)
+
+def unir_nombres(nombres, maximo=15):
+    """['Ana', 'Luis', 'Pedro'] -> 'Ana, Luis y Pedro'"""
+    if len(nombres) > maximo:
+        nombres = nombres[:maximo] + [f"{len(nombres) - maximo} más"]
+    if len(nombres) == 1:
+        return nombres[0]
+    return f"{', '.join(nombres[:-1])} y {nombres[-1]}"
+
+class BienvenidasAgrupadas:
+    """Junta las entradas de VENTANA_BIENVENIDA segundos en un solo saludo"""
+
+    def __init__(self, ventana=VENTANA_BIENVENIDA):
+        self.ventana = ventana
+        self._pendientes = {}   # chat_id -> [nombres]
+
+    def agregar(self, bot, chat_id, nombre):
+        if chat_id not in self._pendientes:
+            self._pendientes[chat_id] = []
+            asyncio.get_running_loop().call_later(self.ventana, self._saludar, bot, chat_id)
+        self._pendientes[chat_id].append(nombre)
+
+    def _saludar(self, bot, chat_id):
+        nombres = self._pendientes.pop(chat_id, [])
+        if not nombres:
+            return
+        mensaje_completo = f"{MENSAJE_BIENVENIDA.format(nombre=unir_nombres(nombres))}\n\n📍 Pagina Web: {SITIO_WEB}"
+        cola_salida.enviar(
+            chat_id,
+            bot.send_message,
+            chat_id=chat_id,
+            text=mensaje_completo,
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+
+cola_salida = ColaSalida()
+bienvenidas = BienvenidasAgrupadas()
+
+metricas.calculada(
+    'chokolo_cola_salida_pendientes', 'gauge', "Mensajes esperando en la cola de salida",
+    lambda: {(): cola_salida.pendientes()}
+)
+metricas.calculada(
+    'chokolo_cola_salida_mensajes_total', 'counter', "Mensajes de la cola de salida por resultado",
+    lambda: {
+        (('resultado', 'enviado'),): cola_salida.enviados,
+        (('resultado', 'limitado'),): cola_salida.limitados,
+        (('resultado', 'error'),): cola_salida.errores
+    }
+)
+
 # =============================================
 # MENSAJES PREDEFINIDOS (TEXTO ORIGINAL)
 # =============================================
@@ -179,12 +2387,553 @@ async def enviar_respuesta(update: Update, texto: str, reply_to: int = None):
     }
     if reply_to:
         params['reply_to_message_id'] = reply_to
-    
-    await update.message.reply_text(**params)
+
+    # Pasa por la cola de salida: respeta los límites de Telegram sin bloquear al handler
+    cola_salida.enviar(update.effective_chat.id, update.message.reply_text, **params)
+
+# =============================================
+# RESPUESTAS PRECALCULADAS (/price, /size)
+# =============================================
+LIMITE_MENSAJE = 4096           # Límite de Telegram (en unidades UTF-16)
+MARGEN_FOOTER = 100             # Espacio para el footer de agregar_footer
+
+def largo_telegram(texto):
+    """Largo tal como lo cuenta Telegram (los emojis cuentan doble)"""
+    return len(texto.encode('utf-16-le')) // 2
+
+def cortar_linea(linea, limite, disponible):
+    """Trozos de una línea que no entra en un mensaje, cortados en un espacio si se puede.
+
+    El primero ocupa lo que queda del mensaje en curso (`disponible`); los
+    demás, hasta `limite` cada uno.
+    """
+    trozos = []
+    while largo_telegram(linea) > disponible:
+        # Caracteres que entran dejando lugar para el salto de línea (sin partir un emoji)
+        corte, largo = 0, 0
+        for caracter in linea:
+            largo += 2 if ord(caracter) > 0xFFFF else 1
+            if largo > disponible - 1:
+                break
+            corte += 1
+        espacio = linea.rfind(' ', 0, corte)
+        if espacio > 0:
+            trozos.append(linea[:espacio] + "\n")
+            linea = linea[espacio + 1:]
+        elif corte:
+            trozos.append(linea[:corte] + "\n")
+            linea = linea[corte:]
+        disponible = limite
+    trozos.append(linea)
+    return trozos
+
+def dividir_mensaje(encabezado, lineas, limite=LIMITE_MENSAJE - MARGEN_FOOTER):
+    """Reparte las líneas en mensajes que no superan el límite.
+
+    Las líneas no se cortan, salvo una que sola ya no entra en un mensaje.
+    """
+    partes = []
+    actual, largo = encabezado, largo_telegram(encabezado)
+    for linea in lineas:
+        largo_linea = largo_telegram(linea)
+        trozos = [linea] if largo_linea <= limite else cortar_linea(linea, limite, limite - largo)
+        for trozo in trozos:
+            largo_trozo = largo_telegram(trozo)
+            if largo + largo_trozo > limite and actual:
+                partes.append(actual)
+                actual, largo = "", 0
+            actual += trozo
+            largo += largo_trozo
+    partes.append(actual)
+    return partes
+
+def tallas_por_modelo(productos):
+    """{modelo: [(talla, precio)]} con las tallas ordenadas numéricamente"""
+    modelos = {}
+    for p in productos:
+        modelos.setdefault(p['modelo'], []).append((p['talla'], p['precio']))
+    for tallas in modelos.values():
+        tallas.sort(key=lambda t: float(t[0]))
+    return modelos
+
+def renderizar_precios(productos):
+    lineas = []
+    for modelo, tallas in tallas_por_modelo(productos).items():
+        precios = {}
+        for talla, precio in tallas:
+            precios.setdefault(precio, []).append(talla)
+        detalle = ' / '.join(
+            f"{', '.join(tallas_precio)} — {precio}" for precio, tallas_precio in precios.items()
+        )
+        lineas.append(f"▪️ *{modelo}*: {detalle}\n")
+    return dividir_mensaje("💰 *Lista de Precios* 💰\n\n", lineas)
+
+def renderizar_tallas(productos):
+    lineas = [
+        f"▪️ *{modelo}*: {', '.join(talla for talla, _ in tallas)}\n"
+        for modelo, tallas in tallas_por_modelo(productos).items()
+    ]
+    return dividir_mensaje("👟 *Tallas Disponibles* (US) 👟\n\n", lineas)
+
+class CacheRespuestas:
+    """Respuestas renderizadas por (chat_id, comando).
+
+    Se invalidan solo cuando cambia el catálogo de ese grupo, así que un
+    /price repetido en un grupo concurrido no vuelve a recorrer productos.
+    """
+
+    def __init__(self):
+        self._respuestas = {}   # (chat_id, comando) -> [mensajes]
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, chat_id, comando, renderizar):
+        """Mensajes ya divididos; [] si el grupo no tiene productos"""
+        clave = (chat_id, comando)
+        partes = self._respuestas.get(clave)
+        if partes is not None:
+            self.aciertos += 1
+            return partes
+        self.fallos += 1
+        productos = catalogo.productos_chat(chat_id)
+        partes = renderizar(productos) if productos else []
+        self._respuestas[clave] = partes
+        return partes
+
+    def invalidar(self, chat_id):
+        for comando in ('price', 'size'):
+            self._respuestas.pop((chat_id, comando), None)
+
+    def anotar(self, op, producto_id, producto=None):
+        """Observador del catálogo: invalida el grupo del producto modificado"""
+        if producto is not None:
+            self.invalidar(producto['chat_id'])
+
+cache_respuestas = CacheRespuestas()
+catalogo.suscribir(cache_respuestas.anotar)
+
+# =============================================
+# API DE CATÁLOGO (SOLO LECTURA)
+# =============================================
+API_LIMITE_PAGINA = 50          # Modelos por página si no se pide ?limit=
+API_LIMITE_MAXIMO = 200
+API_MINIMO_GZIP = 1024          # Respuestas más chicas (bytes) no se comprimen
+API_RESPUESTAS_GUARDADAS = 64   # Páginas/búsquedas serializadas por instantánea
+
+def codificar_cursor(valor):
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip('=') if valor is not None else None
+
+def decodificar_cursor(cursor):
+    """Cursor opaco -> texto (ValueError si no es válido)"""
+    try:
+        return base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Cursor inválido: {e}") from None
+
+class InstantaneaGrupo:
+    """Catálogo de un grupo listo para servir por HTTP; no se modifica nunca.
+
+    Un cambio en el grupo hace que la próxima petición arme otra y la
+    reemplace en una sola asignación, así los lectores nunca ven un estado a
+    medias ni toman el lock del catálogo. Las respuestas ya serializadas
+    (JSON, gzip y ETag) se guardan acá y se descartan con la instantánea.
+    """
+
+    def __init__(self, chat_id, version, productos):
+        self.chat_id = chat_id
+        self.version = version
+        modelos = {}
+        for p in productos:
+            clave = p['modelo'].lower()
+            modelo = modelos.get(clave)
+            if modelo is None:
+                modelo = modelos[clave] = {
+                    'id': clave, 'modelo': p['modelo'], 'foto': p['foto'], 'actualizado': None, 'tallas': []
+                }
+            if p.get('actualizado') is not None:
+                modelo['actualizado'] = max(modelo['actualizado'] or 0, p['actualizado'])
+            talla, precio = numeros_producto(p)
+            modelo['tallas'].append({
+                'talla': p['talla'], 'precio': p['precio'], 'talla_num': talla, 'precio_num': precio
+            })
+        for modelo in modelos.values():
+            modelo['tallas'].sort(key=lambda t: t['talla_num'])
+        self.ids = sorted(modelos)      # El cursor es el último id entregado
+        self.modelos = [modelos[clave] for clave in self.ids]
+        self._tokens = [normalizar_texto(m['modelo']) for m in self.modelos]
+        self._respuestas = {}
+
+    def pagina(self, cursor=None, limite=API_LIMITE_PAGINA):
+        """Modelos en orden de id a partir del cursor (estable aunque se agreguen otros)"""
+        inicio = bisect.bisect_right(self.ids, cursor) if cursor is not None else 0
+        items = self.modelos[inicio:inicio + limite]
+        hay_mas = inicio + limite < len(self.modelos)
+        return {
+            'chat_id': self.chat_id,
+            'total': len(self.modelos),
+            'items': items,
+            'next_cursor': codificar_cursor(items[-1]['id']) if hay_mas else None
+        }
+
+    def buscar(self, consulta, desde=0, limite=API_LIMITE_PAGINA):
+        """Modelos que coinciden con la consulta (texto y/o filtros de /buscar), por relevancia"""
+        texto, filtros = interpretar_filtros(consulta)
+        palabras = normalizar_texto(texto)
+        resultados = []
+        for modelo, tokens in zip(self.modelos, self._tokens):
+            puntaje = puntuar(palabras, tokens) if palabras else 1.0
+            if not puntaje:
+                continue
+            tallas = [t for t in modelo['tallas'] if cumple_filtros(t, filtros)]
+            if tallas:
+                resultados.append((puntaje, {**modelo, 'tallas': tallas}))
+        resultados.sort(key=lambda r: -r[0])
+        items = [modelo for _, modelo in resultados]
+        if filtros['orden'] is not None:
+            # Cada modelo según su talla más barata (o más cara) dentro del filtro
+            mejor = min if filtros['orden'] == 'asc' else max
+            precios = [
+                (mejor((t['precio_num'] for t in m['tallas'] if t['precio_num'] is not None), default=None), m)
+                for m in items
+            ]
+            conocidos = sorted(
+                (e for e in precios if e[0] is not None), key=lambda e: e[0], reverse=mejor is max
+            )
+            items = [m for _, m in conocidos] + [m for precio, m in precios if precio is None]
+        pagina = items[desde:desde + limite]
+        return {
+            'chat_id': self.chat_id,
+            'q': consulta,
+            'total': len(items),
+            'items': pagina,
+            'next_cursor': codificar_cursor(str(desde + limite)) if desde + limite < len(items) else None
+        }
+
+    def respuesta(self, clave, generar):
+        """(cuerpo, etag, cuerpo gzip o None) de una respuesta; se serializa una sola vez"""
+        guardada = self._respuestas.get(clave)
+        if guardada is None:
+            cuerpo = json.dumps(generar(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            comprimido = gzip.compress(cuerpo, compresslevel=6) if len(cuerpo) >= API_MINIMO_GZIP else None
+            guardada = (cuerpo, hashlib.sha256(cuerpo).hexdigest()[:32], comprimido)
+            if len(self._respuestas) < API_RESPUESTAS_GUARDADAS:
+                self._respuestas[clave] = guardada
+        return guardada
+
+class ApiCatalogo:
+    """Instantáneas por grupo para la API HTTP (se suscribe al catálogo).
+
+    El observador solo incrementa la versión del grupo (no arma nada en el
+    loop del bot); la instantánea se reconstruye en el hilo de la petición
+    que la encuentre desactualizada. Una talla que pasa a otro grupo llega
+    como 'del' + 'put', así que cambian la versión (y el ETag) de ambos.
+    """
+
+    def __init__(self):
+        self._instantaneas = {}   # chat_id -> InstantaneaGrupo
+        self._versiones = {}      # chat_id -> cambios anotados en este proceso
+
+    def anotar(self, op, producto_id, producto=None):
+        """Observador del catálogo: invalida la instantánea del grupo del producto"""
+        if producto is not None:
+            chat_id = producto['chat_id']
+            self._versiones[chat_id] = self._versiones.get(chat_id, 0) + 1
+
+    def instantanea(self, chat_id):
+        # version_datos() detecta cambios hechos por otros procesos (SQLite)
+        version = (self._versiones.get(chat_id, 0), catalogo.version_datos())
+        actual = self._instantaneas.get(chat_id)
+        if actual is None or actual.version != version:
+            actual = InstantaneaGrupo(chat_id, version, catalogo.productos_chat(chat_id))
+            self._instantaneas[chat_id] = actual
+        return actual
+
+api_catalogo = ApiCatalogo()
+catalogo.suscribir(api_catalogo.anotar)
+
+# =============================================
+# ÍNDICE DE FOTOS (HASH PERCEPTUAL)
+# =============================================
+DISTANCIA_DUPLICADO = 6         # Bits distintos (de 64) para avisar de una foto repetida
+DISTANCIA_BUSQUEDA_FOTO = 12    # Bits distintos para /buscar respondiendo a una foto
+
+# NumPy y Pillow se importan la primera vez que se usan (no retrasan el
+# arranque); si no están instalados el bot funciona igual, sin el índice.
+np = Image = None
+_fotos_disponibles = None
+
+def dependencias_fotos():
+    """True si NumPy y Pillow están disponibles"""
+    global np, Image, _fotos_disponibles
+    if _fotos_disponibles is None:
+        try:
+            import numpy as np
+            from PIL import Image
+            _fotos_disponibles = True
+        except ImportError as e:
+            logger.warning(f"Índice de fotos desactivado (falta {e.name})")
+            _fotos_disponibles = False
+    return _fotos_disponibles
+
+@functools.lru_cache(maxsize=1)
+def matriz_dct(n=32):
+    """Matriz de la DCT-II ortonormal de n x n"""
+    k = np.arange(n).reshape(-1, 1)
+    matriz = np.cos(np.pi * (2 * np.arange(n) + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matriz[0] /= np.sqrt(2)
+    return matriz
+
+def hash_perceptual(datos):
+    """pHash de 64 bits (hex): DCT de la imagen 32x32 en grises, bit = coeficiente 8x8 > mediana.
+
+    Fotos iguales recomprimidas, reescaladas o con otro tamaño de Telegram
+    quedan a pocos bits de distancia.
+    """
+    with Image.open(io.BytesIO(datos)) as imagen:
+        pixeles = np.asarray(imagen.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    dct = matriz_dct() @ pixeles @ matriz_dct().T
+    bloque = dct[:8, :8].ravel()
+    bits = bloque > np.median(bloque)
+    return format(int.from_bytes(np.packbits(bits).tobytes(), 'big'), '016x')
+
+def contar_bits(valores):
+    """Bits en 1 de cada uint64 (popcount vectorizado)"""
+    if hasattr(np, 'bitwise_count'):   # NumPy >= 2.0
+        return np.bitwise_count(valores)
+    return np.unpackbits(valores.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+async def calcular_phash(bot, fotos_mensaje):
+    """pHash de la foto de un mensaje (None si no se puede descargar o procesar).
+
+    Se descarga la miniatura más chica: alcanza para 32x32 y pesa pocos KB.
+    """
+    if not fotos_mensaje or not dependencias_fotos():
+        return None
+    try:
+        archivo = await bot.get_file(fotos_mensaje[0].file_id)
+        datos = await archivo.download_as_bytearray()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, hash_perceptual, bytes(datos))
+    except Exception as e:
+        logger.warning(f"No se pudo calcular el hash de la foto: {e}")
+        return None
+
+class IndiceFotos:
+    """Hashes perceptuales del catálogo en arreglos NumPy.
+
+    Una búsqueda es un XOR + popcount sobre todo el arreglo (sin recorrer
+    productos en Python). Se construye en segundo plano al arrancar (o en la
+    primera consulta, en el executor) y después se mantiene como observador
+    del catálogo.
+    """
+
+    def __init__(self):
+        self._hashes = None     # uint64 por posición
+        self._chats = None      # chat_id por posición
+        self._vivos = None      # False en posiciones liberadas
+        self._ids = []          # posición -> producto_id
+        self._posiciones = {}   # producto_id -> posición
+        self._por_modelo = {}   # (chat_id, modelo) -> {producto_id} (el hash es del modelo)
+        self._libres = []
+        self._cambios = None    # Cambios recibidos mientras se construye (se aplican al terminar)
+        self._lock = threading.Lock()
+        self._lock_construccion = threading.Lock()
+
+    @property
+    def listo(self):
+        return self._hashes is not None
+
+    def construir(self):
+        """Carga los hashes del catálogo (no hace nada si ya está cargado).
+
+        Los arreglos se arman fuera de self._lock, así anotar() (que corre en
+        el loop con cada registro) no espera la construcción: solo guarda el
+        cambio para aplicarlo cuando se reemplazan los arreglos.
+        """
+        if not dependencias_fotos():
+            return
+        with self._lock_construccion:
+            if self.listo:
+                return
+            with self._lock:
+                self._cambios = []
+            arreglos = None
+            try:
+                arreglos = self._construir()
+            finally:
+                with self._lock:
+                    cambios, self._cambios = self._cambios, None
+                    if arreglos is not None:
+                        (self._hashes, self._chats, self._vivos, self._ids,
+                         self._posiciones, self._por_modelo) = arreglos
+                        for cambio in cambios:
+                            self._aplicar(*cambio)
+            logger.info(f"🖼️ Índice de fotos: {len(self._posiciones)} productos con hash")
+
+    def _construir(self):
+        con_hash = [(pid, p) for pid, p in catalogo.exportar().items() if p.get('phash')]
+        capacidad = max(1024, 2 * len(con_hash))
+        hashes = np.zeros(capacidad, dtype=np.uint64)
+        chats = np.zeros(capacidad, dtype=np.int64)
+        vivos = np.zeros(capacidad, dtype=bool)
+        n = len(con_hash)
+        hashes[:n] = [int(p['phash'], 16) for _, p in con_hash]
+        chats[:n] = [p['chat_id'] for _, p in con_hash]
+        vivos[:n] = True
+        ids = [pid for pid, _ in con_hash]
+        por_modelo = {}
+        for pid, p in con_hash:
+            por_modelo.setdefault((p['chat_id'], pid.rpartition('_')[0]), set()).add(pid)
+        return hashes, chats, vivos, ids, {pid: i for i, pid in enumerate(ids)}, por_modelo
+
+    def _poner(self, producto_id, phash, chat_id):
+        posicion = self._posiciones.get(producto_id)
+        if posicion is None:
+            if self._libres:
+                posicion = self._libres.pop()
+                self._ids[posicion] = producto_id
+            else:
+                posicion = len(self._ids)
+                self._ids.append(producto_id)
+                if posicion == len(self._hashes):
+                    self._hashes = np.resize(self._hashes, posicion * 2)
+                    self._chats = np.resize(self._chats, posicion * 2)
+                    self._vivos = np.resize(self._vivos, posicion * 2)
+                    self._vivos[posicion:] = False
+            self._posiciones[producto_id] = posicion
+        self._hashes[posicion] = phash
+        self._chats[posicion] = chat_id
+        self._vivos[posicion] = True
+
+    def _quitar(self, producto_id):
+        posicion = self._posiciones.pop(producto_id, None)
+        if posicion is not None:
+            self._vivos[posicion] = False
+            clave = (int(self._chats[posicion]), producto_id.rpartition('_')[0])
+            self._ids[posicion] = None
+            self._libres.append(posicion)
+            ids = self._por_modelo.get(clave)
+            if ids is not None:
+                ids.discard(producto_id)
+                if not ids:
+                    del self._por_modelo[clave]
+
+    def _aplicar(self, op, producto_id, producto=None):
+        if op != 'put':
+            self._quitar(producto_id)
+            return
+        # El hash es del modelo: una nueva foto reemplaza el de todas sus tallas en el grupo
+        clave = (producto['chat_id'], producto_id.rpartition('_')[0])
+        tallas = self._por_modelo.get(clave, set()) | {producto_id}
+        if not producto.get('phash'):
+            for pid in tallas:
+                self._quitar(pid)
+            return
+        phash = int(producto['phash'], 16)
+        for pid in tallas:
+            self._poner(pid, phash, producto['chat_id'])
+        self._por_modelo[clave] = tallas
+
+    def anotar(self, op, producto_id, producto=None):
+        """Observador del catálogo (antes de construir el índice no hace nada)"""
+        with self._lock:
+            if self._cambios is not None:
+                self._cambios.append((op, producto_id, producto))
+            elif self.listo:
+                self._aplicar(op, producto_id, producto)
+
+    async def preparar(self):
+        """Construye el índice en el executor si todavía no está (sin bloquear el loop)"""
+        if not self.listo and dependencias_fotos():
+            await asyncio.get_running_loop().run_in_executor(None, self.construir)
+
+    def buscar(self, phash, chat_id, distancia_maxima, limite=None):
+        """[(producto_id, distancia)] del grupo, de la foto más parecida a la menos"""
+        if phash is None or not dependencias_fotos():
+            return []
+        with self._lock:
+            if not self.listo:
+                return []
+            n = len(self._ids)
+            distancias = contar_bits(self._hashes[:n] ^ np.uint64(int(phash, 16)))
+            candidatos = np.flatnonzero(
+                self._vivos[:n] & (self._chats[:n] == chat_id) & (distancias <= distancia_maxima)
+            )
+            orden = candidatos[np.argsort(distancias[candidatos], kind='stable')][:limite]
+            return [(self._ids[i], int(distancias[i])) for i in orden]
+
+    async def parecidos(self, phash, chat_id, distancia_maxima, limite=None):
+        """Productos del grupo con foto parecida, ordenados por distancia"""
+        await self.preparar()
+        productos = []
+        for producto_id, _ in self.buscar(phash, chat_id, distancia_maxima, limite):
+            producto = catalogo.get(producto_id)
+            if producto is not None:
+                productos.append(producto)
+        return productos
+
+indice_fotos = IndiceFotos()
+catalogo.suscribir(indice_fotos.anotar)
+
+# =============================================
+# VENCIMIENTO DE PUBLICACIONES
+# =============================================
+# Cada modelo guarda la fecha de su última publicación; un job de la
+# JobQueue borra en lotes los que superan el TTL de su grupo. Volver a
+# publicar un modelo renueva su fecha. Viene apagado: se activa para todos
+# con TTL_PUBLICACIONES_DIAS o solo para algunos grupos con TTL_GRUPOS.
+TTL_PUBLICACIONES_DIAS = float(os.getenv('TTL_PUBLICACIONES_DIAS', '0'))   # 0 = no vencen
+VENCIMIENTO_INTERVALO = 3600    # Segundos entre revisiones
+VENCIMIENTO_PRIMERA = 60        # Primera revisión tras arrancar
+LOTE_VENCIMIENTO = 500          # Tallas eliminadas por lote (entre lote y lote corren los handlers)
+
+def leer_ttl_grupos(texto):
+    """TTL_GRUPOS='-100123:15,-100456:0' -> {chat_id: días}"""
+    ttl = {}
+    for par in filter(None, (p.strip() for p in texto.split(','))):
+        try:
+            chat_id, dias = par.rsplit(':', 1)
+            ttl[int(chat_id)] = float(dias)
+        except ValueError:
+            logger.warning(f"TTL_GRUPOS: entrada inválida '{par}' (formato chat_id:días), se ignora")
+    return ttl
+
+TTL_GRUPOS = leer_ttl_grupos(os.getenv('TTL_GRUPOS', ''))
+
+def ttl_grupo(chat_id):
+    """Segundos que dura una publicación en el grupo (0 = no vence)"""
+    return TTL_GRUPOS.get(chat_id, TTL_PUBLICACIONES_DIAS) * 86400
+
+async def expirar_publicaciones(context: ContextTypes.DEFAULT_TYPE):
+    """Job periódico: elimina en lotes las tallas que superaron el TTL de su grupo.
+
+    Cada lote es una sola operación del catálogo (los observadores invalidan
+    cachés e índices del grupo) y todo se confirma con una sola escritura al
+    final. En modo multiproceso cada worker vence solo sus propios grupos.
+    """
+    worker = context.job.data   # (indice, total) o None
+    ahora = time.time()
+    total = 0
+    for chat_id in list(catalogo.conteo_por_chat()):
+        if worker is not None and worker_de_chat(chat_id, worker[1]) != worker[0]:
+            continue
+        ttl = ttl_grupo(chat_id)
+        if ttl <= 0:
+            continue
+        ids = catalogo.vencidos(chat_id, ahora - ttl)
+        for inicio in range(0, len(ids), LOTE_VENCIMIENTO):
+            total += len(catalogo.eliminar_lote(ids[inicio:inicio + LOTE_VENCIMIENTO]))
+            await asyncio.sleep(0)
+
+    if total:
+        metricas.incrementar('chokolo_productos_eliminados_total', total, motivo='vencimiento')
+        await persistencia.flush(forzar=True)
+        logger.info(f"⌛ Publicaciones vencidas: {total} tallas eliminadas")
 
 # =============================================
 # FUNCIONES PRINCIPALES DEL BOT (CON PERSISTENCIA)
 # =============================================
+@instrumentar_handler
 async def bienvenida(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
@@ -192,18 +2941,13 @@ async def bienvenida(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         for user in update.message.new_chat_members:
-            mensaje_completo = f"{MENSAJE_BIENVENIDA.format(nombre=user.first_name)}\n\n📍 Pagina Web: {SITIO_WEB}"
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=mensaje_completo,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
+            bienvenidas.agregar(context.bot, chat_id, user.first_name)
             logger.info(f"Nuevo miembro en {chat_id}: {user.first_name}")
 
     except Exception as e:
         logger.error(f"Error en bienvenida: {e}")
 
+@instrumentar_handler
 async def despedida(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
@@ -212,7 +2956,9 @@ async def despedida(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         user = update.message.left_chat_member
         if user.id != context.bot.id:
-            await context.bot.send_message(
+            cola_salida.enviar(
+                chat_id,
+                context.bot.send_message,
                 chat_id=chat_id,
                 text=MENSAJE_DESPEDIDA.format(nombre=user.first_name),
                 parse_mode='Markdown'
@@ -221,98 +2967,224 @@ async def despedida(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error en despedida: {e}")
 
+@instrumentar_handler
+async def actualizar_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Invalida la caché de administradores si alguien fue promovido o degradado"""
+    try:
+        cambio = update.chat_member or update.my_chat_member
+        antes = cambio.old_chat_member.status in ESTADOS_ADMIN
+        despues = cambio.new_chat_member.status in ESTADOS_ADMIN
+        if antes != despues:
+            cache_admins.invalidar(cambio.chat.id)
+            logger.info(f"Administradores de {cambio.chat.id} cambiaron: {cache_admins.estadisticas()}")
+
+    except Exception as e:
+        logger.error(f"Error actualizando administradores: {e}")
+
+VENTANA_ALBUM = 1.5   # Segundos para juntar las fotos de un álbum (media group)
+
+MENSAJE_FORMATO_INCORRECTO = (
+    "⚠️ *Formato incorrecto* ⚠️\n\n"
+    "Ejemplos válidos:\n"
+    "• Nike Air Force 1\nTalla 11 y 10.5 - $95\n"
+    "• Jordan Aj 2/3\n11, 10.5 - 95$\n"
+    "• New Balance 550\n11 / 10.5 - USD 95\n"
+    "• Adidas Samba\n8.0 – 65USD"
+)
+
+class AlbumesPendientes:
+    """Junta los mensajes de un media_group_id durante VENTANA_ALBUM segundos.
+
+    Telegram entrega cada foto de un álbum como un update separado; así se
+    registran todas juntas con una sola verificación de admin, una sola
+    escritura y una sola respuesta.
+    """
+
+    def __init__(self, ventana=VENTANA_ALBUM):
+        self.ventana = ventana
+        self._pendientes = {}   # media_group_id -> [updates]
+
+    def agregar(self, update):
+        """Agrega el update; retorna True si abre un álbum nuevo"""
+        grupo = update.message.media_group_id
+        if grupo in self._pendientes:
+            self._pendientes[grupo].append(update)
+            return False
+        self._pendientes[grupo] = [update]
+        return True
+
+    def descartar(self, grupo):
+        self._pendientes.pop(grupo, None)
+
+    def cerrar_en(self, grupo, procesar):
+        """Tras la ventana, entrega todos los updates del álbum a procesar()"""
+        def disparar():
+            updates = self._pendientes.pop(grupo, [])
+            if updates:
+                asyncio.ensure_future(procesar(updates))
+        asyncio.get_running_loop().call_later(self.ventana, disparar)
+
+albumes = AlbumesPendientes()
+
+@instrumentar_handler
 async def registrar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
         if chat_id not in GRUPOS_AUTORIZADOS:
             return
 
+        grupo = update.message.media_group_id
+        if grupo is not None and not albumes.agregar(update):
+            return  # El álbum ya está abierto (y el admin verificado)
+
         user = update.effective_user
-        admins = await context.bot.get_chat_administrators(chat_id)
-        if user.id not in [admin.user.id for admin in admins]:
+        if not await cache_admins.es_admin(context.bot, chat_id, user.id):
+            if grupo is not None:
+                albumes.descartar(grupo)
             return
 
-        if not (update.message.photo and update.message.caption):
-            return
+        if grupo is not None:
+            albumes.cerrar_en(grupo, registrar_publicacion)
+        else:
+            await registrar_publicacion([update])
 
-        match = PATRON_PRODUCTO.search(update.message.caption)
-        if not match:
-            await enviar_respuesta(
-                update,
-                "⚠️ *Formato incorrecto* ⚠️\n\n"
-                "Ejemplos válidos:\n"
-                "• Nike Air Force 1\nTalla 11 y 10.5 - $95\n"
-                "• Jordan Aj 2/3\n11, 10.5 - 95$\n"
-                "• New Balance 550\n11 / 10.5 - USD 95\n"
-                "• Adidas Samba\n8.0 – 65USD",
-                update.message.message_id
-            )
+    except Exception as e:
+        logger.error(f"Error registrando producto: {e}")
+        await enviar_respuesta(
+            update,
+            "❌ Error al registrar el producto. Verifica el formato e intenta nuevamente.",
+            update.message.message_id
+        )
+
+async def registrar_publicacion(updates):
+    """Registra todos los productos de una foto o de un álbum en un solo lote"""
+    primero = updates[0]
+    try:
+        chat_id = primero.effective_chat.id
+        user = primero.effective_user
+        mensajes = sorted((u.message for u in updates), key=lambda m: m.message_id)
+        fotos = [m for m in mensajes if m.photo]
+        con_caption = [m for m in mensajes if m.caption]
+        if not (fotos and con_caption):
             return
 
-        datos = match.groupdict()
-        modelo = datos['modelo'].strip()
-        precio = re.sub(r'(USD|\$|\s)', '', datos['precio']).strip()  # Normaliza a "65"
-        tallas = re.split(r'\s*(?:,|y|\/)\s*', datos['tallas'])
+        # Bloques de cada caption junto con el mensaje que los trae
+        bloques, tallas_invalidas = [], []
+        for mensaje in con_caption:
+            encontrados, invalidas = interpretar_publicacion(mensaje.caption)
+            bloques.extend((mensaje, bloque) for bloque in encontrados)
+            tallas_invalidas.extend(invalidas)
 
-        # Validar y normalizar tallas
-        tallas_validas = []
-        for talla in tallas:
-            try:
-                talla = talla.strip()
-                talla_float = float(talla)
-                tallas_validas.append(f"{talla_float:.1f}" if talla_float.is_integer() else str(talla_float))
-            except ValueError:
-                await enviar_respuesta(
-                    update,
-                    f"❌ Talla inválida: '{talla}'. Debe ser un número (ej: 10.5)",
-                    update.message.message_id
-                )
-                return
+        # Un solo caption con un modelo por foto: se asignan en orden
+        if len(con_caption) == 1 and len(fotos) > 1 and len(bloques) == len(fotos):
+            bloques = [(foto, bloque) for foto, (_, bloque) in zip(fotos, bloques)]
 
-        # Registrar cada talla
-        productos_registrados = []
-        for talla in tallas_validas:
-            producto_id = f"{modelo.lower()}_{talla}"
-            
-            productos_db[producto_id] = {
-                'modelo': modelo,
-                'talla': talla,
-                'precio': f"${precio}",
-                'foto': update.message.photo[-1].file_id,
-                'chat_id': chat_id,
-                'msg_id': update.message.message_id,
-                'user_id': user.id
-            }
-            productos_registrados.append(f"{modelo} (Talla {talla})")
+        if not bloques:
+            if tallas_invalidas:
+                texto = f"❌ Talla inválida: '{tallas_invalidas[0]}'. Debe ser un número (ej: 10.5)"
+            else:
+                texto = MENSAJE_FORMATO_INCORRECTO
+            await enviar_respuesta(primero, texto, mensajes[0].message_id)
+            return
 
-        guardar_db()
-        hacer_backup()
-        
+        # Hash perceptual de cada foto (descargas en paralelo)
+        hashes = dict(zip(
+            (m.message_id for m in fotos),
+            await asyncio.gather(*(calcular_phash(primero.get_bot(), m.photo) for m in fotos))
+        ))
+
+        lote, duplicados = [], []
+        for mensaje, (modelo, tallas, precio) in bloques:
+            con_foto = mensaje if mensaje.photo else fotos[0]
+            phash = hashes[con_foto.message_id]
+            # Misma foto ya publicada en el grupo con otro nombre de modelo
+            for parecido in agrupar_por_modelo(
+                await indice_fotos.parecidos(phash, chat_id, DISTANCIA_DUPLICADO)
+            ):
+                if parecido['modelo'].lower() != modelo.lower():
+                    duplicados.append(f"{modelo} ≈ {parecido['modelo']}")
+            for talla in tallas:
+                producto = {
+                    'modelo': modelo,
+                    'talla': talla,
+                    'precio': f"${precio}",
+                    'foto': con_foto.photo[-1].file_id,
+                    'chat_id': chat_id,
+                    'msg_id': mensaje.message_id,
+                    'user_id': user.id
+                }
+                if phash is not None:
+                    producto['phash'] = phash
+                lote.append((f"{modelo.lower()}_{talla}", producto))
+
+        catalogo.registrar_lote(lote)
+        persistencia.programar()  # Una escritura diferida para todo el lote (foto o álbum)
+
+        productos_registrados = [f"{p['modelo']} (Talla {p['talla']})" for _, p in lote]
         logger.info(f"📦 Productos registrados: {', '.join(productos_registrados)} | Chat ID: {chat_id}")
 
-        await enviar_respuesta(
-            update,
-            f"✅ *Productos registrados:*\n"
-            f"👟 *Modelo:* {modelo}\n"
-            f"📏 *Tallas:* {', '.join(tallas_validas)} US\n"
-            f"💵 *Precio:* ${precio}",
-            update.message.message_id
-        )
+        if len(bloques) == 1:
+            _, (modelo, tallas, precio) = bloques[0]
+            texto = (
+                f"✅ *Productos registrados:*\n"
+                f"👟 *Modelo:* {modelo}\n"
+                f"📏 *Tallas:* {', '.join(tallas)} US\n"
+                f"💵 *Precio:* ${precio}"
+            )
+        else:
+            texto = f"✅ *{len(bloques)} modelos registrados · {len(lote)} tallas:*\n" + "\n".join(
+                f"👟 {modelo}: {', '.join(tallas)} US — ${precio}"
+                for _, (modelo, tallas, precio) in bloques
+            )
+        if tallas_invalidas:
+            texto += f"\n\n⚠️ Tallas ignoradas: {', '.join(tallas_invalidas)}"
+        if duplicados:
+            logger.info(f"🔁 Posibles duplicados en chat {chat_id}: {', '.join(duplicados)}")
+            texto += "\n\n🔁 *Foto ya publicada con otro nombre:*\n" + "\n".join(
+                f"• {duplicado}" for duplicado in dict.fromkeys(duplicados)
+            )
+        await enviar_respuesta(primero, texto, mensajes[0].message_id)
 
     except Exception as e:
-        logger.error(f"Error registrando producto: {e}")
+        logger.error(f"Error registrando productos: {e}")
         await enviar_respuesta(
-            update,
+            primero,
             "❌ Error al registrar el producto. Verifica el formato e intenta nuevamente.",
-            update.message.message_id
+            primero.message.message_id
         )
 
+def productos_filtrados(chat_id, texto, filtros):
+    """Productos del grupo para una consulta ya separada con interpretar_filtros().
+
+    Solo filtros: rango en los índices ordenados del catálogo. Con texto: se
+    busca y se filtran/ordenan los resultados (que ya son pocos).
+    """
+    if not texto:
+        if not hay_filtros(filtros):
+            return []
+        return catalogo.filtrar(chat_id, filtros['talla'], filtros['precio'], filtros['orden'])
+    productos = catalogo.buscar(chat_id, texto, limite=None)
+    return ordenar_por_precio([p for p in productos if cumple_filtros(p, filtros)], filtros['orden'])
+
+@instrumentar_handler
 async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
-        productos_grupo = [p for p in productos_db.values() if p['chat_id'] == chat_id]
 
-        if not productos_grupo:
+        if context.args:
+            # /price <100, /price talla 10.5 barato, /price jordan 80-120 ...
+            texto, filtros = interpretar_filtros(' '.join(context.args))
+            productos = productos_filtrados(chat_id, texto, filtros)
+            if not productos:
+                await enviar_respuesta(update, "💰 No hay productos con esos filtros")
+                return
+            for respuesta in renderizar_precios(productos):
+                await enviar_respuesta(update, respuesta)
+            return
+
+        partes = cache_respuestas.obtener(chat_id, 'price', renderizar_precios)
+
+        if not partes:
             await enviar_respuesta(
                 update,
                 "🛒 *No hay productos registrados aún*\n\n"
@@ -320,35 +3192,31 @@ async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        respuesta = "💰 *Lista de Precios* 💰\n\n"
-        for p in productos_grupo:
-            respuesta += f"▪️ *{p['modelo']}*: {p['precio']}\n"
-
-        await enviar_respuesta(update, respuesta)
+        for respuesta in partes:
+            await enviar_respuesta(update, respuesta)
 
     except Exception as e:
         logger.error(f"Error en /price: {e}")
         await enviar_respuesta(update, "❌ Error al obtener precios")
 
+@instrumentar_handler
 async def size(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
-        productos_grupo = [p for p in productos_db.values() if p['chat_id'] == chat_id]
+        partes = cache_respuestas.obtener(chat_id, 'size', renderizar_tallas)
 
-        if not productos_grupo:
+        if not partes:
             await enviar_respuesta(update, "📏 *No hay tallas registradas*")
             return
 
-        respuesta = "👟 *Tallas Disponibles* (US) 👟\n\n"
-        for p in productos_grupo:
-            respuesta += f"▪️ *{p['modelo']}*: {p['talla']}\n"
-
-        await enviar_respuesta(update, respuesta)
+        for respuesta in partes:
+            await enviar_respuesta(update, respuesta)
 
     except Exception as e:
         logger.error(f"Error en /size: {e}")
         await enviar_respuesta(update, "❌ Error al obtener tallas")
 
+@instrumentar_handler
 async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         respuesta = """💳 *Métodos de Pago Aceptados* 💳
@@ -366,6 +3234,7 @@ async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error en /pay: {e}")
 
+@instrumentar_handler
 async def shipments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         respuesta = """🚚 *Política de Envíos* 🚚
@@ -383,51 +3252,157 @@ async def shipments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error en /shipments: {e}")
 
+def agrupar_por_modelo(productos):
+    """Un resultado por modelo (en orden de relevancia) con todas sus tallas"""
+    modelos = {}
+    for p in productos:
+        grupo = modelos.setdefault(p['modelo'].lower(), {
+            'modelo': p['modelo'], 'foto': p['foto'], 'tallas': [], 'precios': []
+        })
+        grupo['tallas'].append(p['talla'])
+        if p['precio'] not in grupo['precios']:
+            grupo['precios'].append(p['precio'])
+    return list(modelos.values())
+
+def texto_modelo(grupo):
+    return (
+        f"👟 *{grupo['modelo']}*\n"
+        f"📏 Tallas: {', '.join(grupo['tallas'])} US\n"
+        f"💵 Precio: {' / '.join(grupo['precios'])}"
+    )
+
+async def enviar_album(bot, chat_id, lote, reply_to=None):
+    """Envía hasta RESULTADOS_POR_PAGINA modelos como un solo álbum (o foto)"""
+    try:
+        if len(lote) == 1:
+            await cola_salida.enviar(
+                chat_id,
+                bot.send_photo,
+                chat_id=chat_id,
+                photo=lote[0]['foto'],
+                caption=texto_modelo(lote[0]),
+                parse_mode='Markdown',
+                reply_to_message_id=reply_to
+            )
+        else:
+            await cola_salida.enviar(
+                chat_id,
+                bot.send_media_group,
+                chat_id=chat_id,
+                media=[
+                    InputMediaPhoto(g['foto'], caption=texto_modelo(g), parse_mode='Markdown')
+                    for g in lote
+                ],
+                reply_to_message_id=reply_to
+            )
+    except Exception as e:
+        logger.error(f"Error mostrando productos: {e}")
+        cola_salida.enviar(
+            chat_id,
+            bot.send_message,
+            chat_id=chat_id,
+            text='\n\n'.join(texto_modelo(g) for g in lote),
+            parse_mode='Markdown'
+        )
+
+# callback_data admite 64 bytes; una consulta que no cabe entera se guarda
+# acá y el botón lleva un id corto ("#" + hash), así ninguna página cambia
+# de búsqueda por un corte
+LARGO_CONSULTA_BOTON = 50
+CONSULTAS_PAGINADAS = 1000      # Consultas largas recordadas (las más viejas se olvidan)
+consultas_paginadas = {}        # "#id" -> consulta normalizada
+
+def clave_paginacion(clave):
+    """La consulta para callback_data: tal cual si cabe, si no un id corto"""
+    if len(clave.encode('utf-8')) <= LARGO_CONSULTA_BOTON:
+        return clave
+    identificador = '#' + hashlib.sha256(clave.encode('utf-8')).hexdigest()[:12]
+    consultas_paginadas.pop(identificador, None)
+    consultas_paginadas[identificador] = clave
+    while len(consultas_paginadas) > CONSULTAS_PAGINADAS:
+        del consultas_paginadas[next(iter(consultas_paginadas))]
+    return identificador
+
+async def enviar_pagina_busqueda(bot, chat_id, consulta, pagina, reply_to=None):
+    """Envía una página de resultados como un solo álbum + botón de página siguiente.
+
+    Retorna False si la búsqueda no tiene resultados.
+    """
+    texto, filtros = interpretar_filtros(consulta)
+    modelos = agrupar_por_modelo(productos_filtrados(chat_id, texto, filtros))
+    if not modelos:
+        return False
+
+    total_paginas = -(-len(modelos) // RESULTADOS_POR_PAGINA)
+    pagina = min(pagina, total_paginas - 1)
+    lote = modelos[pagina * RESULTADOS_POR_PAGINA:(pagina + 1) * RESULTADOS_POR_PAGINA]
+    await enviar_album(bot, chat_id, lote, reply_to)
+
+    teclado = None
+    if pagina + 1 < total_paginas:
+        # Consulta normalizada con los filtros primero (las páginas siguientes la reinterpretan)
+        clave = clave_paginacion(' '.join(filtros['piezas'] + list(normalizar_texto(texto))))
+        teclado = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "Siguiente ➡️", callback_data=f"buscar:{pagina + 1}:{clave}"
+        )]])
+    cola_salida.enviar(
+        chat_id,
+        bot.send_message,
+        chat_id=chat_id,
+        text=agregar_footer(
+            f"🔍 {len(modelos)} modelos para '{consulta}' · Página {pagina + 1}/{total_paginas}"
+        ),
+        parse_mode='Markdown',
+        disable_web_page_preview=True,
+        reply_markup=teclado
+    )
+    return True
+
+async def buscar_por_foto(update, context, fotos_mensaje):
+    """/buscar respondiendo a una foto: modelos del grupo con la foto más parecida"""
+    chat_id = update.effective_chat.id
+    phash = await calcular_phash(context.bot, fotos_mensaje)
+    if phash is None:
+        await enviar_respuesta(update, "❌ No se pudo analizar la foto")
+        return
+
+    modelos = agrupar_por_modelo(await indice_fotos.parecidos(phash, chat_id, DISTANCIA_BUSQUEDA_FOTO))
+    if not modelos:
+        await enviar_respuesta(update, "🔍 No hay productos con una foto parecida")
+        return
+
+    await enviar_album(context.bot, chat_id, modelos[:RESULTADOS_POR_PAGINA], update.message.message_id)
+    await enviar_respuesta(update, f"🔍 {len(modelos)} modelos con foto parecida")
+
+@instrumentar_handler
 async def buscar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
-        
+        respondido = update.message.reply_to_message
+
+        if not context.args and respondido is not None and respondido.photo:
+            await buscar_por_foto(update, context, respondido.photo)
+            return
+
         if not context.args:
             await enviar_respuesta(
                 update,
-                "🔍 *Uso:* /buscar [modelo]\nEjemplo: /buscar New Balance"
+                "🔍 *Uso:* /buscar [modelo] [filtros]\nEjemplo: /buscar New Balance\n"
+                "Filtros: talla 10.5, <100, 80-120, barato/caro\n"
+                "También puedes responder a una foto con /buscar"
             )
             return
 
         query = ' '.join(context.args).lower().strip()
-        resultados = [
-            p for p in productos_db.values() 
-            if (query in p['modelo'].lower() and p['chat_id'] == chat_id)
-        ]
+        encontrado = await enviar_pagina_busqueda(
+            context.bot, chat_id, query, 0, update.message.message_id
+        )
 
-        if not resultados:
+        if not encontrado:
             await enviar_respuesta(
                 update,
                 f"🔍 No se encontró '{query}'\n\nPrueba con menos palabras"
             )
-            return
-
-        for producto in resultados:
-            try:
-                await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=producto['foto'],
-                    caption=agregar_footer(
-                        f"👟 *{producto['modelo']}*\n"
-                        f"📏 Talla: {producto['talla']} US\n"
-                        f"💵 Precio: {producto['precio']}"
-                    ),
-                    parse_mode='Markdown',
-                    reply_to_message_id=producto['msg_id']
-                )
-            except Exception as e:
-                logger.error(f"Error mostrando producto: {e}")
-                await enviar_respuesta(
-                    update,
-                    f"👟 *{producto['modelo']}*\n"
-                    f"📏 Talla: {producto['talla']} US\n"
-                    f"💵 Precio: {producto['precio']}"
-                )
 
     except Exception as e:
         logger.error(f"Error en /buscar: {e}")
@@ -436,14 +3411,34 @@ async def buscar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ Error en la búsqueda. Verifica el formato e intenta nuevamente."
         )
 
+@instrumentar_handler
+async def paginar_busqueda(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botón 'Siguiente' de /buscar (callback_data = buscar:<pagina>:<consulta o #id>)"""
+    boton = update.callback_query
+    try:
+        _, pagina, consulta = boton.data.split(':', 2)
+        if consulta.startswith('#'):
+            consulta = consultas_paginadas.get(consulta)
+            if consulta is None:
+                await boton.answer("⌛ Esta búsqueda expiró, vuelve a usar /buscar", show_alert=True)
+                return
+        await boton.answer()
+        cola_salida.enviar(
+            boton.message.chat_id, boton.edit_message_reply_markup, reply_markup=None
+        )
+        await enviar_pagina_busqueda(context.bot, boton.message.chat_id, consulta, int(pagina))
+
+    except Exception as e:
+        logger.error(f"Error paginando /buscar: {e}")
+
+@instrumentar_handler
 async def eliminar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         chat_id = update.effective_chat.id
         user = update.effective_user
         
         # Verificar permisos de administrador
-        admins = await context.bot.get_chat_administrators(chat_id)
-        if user.id not in [admin.user.id for admin in admins]:
+        if not await cache_admins.es_admin(context.bot, chat_id, user.id):
             await enviar_respuesta(update, "❌ Solo administradores pueden eliminar productos")
             return
 
@@ -492,12 +3487,9 @@ async def eliminar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
         modelo_normalizado = modelo.lower().strip('"\'')
         producto_id = f"{modelo_normalizado}_{talla_normalizada}"
         
-        if producto_id in productos_db:
-            producto = productos_db[producto_id]
-            del productos_db[producto_id]
-            
-            guardar_db()
-            hacer_backup()
+        producto = catalogo.eliminar(producto_id, chat_id)  # Solo publicaciones de este grupo
+        if producto is not None:
+            persistencia.programar()
             
             await enviar_respuesta(
                 update,
@@ -510,14 +3502,13 @@ async def eliminar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.info(f"Producto eliminado: {producto_id} | Por: {user.first_name}")
         else:
             # Mostrar sugerencias si no se encuentra exactamente
-            productos_similares = [
-                p for p in productos_db.values() 
-                if modelo_normalizado in p['modelo'].lower() and p['chat_id'] == chat_id
-            ]
+            productos_similares = catalogo.buscar(chat_id, modelo_normalizado, limite=None)
             
             if productos_similares:
-                tallas_disponibles = list(set(p['talla'] for p in productos_similares))
-                modelos_similares = list(set(p['modelo'] for p in productos_similares))
+                modelos_similares = list(dict.fromkeys(p['modelo'] for p in productos_similares))
+                tallas_disponibles = list(dict.fromkeys(
+                    talla for m in modelos_similares for talla in catalogo.tallas_modelo(m, chat_id)
+                ))
                 
                 mensaje = (
                     f"❌ No se encontró '{modelo}' en talla {talla_normalizada}\n\n"
@@ -541,56 +3532,443 @@ async def eliminar_producto(update: Update, context: ContextTypes.DEFAULT_TYPE):
             update.message.message_id
         )
 
+LIMPIAR_VISTA_PREVIA = 20       # Modelos listados en la vista previa de /limpiar
+
+def texto_vista_limpieza(prefijo, encontrados):
+    modelos = agrupar_por_modelo([producto for _, producto in encontrados])
+    lineas = [
+        f"👟 {grupo['modelo']}: {', '.join(grupo['tallas'])} US"
+        for grupo in modelos[:LIMPIAR_VISTA_PREVIA]
+    ]
+    if len(modelos) > LIMPIAR_VISTA_PREVIA:
+        lineas.append(f"… y {len(modelos) - LIMPIAR_VISTA_PREVIA} modelos más")
+    return (
+        f"🧹 *Vista previa de /limpiar '{prefijo}'*\n"
+        f"Se eliminarán {len(encontrados)} tallas de {len(modelos)} modelos:\n\n" + "\n".join(lineas)
+    )
+
+@instrumentar_handler
+async def limpiar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/limpiar <prefijo>: muestra lo que se eliminaría y pide confirmación con un botón"""
+    try:
+        chat_id = update.effective_chat.id
+        if not await cache_admins.es_admin(context.bot, chat_id, update.effective_user.id):
+            await enviar_respuesta(update, "❌ Solo administradores pueden limpiar el catálogo")
+            return
+
+        prefijo = ' '.join(context.args).lower().strip('"\'')
+        if not prefijo:
+            await enviar_respuesta(
+                update,
+                "⚠️ Uso: /limpiar [inicio del modelo]\n"
+                "Elimina todas las tallas de los modelos que empiezan así, por ejemplo:\n"
+                "/limpiar Jordan 4"
+            )
+            return
+        # callback_data admite 64 bytes
+        if len(prefijo.encode('utf-8')) > 50:
+            await enviar_respuesta(update, "❌ El prefijo es demasiado largo", update.message.message_id)
+            return
+
+        encontrados = catalogo.con_prefijo(chat_id, prefijo)
+        if not encontrados:
+            await enviar_respuesta(
+                update, f"🔍 No hay modelos que empiecen con '{prefijo}'", update.message.message_id
+            )
+            return
+
+        teclado = InlineKeyboardMarkup([[
+            InlineKeyboardButton(f"🗑️ Eliminar {len(encontrados)} tallas", callback_data=f"limpiar:si:{prefijo}"),
+            InlineKeyboardButton("Cancelar", callback_data=f"limpiar:no:{prefijo}")
+        ]])
+        cola_salida.enviar(
+            chat_id,
+            update.message.reply_text,
+            text=agregar_footer(texto_vista_limpieza(prefijo, encontrados)),
+            parse_mode='Markdown',
+            disable_web_page_preview=True,
+            reply_to_message_id=update.message.message_id,
+            reply_markup=teclado
+        )
+
+    except Exception as e:
+        logger.error(f"Error en /limpiar: {e}")
+        await enviar_respuesta(update, "❌ Error al preparar la limpieza. Intenta nuevamente.")
+
+@instrumentar_handler
+async def confirmar_limpieza(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones de /limpiar (callback_data = limpiar:<si|no>:<prefijo>)"""
+    boton = update.callback_query
+    try:
+        _, accion, prefijo = boton.data.split(':', 2)
+        chat_id = boton.message.chat_id
+        if not await cache_admins.es_admin(context.bot, chat_id, boton.from_user.id):
+            await boton.answer("Solo administradores pueden limpiar el catálogo", show_alert=True)
+            return
+        await boton.answer()
+
+        if accion == 'si':
+            # Se vuelve a consultar: lo publicado después de la vista previa también entra
+            eliminados = catalogo.eliminar_lote([pid for pid, _ in catalogo.con_prefijo(chat_id, prefijo)])
+            if eliminados:
+                metricas.incrementar('chokolo_productos_eliminados_total', len(eliminados), motivo='limpiar')
+                await persistencia.flush(forzar=True)  # Una sola escritura (y fsync) para todo el lote
+            modelos = len({producto['modelo'] for _, producto in eliminados})
+            texto = f"🗑️ *Limpieza completada:* {len(eliminados)} tallas de {modelos} modelos que empezaban con '{prefijo}'"
+            logger.info(f"/limpiar '{prefijo}' en {chat_id}: {len(eliminados)} tallas | Por: {boton.from_user.first_name}")
+        else:
+            texto = f"🧹 Limpieza de '{prefijo}' cancelada"
+
+        cola_salida.enviar(
+            chat_id, boton.edit_message_text,
+            text=agregar_footer(texto), parse_mode='Markdown', disable_web_page_preview=True
+        )
+
+    except Exception as e:
+        logger.error(f"Error confirmando /limpiar: {e}")
+
 # =============================================
-# CONFIGURACIÓN Y EJECUCIÓN DEL BOT
+# PROCESAMIENTO CONCURRENTE DE UPDATES
 # =============================================
-def main():
-    try:
-        print("🔄 Iniciando bot...")
-        print(f"📦 Productos cargados: {len(productos_db)}")
-        
-        # Configurar el bot de Telegram
-        app = ApplicationBuilder().token(TOKEN).build()
+UPDATES_CONCURRENTES = 32       # Handlers ejecutándose a la vez (entre todos los grupos)
+UPDATES_EN_VUELO = 1024         # Updates aceptados (esperando turno o en ejecución)
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    """Updates de grupos distintos en paralelo; los de un mismo grupo, en orden.
+
+    Cada chat tiene un turno (asyncio.Lock, que atiende en orden de llegada).
+    El límite global se toma recién con el turno del chat: así un grupo con
+    muchos updates en espera no ocupa los lugares de los demás.
+    """
+
+    def __init__(self, concurrentes=UPDATES_CONCURRENTES):
+        super().__init__(max_concurrent_updates=UPDATES_EN_VUELO)
+        self._limite = asyncio.Semaphore(concurrentes)
+        self._turnos = {}   # chat_id -> [asyncio.Lock, updates esperando o en curso]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, 'effective_chat', None)
+        if chat is None:
+            async with self._limite:
+                await coroutine
+            return
 
-        # Handlers para eventos
-        app.add_handler(MessageHandler(
-            filters.Chat(GRUPOS_AUTORIZADOS) & filters.StatusUpdate.NEW_CHAT_MEMBERS,
-            bienvenida
-        ))
-        app.add_handler(MessageHandler(
-            filters.Chat(GRUPOS_AUTORIZADOS) & filters.StatusUpdate.LEFT_CHAT_MEMBER,
-            despedida
-        ))
+        turno = self._turnos.get(chat.id)
+        if turno is None:
+            turno = self._turnos[chat.id] = [asyncio.Lock(), 0]
+        turno[1] += 1
+        try:
+            async with turno[0]:
+                async with self._limite:
+                    await coroutine
+        finally:
+            turno[1] -= 1
+            if not turno[1]:
+                del self._turnos[chat.id]
 
-        # Handlers para comandos
-        app.add_handler(CommandHandler("eliminar", eliminar_producto))
-        app.add_handler(CommandHandler("price", price))
-        app.add_handler(CommandHandler("size", size))
-        app.add_handler(CommandHandler("pay", pay))
-        app.add_handler(CommandHandler("shipments", shipments))
-        app.add_handler(CommandHandler("buscar", buscar_producto))
-
-        # Handler para productos
-        app.add_handler(MessageHandler(
-            filters.Chat(GRUPOS_AUTORIZADOS) & filters.PHOTO,
-            registrar_producto
-        ))
+    async def initialize(self):
+        pass
 
-        logger.info("Bot iniciado correctamente")
-        print(f"✅ Bot de Coes Sneakers listo | Web: {SITIO_WEB}")
+    async def shutdown(self):
+        pass
+
+# =============================================
+# CONFIGURACIÓN Y EJECUCIÓN DEL BOT
+# =============================================
+async def ejecutar_webhook(app):
+    """Sirve flask_app con uvicorn (ASGI) en el mismo loop que la Application"""
+    import uvicorn
+    from asgiref.wsgi import WsgiToAsgi
+
+    global receptor_webhook
+    servidor = uvicorn.Server(uvicorn.Config(
+        WsgiToAsgi(crear_flask_app()),
+        host='0.0.0.0',
+        port=int(os.environ.get('PORT', 5000)),
+        log_level='warning'
+    ))
+    # uvicorn vuelve a lanzar SIGINT/SIGTERM cuando serve() termina, lo que
+    # cortaría el cierre (al_apagar y persistencia.cerrar() en main). Las
+    # señales se atienden acá: solo piden a uvicorn que termine.
+    servidor.install_signal_handlers = lambda: None     # uvicorn < 0.29
+    servidor.capture_signals = contextlib.nullcontext   # uvicorn >= 0.29
+
+    def detener(signum, frame):
+        servidor.force_exit = servidor.should_exit      # Segunda señal: sin esperar conexiones
+        servidor.should_exit = True
+
+    async with app:
+        await app.start()
+        receptor_webhook = (app, asyncio.get_running_loop())
+        await app.bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Webhook activo en {WEBHOOK_URL}")
+        registrar_arranque("webhook")
+        anteriores = {sig: signal.signal(sig, detener) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            await servidor.serve()
+        finally:
+            receptor_webhook = None
+            await app.stop()
+            await al_apagar(app)
+            for sig, anterior in anteriores.items():
+                signal.signal(sig, anterior)
+
+def registrar_arranque(modo):
+    logger.info(f"⏱️ Arranque completo ({modo}) en {time.perf_counter() - INICIO_ARRANQUE:.2f} s")
+
+async def al_iniciar(app):
+    """Hook de inicio (polling): la Application ya está inicializada"""
+    registrar_arranque("polling")
+
+async def al_apagar(app):
+    """Hook de cierre: vacía la persistencia diferida y la cola de salida"""
+    await persistencia.flush(forzar=True)
+    await cola_salida.vaciar()
+
+def crear_aplicacion(recibe_updates=True, worker=None):
+    """Application con todos los handlers (los workers no consultan a Telegram por updates).
+
+    worker = (indice, total) en modo multiproceso: el vencimiento solo toca sus grupos.
+    """
+    # La JobQueue requiere python-telegram-bot[job-queue] (APScheduler); se crea
+    # acá para no leer app.job_queue (que avisa con un warning si no existe)
+    try:
+        cola_jobs = JobQueue()
+    except RuntimeError:
+        cola_jobs = None
+        logger.warning("JobQueue no disponible (instalar python-telegram-bot[job-queue]): las publicaciones no vencerán")
+    constructor = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        .request(RequestMedido(connection_pool_size=256))
+        .get_updates_request(RequestMedido())
+        .concurrent_updates(ProcesadorPorChat())
+        .post_init(al_iniciar)
+        .post_shutdown(al_apagar)
+        .job_queue(cola_jobs)
+    )
+    if not recibe_updates:
+        constructor = constructor.updater(None)
+    app = constructor.build()
+    if recibe_updates:  # En modo multiproceso los updates ya los cuenta el front
+        app.add_handler(TypeHandler(Update, contar_update), group=-1)
+    threading.Thread(target=indice_fotos.construir, daemon=True).start()
+
+    if cola_jobs is not None:
+        cola_jobs.run_repeating(
+            expirar_publicaciones, interval=VENCIMIENTO_INTERVALO, first=VENCIMIENTO_PRIMERA,
+            data=worker, name="vencimiento"
+        )
 
+    # Handlers para eventos
+    app.add_handler(MessageHandler(
+        filters.Chat(GRUPOS_AUTORIZADOS) & filters.StatusUpdate.NEW_CHAT_MEMBERS,
+        bienvenida
+    ))
+    app.add_handler(MessageHandler(
+        filters.Chat(GRUPOS_AUTORIZADOS) & filters.StatusUpdate.LEFT_CHAT_MEMBER,
+        despedida
+    ))
+    app.add_handler(ChatMemberHandler(actualizar_admins, ChatMemberHandler.ANY_CHAT_MEMBER))
+
+    # Handlers para comandos
+    app.add_handler(CommandHandler("eliminar", eliminar_producto))
+    app.add_handler(CommandHandler("price", price))
+    app.add_handler(CommandHandler("size", size))
+    app.add_handler(CommandHandler("pay", pay))
+    app.add_handler(CommandHandler("shipments", shipments))
+    app.add_handler(CommandHandler("buscar", buscar_producto))
+    app.add_handler(CallbackQueryHandler(paginar_busqueda, pattern=r'^buscar:'))
+    app.add_handler(CommandHandler("limpiar", limpiar))
+    app.add_handler(CallbackQueryHandler(confirmar_limpieza, pattern=r'^limpiar:'))
+
+    # Handler para productos
+    app.add_handler(MessageHandler(
+        filters.Chat(GRUPOS_AUTORIZADOS) & filters.PHOTO,
+        registrar_producto
+    ))
+    return app
+
+def recibir_updates(app):
+    """Webhook si hay WEBHOOK_URL (y uvicorn instalado); si no, polling + Flask en un hilo"""
+    modo_webhook = bool(WEBHOOK_URL)
+    if modo_webhook:
+        try:
+            asyncio.run(ejecutar_webhook(app))
+        except ImportError as e:
+            logger.warning(f"Webhook no disponible ({e}), se usa polling")
+            modo_webhook = False
+
+    if not modo_webhook:
         # Iniciar Flask en un hilo separado
-        import threading
         flask_thread = threading.Thread(target=run_flask)
         flask_thread.daemon = True
         flask_thread.start()
 
         # Iniciar el bot de Telegram
-        app.run_polling()
+        # ALL_TYPES incluye chat_member (necesario para invalidar la caché de admins)
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+# =============================================
+# MODO MULTIPROCESO (WORKERS POR GRUPO)
+# =============================================
+# Proceso front: recibe los updates (polling o webhook) y los reparte por
+# chat_id. Cada worker atiende siempre los mismos grupos, así sus cachés
+# (respuestas, admins, álbumes) y el orden por chat siguen siendo locales;
+# el catálogo se comparte en SQLite (WAL admite varios procesos).
+METRICAS_INTERVALO_WORKER = 5   # Segundos entre envíos de métricas de un worker al front
+
+def worker_de_chat(chat_id, total):
+    return chat_id % total
+
+def clave_update(update):
+    """chat_id del update (o el usuario, o 0) para elegir worker"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return 0
+
+def ejecutar_worker(indice, total, cola, cola_metricas):
+    """Proceso worker: atiende los updates que le entrega el front por `cola`"""
+    global cola_salida
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # El apagado lo coordina el front
+    # El límite global de Telegram es por bot: se reparte entre los workers
+    cola_salida = ColaSalida(tasa_global=TASA_GLOBAL / total)
+    # Un solo proceso escribe los respaldos completos (el catálogo es el mismo)
+    respaldos.completos = indice == 0
+
+    app = crear_aplicacion(recibe_updates=False, worker=(indice, total))
+    try:
+        asyncio.run(atender_cola(app, cola, cola_metricas, indice))
+    finally:
+        persistencia.cerrar()
+        logger.info(f"Worker {indice} detenido")
+
+async def atender_cola(app, cola, cola_metricas, indice):
+    loop = asyncio.get_running_loop()
+    terminado = asyncio.Event()
+
+    async def enviar_metricas():
+        # /metrics lo sirve el front: le llegan las de este worker cada tanto
+        while not terminado.is_set():
+            cola_metricas.put((indice, metricas.instantanea()))
+            try:
+                await asyncio.wait_for(terminado.wait(), METRICAS_INTERVALO_WORKER)
+            except asyncio.TimeoutError:
+                pass
+
+    def leer():
+        # multiprocessing.Queue es bloqueante: se lee en un hilo y se pasa al loop
+        while True:
+            datos = cola.get()
+            if datos is None:
+                loop.call_soon_threadsafe(terminado.set)
+                return
+            loop.call_soon_threadsafe(app.update_queue.put_nowait, Update.de_json(datos, app.bot))
+
+    async with app:
+        await app.start()
+        threading.Thread(target=leer, name=f"cola-worker-{indice}", daemon=True).start()
+        envio_metricas = asyncio.create_task(enviar_metricas())
+        logger.info(f"Worker {indice} listo")
+        await terminado.wait()
+        await app.stop()  # Atiende lo que quedó en la cola antes de salir
+        await al_apagar(app)
+        await envio_metricas
+        cola_metricas.put((indice, metricas.instantanea()))
+
+def ejecutar_front(total):
+    """Lanza `total` workers y les reparte los updates por chat_id"""
+    contexto = multiprocessing.get_context('spawn')  # Sin heredar conexiones ni hilos
+    colas = [contexto.Queue() for _ in range(total)]
+    cola_metricas = contexto.Queue()
+    procesos = [
+        contexto.Process(target=ejecutar_worker, args=(i, total, colas[i], cola_metricas), name=f"worker-{i}")
+        for i in range(total)
+    ]
+    for proceso in procesos:
+        proceso.start()
+
+    def recibir_metricas():
+        while True:
+            metricas.recibir(*cola_metricas.get())
+
+    threading.Thread(target=recibir_metricas, name="metricas-workers", daemon=True).start()
+
+    async def despachar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        colas[worker_de_chat(clave_update(update), total)].put(update.to_dict())
+
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        .request(RequestMedido())
+        .get_updates_request(RequestMedido())
+        .post_init(al_iniciar)
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, contar_update), group=-1)
+    app.add_handler(TypeHandler(Update, despachar))
+
+    logger.info(f"Front iniciado con {total} workers")
+    try:
+        recibir_updates(app)
+    finally:
+        for cola in colas:
+            cola.put(None)
+        for proceso in procesos:
+            proceso.join(timeout=30)
+            if proceso.is_alive():
+                logger.warning(f"{proceso.name} no terminó a tiempo, se detiene")
+                proceso.terminate()
+
+def main(workers=WORKERS):
+    try:
+        print("🔄 Iniciando bot...")
+        print(f"📦 Productos cargados: {len(catalogo)}")
+
+        if workers > 1:
+            if isinstance(catalogo, CatalogoSQLite):
+                ejecutar_front(workers)
+                return
+            logger.warning("WORKERS > 1 requiere ALMACEN_DB=sqlite (catálogo compartido); se usa un solo proceso")
+
+        # Configurar el bot de Telegram
+        app = crear_aplicacion()
+
+        logger.info("Bot iniciado correctamente")
+        print(f"✅ Bot de Coes Sneakers listo | Web: {SITIO_WEB}")
+
+        recibir_updates(app)
+
+        # Confirmar los cambios pendientes antes de salir
+        persistencia.cerrar()
 
     except Exception as e:
         logger.critical(f"Error al iniciar bot: {e}")
         print(f"❌ Error crítico: {e}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Bot de Telegram de Coes Sneakers")
+    parser.add_argument(
+        '--restaurar', metavar='"AAAA-MM-DD HH:MM"',
+        help="Restaura el catálogo al estado que tenía en esa fecha y hora"
+    )
+    parser.add_argument(
+        '--workers', type=int, default=WORKERS,
+        help="Procesos worker (requiere ALMACEN_DB=sqlite); por defecto $WORKERS o 1"
+    )
+    args = parser.parse_args()
+
+    if args.restaurar:
+        restaurar_db(args.restaurar)
+    else:
+        main(args.workers)
\ No newline at end of file
@@ -0,0 +1,691 @@
+"""
+Prueba de carga de punta a punta de Chokolo Bot.
+
+Levanta una Bot API falsa en local (getUpdates/setWebhook, sendMessage,
+sendPhoto, sendMediaGroup, getChatAdministrators, getFile y descarga de
+fotos) con latencia y respuestas 429 configurables, arranca chokolo_bot.py
+apuntado a ella (TELEGRAM_API_URL) y reproduce un perfil de tráfico:
+avalanchas de ingresos (bienvenida), ráfagas de fotos y álbumes
+(registrar_producto), muchos /buscar y /price a la vez.
+
+Cada update queda pendiente hasta que el bot responde en su grupo; al final
+se reporta la latencia de punta a punta (p50/p90/p99), el throughput y las
+tasas de error por tipo de evento.
+
+Uso:
+    python prueba_carga.py --perfil mixto
+    python prueba_carga.py --perfil fotos --escala 2 --latencia-ms 80 --tasa-429 0.05
+    python prueba_carga.py --perfil busquedas --webhook --salida carga.json
+    python prueba_carga.py --perfil mixto --workers 2
+
+Las respuestas pasan por la cola de salida del bot (límites de Telegram por
+grupo), así que con mucho tráfico en un mismo grupo la latencia refleja
+también esa espera.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger("prueba_carga")
+
+# =============================================
+# CONFIGURACIÓN
+# =============================================
+TOKEN_PRUEBA = "123456:prueba-de-carga"
+ID_BOT = 123456
+ID_ADMIN = 1                      # Publica las fotos (es el creador de los grupos)
+GRUPOS = [-1002592175038, -1002586303587]   # Grupos autorizados en chokolo_bot.py
+
+MARCAS = ["Nike Air Force", "Jordan", "New Balance", "Adidas Samba", "Yeezy Boost",
+          "Puma Suede", "Asics Gel", "Converse Chuck", "Vans Old Skool", "Reebok Club"]
+TALLAS = ["8", "8.5", "9", "9.5", "10", "10.5", "11", "12"]
+
+# Perfil: fases (tipo, cantidad, inicio_s, duracion_s); los eventos de cada
+# fase se reparten al azar dentro de su ventana.
+PERFILES = {
+    'ingresos': [
+        ('ingresos', 300, 0, 5),          # Avalancha de entradas
+        ('ingresos', 60, 12, 20),         # Goteo posterior
+    ],
+    'fotos': [
+        ('fotos', 40, 0, 10),
+        ('albumes', 10, 2, 10),
+    ],
+    'busquedas': [
+        ('fotos', 20, 0, 5),              # Catálogo para que haya resultados
+        ('busquedas', 60, 8, 5),
+        ('precios', 10, 10, 5),
+    ],
+    'mixto': [
+        ('ingresos', 100, 0, 10),
+        ('fotos', 20, 0, 10),
+        ('albumes', 5, 3, 10),
+        ('busquedas', 30, 6, 10),
+        ('precios', 6, 8, 8),
+    ],
+}
+FOTOS_POR_ALBUM = 3
+METODOS_ENVIO = {'sendMessage', 'sendPhoto', 'sendMediaGroup'}
+
+# =============================================
+# SEGUIMIENTO DE EVENTOS
+# =============================================
+class Seguimiento:
+    """Updates publicados y pendientes de respuesta, por grupo.
+
+    Cada envío del bot resuelve el evento más antiguo que le corresponde:
+    por reply_to_message_id (registros, búsquedas), por el nombre del nuevo
+    miembro (bienvenidas agrupadas) o por el encabezado (/price).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.eventos = []                 # Todos los eventos publicados
+        self._por_mensaje = {}            # (chat_id, msg_id) -> evento
+        self._por_nombre = {}             # (chat_id, nombre) -> evento
+        self._consultas = {}              # (chat_id, consulta) -> deque de eventos
+        self._precios = {}                # chat_id -> deque de eventos
+        self.respondidos = 0
+        self.ultimo_progreso = time.monotonic()
+
+    def publicar(self, tipo, chat_id, msg_id, nombre=None, consulta=None):
+        evento = {'tipo': tipo, 'chat_id': chat_id, 'publicado': time.monotonic(), 'respondido': None}
+        with self._lock:
+            self.eventos.append(evento)
+            if tipo == 'ingresos':
+                self._por_nombre[(chat_id, nombre)] = evento
+            elif tipo == 'precios':
+                self._precios.setdefault(chat_id, deque()).append(evento)
+            else:
+                self._por_mensaje[(chat_id, msg_id)] = evento
+                if consulta is not None:
+                    self._consultas.setdefault((chat_id, consulta), deque()).append(evento)
+
+    def _resolver(self, evento, ahora):
+        if evento is not None and evento['respondido'] is None:
+            evento['respondido'] = ahora
+            self.respondidos += 1
+            self.ultimo_progreso = ahora
+
+    def respuesta(self, chat_id, texto, reply_to):
+        ahora = time.monotonic()
+        with self._lock:
+            if reply_to is not None:
+                self._resolver(self._por_mensaje.pop((chat_id, reply_to), None), ahora)
+            if not texto:
+                return
+            if "Lista de Precios" in texto or "No hay productos" in texto:
+                pendientes = self._precios.get(chat_id)
+                if pendientes:
+                    self._resolver(pendientes.popleft(), ahora)
+            for (chat, consulta), pendientes in self._consultas.items():
+                if chat == chat_id and pendientes and f"'{consulta}'" in texto:
+                    self._resolver(pendientes.popleft(), ahora)
+            # Una bienvenida agrupada saluda a varios a la vez
+            for clave in [c for c in self._por_nombre if c[0] == chat_id and c[1] in texto]:
+                self._resolver(self._por_nombre.pop(clave), ahora)
+
+    def pendientes(self):
+        with self._lock:
+            return len(self.eventos) - self.respondidos
+
+# =============================================
+# BOT API FALSA
+# =============================================
+class ApiFalsa:
+    """Estado de la Bot API falsa: cola de updates, webhook y estadísticas"""
+
+    def __init__(self, seguimiento, latencia, jitter, tasa_429, retry_after, azar):
+        self.seguimiento = seguimiento
+        self.latencia = latencia
+        self.jitter = jitter
+        self.tasa_429 = tasa_429
+        self.retry_after = retry_after
+        self.azar = azar
+        self.llamadas = Counter()
+        self.limitados = 0
+        self.respuestas_error = 0
+        self.listo = threading.Event()
+        self.cerrando = False
+        self._condicion = threading.Condition()
+        self._updates = deque()
+        self._siguiente_update = 1
+        self.publicados = 0
+        self._siguiente_mensaje = 10_000_000   # Ids de los mensajes que envía el bot
+        self._webhook = None                   # (url, secreto)
+        self._envios_webhook = ThreadPoolExecutor(max_workers=16)
+        self._fotos = {}
+
+    # --- Updates ---
+    def publicar(self, datos):
+        """Entrega un update al bot (getUpdates o POST al webhook)"""
+        with self._condicion:
+            datos['update_id'] = self._siguiente_update
+            self._siguiente_update += 1
+            self.publicados += 1
+            webhook = self._webhook
+            if webhook is None:
+                self._updates.append(datos)
+                self._condicion.notify_all()
+        if webhook is not None:
+            self._envios_webhook.submit(self._enviar_webhook, webhook, datos)
+
+    def _enviar_webhook(self, webhook, datos):
+        url, secreto = webhook
+        peticion = urllib.request.Request(
+            url, data=json.dumps(datos).encode(), method='POST',
+            headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secreto or ''}
+        )
+        try:
+            urllib.request.urlopen(peticion, timeout=10).read()
+        except (urllib.error.URLError, OSError) as e:
+            self.llamadas['webhook_fallido'] += 1
+            logger.warning(f"Webhook rechazó el update {datos['update_id']}: {e}")
+
+    def obtener_updates(self, offset, timeout, limite):
+        fin = time.monotonic() + timeout
+        with self._condicion:
+            while True:
+                while self._updates and self._updates[0]['update_id'] < offset:
+                    self._updates.popleft()
+                if self._updates or self.cerrando:
+                    return [u for u, _ in zip(self._updates, range(limite))]
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    return []
+                self._condicion.wait(restante)
+
+    def cerrar(self):
+        with self._condicion:
+            self.cerrando = True
+            self._condicion.notify_all()
+        self._envios_webhook.shutdown(wait=False, cancel_futures=True)
+
+    # --- Objetos de Telegram ---
+    def mensaje_del_bot(self, chat_id, **campos):
+        with self._condicion:
+            self._siguiente_mensaje += 1
+            msg_id = self._siguiente_mensaje
+        return {
+            'message_id': msg_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Grupo {chat_id}"},
+            'from': {'id': ID_BOT, 'is_bot': True, 'first_name': "Chokolo", 'username': "chokolo_bot"},
+            **campos
+        }
+
+    def foto(self, file_id):
+        """PNG de ruido estable por file_id (cada foto tiene un hash distinto)"""
+        if file_id not in self._fotos:
+            try:
+                from PIL import Image
+            except ImportError:
+                return None
+            import io
+            azar = random.Random(file_id)
+            imagen = Image.frombytes('L', (32, 32), bytes(azar.randrange(256) for _ in range(1024)))
+            salida = io.BytesIO()
+            imagen.resize((256, 256)).save(salida, format='PNG')
+            self._fotos[file_id] = salida.getvalue()
+        return self._fotos[file_id]
+
+    # --- Métodos de la API ---
+    def llamar(self, metodo, params):
+        """(código HTTP, cuerpo JSON) de un método de la Bot API"""
+        self.llamadas[metodo] += 1
+        if metodo in METODOS_ENVIO and self.azar.random() < self.tasa_429:
+            self.limitados += 1
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }
+        if metodo != 'getUpdates':
+            time.sleep(self.latencia + self.azar.uniform(0, self.jitter))
+
+        if metodo == 'getMe':
+            resultado = {'id': ID_BOT, 'is_bot': True, 'first_name': "Chokolo", 'username': "chokolo_bot",
+                         'can_join_groups': True, 'can_read_all_group_messages': True,
+                         'supports_inline_queries': False}
+        elif metodo == 'getUpdates':
+            self.listo.set()
+            resultado = self.obtener_updates(
+                int(params.get('offset') or 0), float(params.get('timeout') or 0),
+                int(params.get('limit') or 100)
+            )
+        elif metodo == 'setWebhook':
+            with self._condicion:
+                self._webhook = (params['url'], params.get('secret_token'))
+            self.listo.set()
+            resultado = True
+        elif metodo == 'deleteWebhook':
+            with self._condicion:
+                self._webhook = None
+            resultado = True
+        elif metodo == 'getChatAdministrators':
+            resultado = [{'status': 'creator', 'is_anonymous': False,
+                          'user': {'id': ID_ADMIN, 'is_bot': False, 'first_name': "Admin"}}]
+        elif metodo == 'getFile':
+            resultado = {'file_id': params['file_id'], 'file_unique_id': params['file_id'],
+                         'file_size': 4096, 'file_path': f"photos/{params['file_id']}.png"}
+        elif metodo in METODOS_ENVIO:
+            resultado = self.enviar(metodo, params)
+        else:
+            resultado = True   # answerCallbackQuery, deleteMessage, ...
+        return 200, {'ok': True, 'result': resultado}
+
+    def enviar(self, metodo, params):
+        chat_id = int(params['chat_id'])
+        reply_to = params.get('reply_to_message_id')
+        reply_to = int(reply_to) if reply_to is not None else None
+        foto = [{'file_id': "foto", 'file_unique_id': "foto", 'width': 256, 'height': 256}]
+
+        if metodo == 'sendMediaGroup':
+            media = params['media']
+            media = json.loads(media) if isinstance(media, str) else media
+            textos = [m.get('caption') or "" for m in media]
+            resultado = [self.mensaje_del_bot(chat_id, photo=foto, caption=t) for t in textos]
+            texto = "\n".join(textos)
+        elif metodo == 'sendPhoto':
+            texto = params.get('caption') or ""
+            resultado = self.mensaje_del_bot(chat_id, photo=foto, caption=texto)
+        else:
+            texto = params.get('text') or ""
+            resultado = self.mensaje_del_bot(chat_id, text=texto)
+
+        if texto.startswith("❌"):
+            self.respuestas_error += 1
+        self.seguimiento.respuesta(chat_id, texto, reply_to)
+        return resultado
+
+class ManejadorApi(BaseHTTPRequestHandler):
+    """/bot<token>/<método> y /file/bot<token>/<ruta> sobre la ApiFalsa del servidor"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, codigo, cuerpo, tipo='application/json'):
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _parametros(self):
+        ruta = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(ruta.query).items()}
+        largo = int(self.headers.get('Content-Length') or 0)
+        if largo:
+            cuerpo = self.rfile.read(largo)
+            tipo = self.headers.get('Content-Type', '')
+            if tipo.startswith('application/json'):
+                params.update(json.loads(cuerpo or b'{}'))
+            elif tipo.startswith('application/x-www-form-urlencoded'):
+                params.update({k: v[-1] for k, v in parse_qs(cuerpo.decode()).items()})
+        return unquote(ruta.path), params   # Las descargas llegan con el ':' del token codificado
+
+    def _atender(self):
+        api = self.server.api
+        ruta, params = self._parametros()
+        partes = ruta.strip('/').split('/')
+
+        if len(partes) >= 3 and partes[0] == 'file' and partes[1] == f"bot{TOKEN_PRUEBA}":
+            datos = api.foto(partes[-1].rsplit('.', 1)[0])
+            api.llamadas['descarga'] += 1
+            if datos is None:
+                self._responder(404, b'')
+            else:
+                self._responder(200, datos, 'image/png')
+            return
+
+        if len(partes) != 2 or partes[0] != f"bot{TOKEN_PRUEBA}":
+            self._responder(404, json.dumps({'ok': False, 'error_code': 404, 'description': "Not Found"}).encode())
+            return
+
+        try:
+            codigo, respuesta = api.llamar(partes[1], params)
+        except (KeyError, ValueError) as e:
+            codigo, respuesta = 400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"}
+        self._responder(codigo, json.dumps(respuesta).encode())
+
+    do_GET = _atender
+    do_POST = _atender
+
+def iniciar_api(api):
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ManejadorApi)
+    servidor.daemon_threads = True
+    servidor.api = api
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+# =============================================
+# PERFILES DE TRÁFICO
+# =============================================
+class Trafico:
+    """Genera los updates de cada tipo de evento y los registra en el seguimiento"""
+
+    def __init__(self, api, seguimiento, azar):
+        self.api = api
+        self.seguimiento = seguimiento
+        self.azar = azar
+        self.mensajes = {}          # chat_id -> último message_id
+        self.modelos = {}           # chat_id -> modelos publicados
+        self.usuarios = 0
+        self.media_groups = 0
+
+    def _mensaje(self, chat_id, usuario, **campos):
+        self.mensajes[chat_id] = self.mensajes.get(chat_id, 0) + 1
+        msg_id = self.mensajes[chat_id]
+        return msg_id, {
+            'message_id': msg_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Grupo {chat_id}"},
+            'from': usuario, **campos
+        }
+
+    def _usuario(self):
+        self.usuarios += 1
+        # Ancho fijo: ningún nombre es prefijo de otro
+        return {'id': 1_000_000 + self.usuarios, 'is_bot': False, 'first_name': f"Invitado{self.usuarios:06d}"}
+
+    def _caption(self, chat_id):
+        modelo = f"{self.azar.choice(MARCAS)} {len(self.modelos.get(chat_id, [])) + 1}"
+        self.modelos.setdefault(chat_id, []).append(modelo)
+        tallas = ", ".join(sorted(self.azar.sample(TALLAS, 2), key=float))
+        return f"{modelo}\n{tallas} - ${self.azar.randrange(60, 300)}"
+
+    def _foto(self, chat_id, msg):
+        return [{'file_id': f"f{chat_id}_{msg}_{n}", 'file_unique_id': f"u{chat_id}_{msg}_{n}",
+                 'width': 90 * (n + 1), 'height': 90 * (n + 1)} for n in range(2)]
+
+    def ingresos(self, chat_id):
+        usuario = self._usuario()
+        msg_id, mensaje = self._mensaje(chat_id, usuario, new_chat_members=[usuario])
+        self.seguimiento.publicar('ingresos', chat_id, msg_id, nombre=usuario['first_name'])
+        self.api.publicar({'message': mensaje})
+
+    def fotos(self, chat_id):
+        admin = {'id': ID_ADMIN, 'is_bot': False, 'first_name': "Admin"}
+        msg_id = self.mensajes.get(chat_id, 0) + 1
+        _, mensaje = self._mensaje(chat_id, admin, photo=self._foto(chat_id, msg_id), caption=self._caption(chat_id))
+        self.seguimiento.publicar('fotos', chat_id, msg_id)
+        self.api.publicar({'message': mensaje})
+
+    def albumes(self, chat_id):
+        admin = {'id': ID_ADMIN, 'is_bot': False, 'first_name': "Admin"}
+        self.media_groups += 1
+        grupo = f"album{self.media_groups}"
+        for n in range(FOTOS_POR_ALBUM):
+            msg_id = self.mensajes.get(chat_id, 0) + 1
+            _, mensaje = self._mensaje(
+                chat_id, admin, photo=self._foto(chat_id, msg_id),
+                caption=self._caption(chat_id), media_group_id=grupo
+            )
+            if n == 0:
+                # El bot responde una sola vez al primer mensaje del álbum
+                self.seguimiento.publicar('albumes', chat_id, msg_id)
+            self.api.publicar({'message': mensaje})
+
+    def _comando(self, chat_id, texto):
+        comando = texto.split()[0]
+        return self._mensaje(
+            chat_id, self._usuario(), text=texto,
+            entities=[{'type': 'bot_command', 'offset': 0, 'length': len(comando)}]
+        )
+
+    def busquedas(self, chat_id):
+        publicados = self.modelos.get(chat_id)
+        if publicados and self.azar.random() < 0.8:
+            consulta = self.azar.choice(publicados).lower()
+        else:
+            consulta = f"modelo inexistente {self.azar.randrange(1000)}"
+        msg_id, mensaje = self._comando(chat_id, f"/buscar {consulta}")
+        self.seguimiento.publicar('busquedas', chat_id, msg_id, consulta=consulta)
+        self.api.publicar({'message': mensaje})
+
+    def precios(self, chat_id):
+        msg_id, mensaje = self._comando(chat_id, "/price")
+        self.seguimiento.publicar('precios', chat_id, msg_id)
+        self.api.publicar({'message': mensaje})
+
+def programar(perfil, escala, azar):
+    """Lista ordenada de (segundo, tipo, chat_id) del perfil"""
+    eventos = []
+    for tipo, cantidad, inicio, duracion in PERFILES[perfil]:
+        for _ in range(max(1, round(cantidad * escala))):
+            eventos.append((inicio + azar.uniform(0, duracion), tipo, azar.choice(GRUPOS)))
+    eventos.sort()
+    return eventos
+
+def reproducir(trafico, eventos):
+    inicio = time.monotonic()
+    for segundo, tipo, chat_id in eventos:
+        espera = inicio + segundo - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        getattr(trafico, tipo)(chat_id)
+    return time.monotonic() - inicio
+
+# =============================================
+# PROCESO DEL BOT
+# =============================================
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def lanzar_bot(puerto_api, directorio, workers, webhook):
+    puerto = puerto_libre()
+    entorno = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=TOKEN_PRUEBA,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{puerto_api}/bot",
+        HOME=directorio,
+        PORT=str(puerto),
+        PYTHONUNBUFFERED='1'
+    )
+    for variable in ('WEBHOOK_URL', 'RENDER_EXTERNAL_URL', 'TELEGRAM_FILE_URL'):
+        entorno.pop(variable, None)
+    if workers > 1:
+        entorno.update(WORKERS=str(workers), ALMACEN_DB='sqlite')
+    if webhook:
+        entorno.update(WEBHOOK_URL=f"http://127.0.0.1:{puerto}", WEBHOOK_SECRET='secreto-de-prueba')
+
+    bitacora = open(os.path.join(directorio, 'bot.log'), 'wb')
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chokolo_bot.py')],
+        env=entorno, stdout=bitacora, stderr=subprocess.STDOUT
+    )
+    return proceso, puerto, bitacora
+
+def errores_handlers(puerto):
+    """Suma de chokolo_handler_errores_total en /metrics del bot (None si no responde)"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{puerto}/metrics", timeout=5) as respuesta:
+            texto = respuesta.read().decode()
+    except (urllib.error.URLError, OSError):
+        return None
+    return sum(
+        float(linea.rsplit(' ', 1)[1]) for linea in texto.splitlines()
+        if linea.startswith('chokolo_handler_errores_total')
+    )
+
+def detener_bot(proceso, espera=20):
+    if proceso.poll() is None:
+        proceso.send_signal(signal.SIGINT)
+        try:
+            proceso.wait(espera)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+            proceso.wait()
+    return proceso.returncode
+
+# =============================================
+# REPORTE
+# =============================================
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+def resumir(eventos, duracion):
+    por_tipo = {}
+    for evento in eventos:
+        por_tipo.setdefault(evento['tipo'], []).append(evento)
+
+    resultados = {}
+    for tipo, lista in por_tipo.items():
+        latencias = sorted(
+            (e['respondido'] - e['publicado']) * 1000 for e in lista if e['respondido'] is not None
+        )
+        resultados[tipo] = {
+            'enviados': len(lista),
+            'respondidos': len(latencias),
+            'sin_respuesta': len(lista) - len(latencias),
+            'tasa_sin_respuesta': round(1 - len(latencias) / len(lista), 4),
+            'p50_ms': percentil(latencias, 50),
+            'p90_ms': percentil(latencias, 90),
+            'p99_ms': percentil(latencias, 99),
+            'max_ms': latencias[-1] if latencias else None,
+        }
+    return resultados
+
+def imprimir_tabla(reporte):
+    formato = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+    print(f"\n📊 Perfil {reporte['perfil']} ({reporte['modo']})", file=sys.stderr)
+    print(f"{'evento':<12}{'enviados':>10}{'resp.':>8}{'sin resp.':>10}"
+          f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}", file=sys.stderr)
+    for tipo, r in reporte['eventos'].items():
+        print(
+            f"{tipo:<12}{r['enviados']:>10}{r['respondidos']:>8}{r['sin_respuesta']:>10}"
+            f"{formato(r['p50_ms'])}{formato(r['p90_ms'])}{formato(r['p99_ms'])}{formato(r['max_ms'])}",
+            file=sys.stderr
+        )
+    t = reporte['throughput']
+    print(
+        f"\n⏱️ {t['updates']} updates en {t['duracion_s']:.1f} s · "
+        f"{t['updates_por_segundo']:.1f} updates/s · {t['respuestas_por_segundo']:.1f} respuestas/s",
+        file=sys.stderr
+    )
+    e = reporte['errores']
+    print(
+        f"⚠️ 429 inyectados: {e['429_inyectados']} · respuestas ❌: {e['respuestas_error']} · "
+        f"errores en handlers: {e['handlers']} · código de salida: {e['codigo_salida']}",
+        file=sys.stderr
+    )
+
+# =============================================
+# EJECUCIÓN
+# =============================================
+def ejecutar(args):
+    azar = random.Random(args.semilla)
+    seguimiento = Seguimiento()
+    api = ApiFalsa(
+        seguimiento, args.latencia_ms / 1000, args.jitter_ms / 1000,
+        args.tasa_429, args.retry_after, random.Random(args.semilla + 1)
+    )
+    servidor = iniciar_api(api)
+    directorio = tempfile.mkdtemp(prefix="chokolo_carga_")
+    proceso, puerto_bot, bitacora = lanzar_bot(servidor.server_address[1], directorio, args.workers, args.webhook)
+    logger.info(f"Bot lanzado (pid {proceso.pid}), bitácora en {directorio}/bot.log")
+
+    try:
+        if not api.listo.wait(args.arranque):
+            raise RuntimeError(f"El bot no se conectó a la API falsa en {args.arranque} s")
+        time.sleep(1)   # Que el receptor (webhook o polling) quede escuchando
+
+        eventos = programar(args.perfil, args.escala, azar)
+        logger.info(f"Reproduciendo {len(eventos)} eventos del perfil '{args.perfil}'")
+        inicio = time.monotonic()
+        reproduccion = reproducir(Trafico(api, seguimiento, azar), eventos)
+
+        # Esperar las respuestas mientras sigan llegando
+        while seguimiento.pendientes() and proceso.poll() is None:
+            if time.monotonic() - seguimiento.ultimo_progreso > args.espera:
+                logger.warning(f"{seguimiento.pendientes()} eventos sin respuesta tras {args.espera} s sin progreso")
+                break
+            time.sleep(0.2)
+        ultima = max((e['respondido'] for e in seguimiento.eventos if e['respondido']), default=time.monotonic())
+        duracion = max(ultima - inicio, 1e-9)
+        errores = errores_handlers(puerto_bot)
+    finally:
+        api.cerrar()
+        codigo = detener_bot(proceso)
+        bitacora.close()
+        servidor.shutdown()
+
+    return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'perfil': args.perfil,
+        'modo': f"{'webhook' if args.webhook else 'polling'}, {args.workers} worker(s)",
+        'parametros': {
+            'escala': args.escala, 'latencia_ms': args.latencia_ms, 'jitter_ms': args.jitter_ms,
+            'tasa_429': args.tasa_429, 'retry_after': args.retry_after, 'semilla': args.semilla
+        },
+        'eventos': resumir(seguimiento.eventos, duracion),
+        'throughput': {
+            'updates': api.publicados,
+            'reproduccion_s': round(reproduccion, 3),
+            'duracion_s': round(duracion, 3),
+            'updates_por_segundo': round(api.publicados / max(reproduccion, 1e-9), 2),
+            'respuestas_por_segundo': round(seguimiento.respondidos / duracion, 2),
+        },
+        'llamadas_api': dict(api.llamadas),
+        'errores': {
+            '429_inyectados': api.limitados,
+            'respuestas_error': api.respuestas_error,
+            'handlers': errores,
+            'codigo_salida': codigo,
+        },
+        'bitacora': os.path.join(directorio, 'bot.log'),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de punta a punta de Chokolo Bot")
+    parser.add_argument('--perfil', choices=sorted(PERFILES), default='mixto')
+    parser.add_argument('--escala', type=float, default=1.0, help="Multiplica la cantidad de eventos del perfil")
+    parser.add_argument('--latencia-ms', type=float, default=30, help="Latencia de cada llamada a la API falsa")
+    parser.add_argument('--jitter-ms', type=float, default=20, help="Variación aleatoria sumada a la latencia")
+    parser.add_argument('--tasa-429', type=float, default=0.0,
+                        help="Fracción de envíos que reciben 429 Too Many Requests")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after de las respuestas 429 (s)")
+    parser.add_argument('--workers', type=int, default=1, help="Procesos worker del bot (usa SQLite)")
+    parser.add_argument('--webhook', action='store_true', help="Entregar los updates por webhook en vez de polling")
+    parser.add_argument('--arranque', type=float, default=60, help="Segundos máximos para que el bot arranque")
+    parser.add_argument('--espera', type=float, default=30,
+                        help="Segundos sin respuestas nuevas antes de dar por perdidos los pendientes")
+    parser.add_argument('--semilla', type=int, default=1234)
+    parser.add_argument('--salida', help="Archivo JSON del reporte (por defecto a stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    reporte = ejecutar(args)
+    imprimir_tabla(reporte)
+
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+        print(f"\n💾 Reporte guardado en {args.salida}", file=sys.stderr)
+    else:
+        print(texto)
+
+if __name__ == '__main__':
+    main()